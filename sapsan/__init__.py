@@ -1,11 +1,30 @@
 from ._version import __version__
-from .lib.estimator.krr.krr_estimator import KRR, KRRConfig
-from .lib.estimator.cnn.cnn3d_estimator import CNN3d, CNN3dConfig
-from .lib.estimator.picae.picae_estimator import PICAE, PICAEConfig
-from .lib.estimator.torch_backend import load_estimator, TorchBackend
-from .lib.estimator.sklearn_backend import load_sklearn_estimator, SklearnBackend
-from .lib.experiments.evaluate import Evaluate
-from .lib.experiments.train import Train
-from .utils.plot import pdf_plot, cdf_plot, slice_plot, line_plot, model_graph
-from .utils.physics import PowerSpectrum, GradientModel
-from .utils.filters import spectral, box, gaussian
+from ._lazy import lazy_exports
+
+#the estimators, experiments and utils are imported on first use
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'KRR': '.lib.estimator.krr.krr_estimator',
+    'KRRConfig': '.lib.estimator.krr.krr_estimator',
+    'Incremental': '.lib.estimator.incremental.incremental_estimator',
+    'IncrementalConfig': '.lib.estimator.incremental.incremental_estimator',
+    'CNN3d': '.lib.estimator.cnn.cnn3d_estimator',
+    'CNN3dConfig': '.lib.estimator.cnn.cnn3d_estimator',
+    'PICAE': '.lib.estimator.picae.picae_estimator',
+    'PICAEConfig': '.lib.estimator.picae.picae_estimator',
+    'load_estimator': '.lib.estimator.torch_backend',
+    'TorchBackend': '.lib.estimator.torch_backend',
+    'load_sklearn_estimator': '.lib.estimator.sklearn_backend',
+    'SklearnBackend': '.lib.estimator.sklearn_backend',
+    'Evaluate': '.lib.experiments.evaluate',
+    'Train': '.lib.experiments.train',
+    'pdf_plot': '.utils.plot',
+    'cdf_plot': '.utils.plot',
+    'slice_plot': '.utils.plot',
+    'line_plot': '.utils.plot',
+    'model_graph': '.utils.plot',
+    'PowerSpectrum': '.utils.physics',
+    'GradientModel': '.utils.physics',
+    'spectral': '.utils.filters',
+    'box': '.utils.filters',
+    'gaussian': '.utils.filters',
+})
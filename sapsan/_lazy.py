@@ -0,0 +1,33 @@
+"""
+Lazy exports of the sapsan packages
+
+The public names of a package are imported from their modules only on
+first access (PEP 562 module __getattr__), so `import sapsan` doesn't pay
+for torch, catalyst, sklearn, matplotlib, mlflow etc. until they are used.
+
+Usage, in a package __init__.py:
+    __getattr__, __dir__, __all__ = lazy_exports(__name__, {'Train': '.lib.experiments.train'})
+"""
+
+import sys
+import importlib
+
+
+def lazy_exports(package: str, exports: dict):
+    """
+    @param package: __name__ of the package
+    @param exports: {name: module to import it from, relative to the package}
+    @return: module-level __getattr__, __dir__, and __all__ of the package
+    """
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError("module '%s' has no attribute '%s'"%(package, name))
+        value = getattr(importlib.import_module(exports[name], package), name)
+        #cache it, so that __getattr__ is called once per name
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(exports))
+
+    return __getattr__, __dir__, list(exports)
@@ -1,8 +1,6 @@
 import os
+import sys
 import click
-import jupytext
-import nbformat
-import pytest
 import shutil
 
 from sapsan._version import __version__
@@ -27,6 +25,8 @@ def create_init(path: str):
         file.write("")
 
 def setup_project(name: str, ddp: bool):
+    import jupytext
+    import nbformat
     click.echo("Created...")
     os.mkdir(name)
     click.echo("Project Folder:             {name}/".format(name=name))
@@ -61,6 +61,8 @@ def setup_project(name: str, ddp: bool):
     
 
 def setup_package(name: str):
+    import jupytext
+    import nbformat
     os.mkdir(name)
     os.mkdir('./{name}/.github'.format(name=name))
     os.mkdir('./{name}/.github/workflows'.format(name=name))
@@ -171,8 +173,102 @@ def create(name, ddp):
 #    click.echo("========================================================")  
 #    setup_package(name=name.lower())
     
+@sapsan.command("train", context_settings=dict(ignore_unknown_options=True),
+                help="Runs a training script in N Distributed Data Parallel (DDP) processes, e.g. one per group of CPU cores. "
+                     "Equivalent to 'torchrun --standalone --nproc_per_node N script.py'")
+@click.option('--nproc', '-n', default=1, show_default=True, help="number of processes to launch")
+@click.argument('script', type=click.Path(exists=True))
+@click.argument('script_args', nargs=-1, type=click.UNPROCESSED)
+def train(nproc, script, script_args):
+    args = ['--nproc_per_node', str(nproc), script, *script_args]
+    try:
+        from torch.distributed.run import main as torchrun
+        torchrun(['--standalone', *args])
+    except ImportError:
+        #torch<1.9 has no torchrun: use the legacy launcher
+        from torch.distributed.launch import main as launch
+        launch(['--use_env', *args])
+
+@sapsan.command("benchmark", help="Times the Sapsan hot paths on synthetic fields and saves the results as JSON. "
+                                   "With a baseline, exits with an error if any case got slower than the threshold")
+@click.option('--sizes', '-s', default='32,64', show_default=True, help="comma-separated edge sizes of the synthetic fields, multiples of 16")
+@click.option('--cases', '-c', default=None, help="comma-separated names or glob patterns of the cases to run, all by default")
+@click.option('--repeat', '-r', default=5, show_default=True, help="number of timed runs of every case")
+@click.option('--warmup', '-w', default=1, show_default=True, help="number of untimed runs before the timed ones")
+@click.option('--output', '-o', default='benchmark.json', show_default=True, help="JSON file to save the results to")
+@click.option('--baseline', '-b', default=None, type=click.Path(exists=True), help="JSON results to compare against")
+@click.option('--threshold', '-t', default=0.2, show_default=True, help="allowed slowdown of the median relative to the baseline")
+@click.option('--list', 'list_cases', is_flag=True, help="list the benchmark cases and exit")
+def benchmark(sizes, cases, repeat, warmup, output, baseline, threshold, list_cases):
+    from sapsan.utils.benchmark import BENCHMARKS, run_benchmarks, save_results, load_results, compare
+    
+    if list_cases:
+        for name in BENCHMARKS: click.echo(name)
+        return
+    
+    sizes = [int(size) for size in sizes.split(',')]
+    if cases != None: cases = [case.strip() for case in cases.split(',')]
+    results = run_benchmarks(sizes = sizes, cases = cases, repeat = repeat, warmup = warmup)
+    save_results(results, output)
+    click.echo("Results saved to %s"%output)
+    
+    if baseline != None:
+        regressions = compare(results, load_results(baseline), threshold = threshold)
+        if regressions:
+            click.echo("Regressions against %s (threshold %d%%):"%(baseline, threshold*100))
+            for key, reference, median, ratio in regressions:
+                click.echo("  %-32s %.4e -> %.4e sec (x%.2f)"%(key, reference, median, ratio))
+            sys.exit(1)
+        click.echo("No regressions against %s"%baseline)
+        
+@sapsan.command("preprocess", help="Computes the filtered features, their gradients and the stress tensor 'tn' "
+                                    "from raw snapshots slab by slab in a process pool, and writes them as chunked HDF5 "
+                                    "ready for HDF5Dataset. INPUT_PATH and OUTPUT_PATH are templates with {checkpoint} "
+                                    "and {feature}, e.g. 'raw/t{checkpoint:1.0f}/{feature}.h5'")
+@click.argument('input_path')
+@click.argument('output_path')
+@click.option('--checkpoints', '-c', default='0', show_default=True, help="comma-separated checkpoints to preprocess")
+@click.option('--features', '-f', default='u', show_default=True, help="comma-separated raw features to filter")
+@click.option('--features-label', default=None, help="comma-separated dataset names in the input files, the last dataset by default")
+@click.option('--filt-size', default=2.0, show_default=True, help="sigma of the gaussian filter")
+@click.option('--truncate', default=4.0, show_default=True, help="truncate the filter at this many sigmas")
+@click.option('--gradients/--no-gradients', default=True, show_default=True, help="write the gradients of the filtered features")
+@click.option('--tensor', default='u', show_default=True, help="feature to compute the stress tensor of, 'none' to skip it")
+@click.option('--only-x-components', is_flag=True, help="compute only the tn[0] components of the stress tensor")
+@click.option('--factor', default=1, show_default=True, help="downsample the results by taking every factor-th point")
+@click.option('--axis', default=3, show_default=True, help="number of spatial axes")
+@click.option('--periodic/--no-periodic', default=False, show_default=True, help="periodic boundaries")
+@click.option('--time-granularity', default=1.0, show_default=True, help="checkpoint to time conversion of the paths")
+@click.option('--nproc', '-n', default=1, show_default=True, help="number of processes computing the slabs")
+@click.option('--slab-size', default=None, type=int, help="thickness of a slab in grid points, ~256MB of input by default")
+@click.option('--chunk-size', default=32, show_default=True, help="edge of the HDF5 chunks of the outputs")
+def preprocess(input_path, output_path, checkpoints, features, features_label, filt_size, truncate, gradients,
+               tensor, only_x_components, factor, axis, periodic, time_granularity, nproc, slab_size, chunk_size):
+    from sapsan.lib.data.preprocess import Preprocessor
+
+    features = [feature.strip() for feature in features.split(',')]
+    if features_label != None: features_label = [label.strip() for label in features_label.split(',')]
+    preprocessor = Preprocessor(features = features,
+                                features_label = features_label,
+                                filt_size = filt_size,
+                                truncate = truncate,
+                                gradients = gradients,
+                                tensor = None if tensor.lower() == 'none' else tensor,
+                                only_x_components = only_x_components,
+                                factor = factor,
+                                axis = axis,
+                                periodic = periodic,
+                                nproc = nproc,
+                                slab_size = slab_size,
+                                chunk_size = chunk_size)
+    paths = preprocessor.build(input_path, output_path,
+                               checkpoints = [float(checkpoint) for checkpoint in checkpoints.split(',')],
+                               time_granularity = time_granularity)
+    for path in paths: click.echo("Saved %s"%path)
+
 @sapsan.command("test", help="Run tests to check if everything is working correctly")
 def test():
+    import pytest
     pytest.main(__path__)
     
 @sapsan.command("get_examples", help="Copy examples to your working directory")    
@@ -80,9 +80,10 @@ class ExperimentBackend(ABC):
     """ Backend of experiment. """
     def __init__(self, name: str = 'None'):
         self.name = name
+        self.listeners = []
 
     @abstractmethod
-    def log_metric(self, name: str, value: float):
+    def log_metric(self, name: str, value: float, step: int = None):
         pass
 
     @abstractmethod
@@ -93,6 +94,19 @@ class ExperimentBackend(ABC):
     def log_artifact(self, path: str):
         pass
 
+    def subscribe(self, listener):
+        """
+        Calls listener(name, value, step) for every metric streamed while
+        training, e.g. to draw the progress in the GUI
+        """
+        if not hasattr(self, 'listeners'): self.listeners = []
+        self.listeners.append(listener)
+
+    def stream_metric(self, name: str, value: float, step: int):
+        #logs a metric of a running experiment and passes it to the subscribers
+        self.log_metric(name, value, step)
+        for listener in getattr(self, 'listeners', []): listener(name, value, step)
+
 
 class Experiment(ABC):
     """ Abstract class for sapsan experiments """
@@ -154,6 +168,10 @@ class Sampling(ABC):
     def sample_dim(self):
         pass
 
+    def read(self, dataset):
+        #samples an h5py dataset; override to avoid reading all of it
+        return self.sample(dataset[()])
+
 
 class Shaper(ABC):
     @abstractmethod
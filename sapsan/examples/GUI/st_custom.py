@@ -20,8 +20,6 @@ import configparser
 import webbrowser
 import time
 import numpy as np
-from threading import Thread
-from streamlit.report_thread import add_report_ctx
 import json
 from collections import OrderedDict
 import plotly.express as px
@@ -109,66 +107,30 @@ def custom():
         value = list([int(i) for i in value.split(',')])
         return value
         
-    #show loss vs epoch progress with plotly
+    #show loss vs epoch progress with plotly, as the epochs are streamed by the backend
     def show_log(progress_slot, epoch_slot):
-        from datetime import datetime
-        
-        #log_path = 'logs/checkpoints/_metrics.json'
-        log_path = 'logs/log.txt'
-        log_exists = False
-        while log_exists == False:
-            if os.path.exists(log_path):
-                log_exists = True
-            
-            time.sleep(0.1)
-        
-        first_entry = False
-        while first_entry == False:
-            with open(log_path) as file:
-                if len(list(file))>=4: 
-                    first_entry = True
-            time.sleep(0.05)
-            
         plot_data = {'epoch':[], 'train_loss':[]}
-        last_epoch = 0
-        running = True
-        
-        start_time= datetime.now()
-        while running:
-            with open(log_path) as file:
-                #get the date of the latest event
-                lines = list(file)
-                
-                current_epoch = int(lines[-2].split('/')[0])
-                train_loss = float(lines[-2].split('loss=')[-1])
-                valid_loss = float(lines[-1].split('loss=')[-1])
-                                
-            if current_epoch == last_epoch:
-                pass
-            else:     
-                metrics = {'train_loss':train_loss, 'valid_loss':valid_loss}
-                epoch_slot.markdown('Epoch:$~$**%d** $~~~~~$ Train Loss:$~$**%.4e**'%(current_epoch, metrics['train_loss']))
-                plot_data['epoch'] = np.append(plot_data['epoch'], current_epoch)
-                plot_data['train_loss'] = np.append(plot_data['train_loss'], metrics['train_loss'])                
-                df = pd.DataFrame(plot_data)
-                
-                if len(plot_data['epoch']) == 1:
-                    plotting_routine = px.scatter
-                else:
-                    plotting_routine = px.line
+        
+        def listener(name, value, step):
+            if name != 'train - loss': return
+            
+            epoch_slot.markdown('Epoch:$~$**%d** $~~~~~$ Train Loss:$~$**%.4e**'%(step, value))
+            plot_data['epoch'].append(step)
+            plot_data['train_loss'].append(value)
+            df = pd.DataFrame(plot_data)
                 
-                fig = plotting_routine(df, x="epoch", y="train_loss", log_y=True,
-                              title='Training Progress', width=700, height=400)
-                fig.update_layout(yaxis=dict(exponentformat='e'))
-                fig.layout.hovermode = 'x'
-                progress_slot.plotly_chart(fig)
+            if len(plot_data['epoch']) == 1:
+                plotting_routine = px.scatter
+            else:
+                plotting_routine = px.line
                 
-                last_epoch = current_epoch
-
-            if current_epoch == widget_values['n_epochs']: 
-                return
-                        
-            time.sleep(0.1) 
+            fig = plotting_routine(df, x="epoch", y="train_loss", log_y=True,
+                          title='Training Progress', width=700, height=400)
+            fig.update_layout(yaxis=dict(exponentformat='e'))
+            fig.layout.hovermode = 'x'
+            progress_slot.plotly_chart(fig)
+            
+        return listener
             
     def load_data(checkpoints):
         #Load the data      
@@ -220,9 +182,7 @@ def custom():
         progress_slot = st.empty()
         epoch_slot = st.empty()
         
-        thread = Thread(target=show_log, args=(progress_slot, epoch_slot))
-        add_report_ctx(thread)
-        thread.start()
+        tracking_backend.subscribe(show_log(progress_slot, epoch_slot))
         
         start = time.time()
         #Train the model
@@ -15,13 +15,11 @@ import plotly.express as px
 import configparser
 import webbrowser
 from io import BytesIO
-from threading import Thread
 #from st_state_patch import SessionState
 #from multiprocessing import Process
 
 import torch
 import streamlit as st
-from streamlit.report_thread import add_report_ctx
 
 #uncomment if cloned from github!
 sys.path.append(str(Path.home())+"/Sapsan/")
@@ -151,58 +149,30 @@ def cnn3d():
         value = list([int(i) for i in value.split(',')])
         return value
         
-    #show loss vs epoch progress with plotly
+    #show loss vs epoch progress with plotly, as the epochs are streamed by the backend
     def show_log(progress_slot, epoch_slot):        
-        log_path = 'logs/logs/train.csv'
-        
-        if os.path.exists(log_path):
-            os.remove(log_path)
-            
-        log_exists = False            
-        while log_exists == False:            
-            if os.path.exists(log_path):
-                log_exists = True            
-            time.sleep(0.1)
-            
         plot_data = {'epoch':[], 'train_loss':[]}
-        last_epoch = 0
-        running = True
         
-        while running:
-            data = np.genfromtxt(log_path, delimiter=',', 
-                                 skip_header=1, dtype=np.float32)
-
-            if len(data.shape)==1: data = np.array([data])
-
-            current_epoch = data[-1, 0]
-            train_loss = data[-1, 1]
+        def listener(name, value, step):
+            if name != 'train - loss': return
             
-            if current_epoch == last_epoch:
-                pass
-            else:     
-                epoch_slot.markdown('Epoch:$~$**%d** $~~~~~$ Train Loss:$~$**%.4e**'%(current_epoch, train_loss))
-                plot_data['epoch'] = data[:, 0]
-                plot_data['train_loss'] = data[:, 1]
-                df = pd.DataFrame(plot_data)
+            epoch_slot.markdown('Epoch:$~$**%d** $~~~~~$ Train Loss:$~$**%.4e**'%(step, value))
+            plot_data['epoch'].append(step)
+            plot_data['train_loss'].append(value)
+            df = pd.DataFrame(plot_data)
                 
-                if len(plot_data['epoch']) == 1:
-                    plotting_routine = px.scatter
-                else:
-                    plotting_routine = px.line
-                
-                fig = plotting_routine(df, x="epoch", y="train_loss", log_y=True,
-                              title='Training Progress', width=700, height=400)
-                fig.update_layout(yaxis=dict(exponentformat='e'))
-                fig.layout.hovermode = 'x'
-                progress_slot.plotly_chart(fig)
+            if len(plot_data['epoch']) == 1:
+                plotting_routine = px.scatter
+            else:
+                plotting_routine = px.line
                 
-                last_epoch = current_epoch
-
-            if current_epoch == widget_values['n_epochs']: 
-                return
-                        
+            fig = plotting_routine(df, x="epoch", y="train_loss", log_y=True,
+                          title='Training Progress', width=700, height=400)
+            fig.update_layout(yaxis=dict(exponentformat='e'))
+            fig.layout.hovermode = 'x'
+            progress_slot.plotly_chart(fig)
             
-            time.sleep(0.1) 
+        return listener
 
     def plot_static():
         buf = BytesIO()
@@ -263,9 +233,7 @@ def cnn3d():
         progress_slot = st.empty()
         epoch_slot = st.empty()
         
-        thread = Thread(target=show_log, args=(progress_slot, epoch_slot))
-        add_report_ctx(thread)
-        thread.start()
+        tracking_backend.subscribe(show_log(progress_slot, epoch_slot))
         
         start = time.time()
         #Train the model
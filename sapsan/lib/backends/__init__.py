@@ -1,2 +1,7 @@
-from .fake import FakeBackend
-from .mlflow import MLflowBackend
+from sapsan._lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'FakeBackend': '.fake',
+    'MLflowBackend': '.mlflow',
+    'LocalBackend': '.local',
+})
@@ -16,11 +16,12 @@ class FakeBackend(ExperimentBackend):
     def log_artifact(self, path: str):
         logging.info("Logging artifact {path}".format(path=path))
 
-    def log_metric(self, name: str, value: float):
+    def log_metric(self, name: str, value: float, step: int = None):
         logging.info("Logging experiment '{experiment}' metric "
-                     "{name}: {value}".format(experiment=self.name,
-                                              name=name,
-                                              value=value))
+                     "{name}: {value}{step}".format(experiment=self.name,
+                                                    name=name,
+                                                    value=value,
+                                                    step='' if step==None else ' (step %d)'%step))
     def close_active_run(self):
         pass
     
@@ -0,0 +1,172 @@
+"""
+Local file-based tracking backend
+
+Needs no server: every run is appended to files in a local directory,
+so it works offline on compute nodes and costs nothing to start.
+
+    {path}/{experiment}/runs.jsonl     - one record per run start and end
+    {path}/{experiment}/params.jsonl   - parameters
+    {path}/{experiment}/metrics.jsonl  - metrics with their step and timestamp
+    {path}/{experiment}/artifacts/{run_id}/
+
+The files are append-only JSON lines. With storage='parquet' (needs pyarrow)
+the params & metrics of every run are written as a columnar Parquet file
+per run at the end of the run instead.
+
+Usage:
+    tracking_backend = LocalBackend('experiment', path='./sapsan_runs')
+    ...
+    tracking_backend.compare()     #params & final metrics of all runs
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import pandas as pd
+
+from sapsan.core.models import ExperimentBackend
+from sapsan.utils.distributed import is_main_process
+
+
+class LocalBackend(ExperimentBackend):
+    def __init__(self, name: str = 'experiment',
+                       path: str = './sapsan_runs',
+                       storage: str = 'jsonl'):
+        """
+        @param path: directory to keep the experiments in
+        @param storage: 'jsonl' (appended on every call) or 'parquet' (written per run)
+        """
+        super().__init__(name)
+        if storage not in ['jsonl', 'parquet']:
+            raise ValueError("storage can be either 'jsonl' or 'parquet', but recieved '%s'"%storage)
+        if storage == 'parquet':
+            try: import pyarrow
+            except ImportError: raise ImportError("storage='parquet' requires pyarrow: pip install pyarrow")
+
+        self.path = os.path.join(path, name)
+        self.storage = storage
+        #stack of the active runs: [run_id, run_name, params, metrics]
+        self.runs = []
+        #in DDP runs only rank 0 writes
+        self.active = is_main_process()
+
+    def start(self, run_name: str, nested = False):
+        if not self.active: return
+        if not nested: self.close_active_run()
+        run_id = uuid.uuid4().hex
+        parent = self.runs[-1][0] if self.runs else None
+        self.runs.append([run_id, run_name, [], []])
+        self._append('runs', dict(run_id=run_id, run_name=run_name, parent=parent,
+                                  event='start', timestamp=time.time()))
+
+    def log_metric(self, name: str, value: float, step: int = None):
+        if not self.active: return
+        self._log('metrics', dict(key=name, value=float(value), step=step or 0, timestamp=time.time()))
+
+    def log_parameter(self, name: str, value: str):
+        if not self.active: return
+        self._log('params', dict(key=name, value=str(value)))
+
+    def log_artifact(self, path: str):
+        if not self.active: return
+        run_id = self._active_run()[0]
+        artifacts = os.path.join(self.path, 'artifacts', run_id)
+        os.makedirs(artifacts, exist_ok=True)
+        shutil.copy2(path, artifacts)
+
+    def close_active_run(self):
+        if not self.active: return
+        while self.runs: self.end()
+
+    def end(self):
+        if not self.active or not self.runs: return
+        run_id, run_name, params, metrics = self.runs.pop()
+        if self.storage == 'parquet':
+            for kind, records in [('params', params), ('metrics', metrics)]:
+                if not records: continue
+                os.makedirs(os.path.join(self.path, kind), exist_ok=True)
+                pd.DataFrame(records).to_parquet(os.path.join(self.path, kind, '%s.parquet'%run_id))
+        self._append('runs', dict(run_id=run_id, run_name=run_name, event='end', timestamp=time.time()))
+
+    def _active_run(self):
+        #logging outside of a run starts one, as in mlflow
+        if not self.runs: self.start('run')
+        return self.runs[-1]
+
+    def _log(self, kind, record):
+        run = self._active_run()
+        record = dict(run_id=run[0], **record)
+        if self.storage == 'parquet': run[2 if kind=='params' else 3].append(record)
+        else: self._append(kind, record)
+
+    def _append(self, kind, record):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '%s.jsonl'%kind), 'a') as file:
+            file.write(json.dumps(record)+'\n')
+
+    #---- query API ----
+
+    def read(self, kind: str):
+        """
+        All records of 'runs', 'params' or 'metrics' as a DataFrame
+        """
+        frames = []
+        jsonl = os.path.join(self.path, '%s.jsonl'%kind)
+        if os.path.exists(jsonl): frames.append(pd.read_json(jsonl, lines=True, dtype=False))
+        parquet = os.path.join(self.path, kind)
+        if os.path.isdir(parquet):
+            frames += [pd.read_parquet(os.path.join(parquet, file))
+                       for file in sorted(os.listdir(parquet)) if file.endswith('.parquet')]
+        if not frames: return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def list_runs(self):
+        """
+        Runs with their name, parent run, start & end time, and duration
+        """
+        events = self.read('runs')
+        if events.empty: return events
+        starts = events[events['event']=='start'].set_index('run_id')
+        ends = events[events['event']=='end'].set_index('run_id')
+        runs = starts[['run_name', 'parent']].copy()
+        runs['start'] = pd.to_datetime(starts['timestamp'], unit='s')
+        runs['end'] = pd.to_datetime(ends['timestamp'].reindex(runs.index), unit='s')
+        runs['duration'] = ends['timestamp'].reindex(runs.index) - starts['timestamp']
+        return runs
+
+    def get_metrics(self, run_ids = None, keys = None):
+        """
+        Metric history (run_id, key, value, step, timestamp) of the selected runs & keys
+        """
+        metrics = self.read('metrics')
+        if metrics.empty: return metrics
+        if run_ids != None: metrics = metrics[metrics['run_id'].isin(run_ids)]
+        if keys != None: metrics = metrics[metrics['key'].isin(keys)]
+        return metrics.sort_values(['run_id', 'key', 'step', 'timestamp'])
+
+    def compare(self, run_ids = None, metrics = None, params = None):
+        """
+        Table of runs (rows) with their parameters and the last value of
+        every metric (columns); only the parameters that differ between
+        the runs are shown unless 'params' are selected
+        """
+        runs = self.list_runs()
+        if runs.empty: return runs
+        if run_ids != None: runs = runs.loc[[run for run in run_ids if run in runs.index]]
+
+        table = runs[['run_name']]
+        logged = self.read('params')
+        if not logged.empty:
+            logged = logged[logged['run_id'].isin(runs.index)]
+            logged = logged.drop_duplicates(['run_id', 'key'], keep='last').pivot(index='run_id', columns='key', values='value')
+            if params != None: logged = logged[[key for key in params if key in logged.columns]]
+            elif len(logged) > 1: logged = logged.loc[:, logged.nunique(dropna=False) > 1]
+            table = table.join(logged)
+
+        history = self.get_metrics(list(runs.index), metrics)
+        if not history.empty:
+            last = history.groupby(['run_id', 'key'])['value'].last().unstack('key')
+            table = table.join(last)
+        return table
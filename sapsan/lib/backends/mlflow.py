@@ -1,51 +1,159 @@
+"""
+MLflow tracking backend
+
+Metrics, parameters and artifacts are not sent to the server one call
+at a time: they are put in a bounded queue and sent by a background
+thread in batches (MlflowClient.log_batch), so logging doesn't block
+the experiment. The queue is flushed on end() and close_active_run(),
+or explicitly with flush().
+
+Usage:
+    tracking_backend = MLflowBackend('experiment', host='localhost', port=9000)
+"""
+
 import mlflow
+from mlflow.tracking import MlflowClient
+from mlflow.entities import Metric, Param
 from threading import Thread
+import queue
+import tempfile
+import shutil
+import atexit
 import os
 import time
 
 from sapsan.core.models import ExperimentBackend
+from sapsan.utils.distributed import is_main_process
+
+#limits of a single MLflow log_batch request
+MAX_BATCH_METRICS = 1000
+MAX_BATCH_PARAMS = 100
 
 
 class MLflowBackend(ExperimentBackend):
     def __init__(self, name: str = 'experiment',
-                       host: str = 'localhost', 
-                       port: int = 9000):
+                       host: str = 'localhost',
+                       port: int = 9000,
+                       tracking_uri: str = None,
+                       queue_size: int = 10000):
+        """
+        @param tracking_uri: MLflow tracking URI (e.g. a local 'file:' store);
+                             by default the ui at http://host:port, started if not running
+        @param queue_size: max number of entries waiting to be sent; logging
+                           blocks when the queue is full
+        """
         super().__init__(name)
         self.host = host
         self.port = port
-        
+
         self.mlflow_url = "http://{host}:{port}".format(host=host,
                                                         port=port)
-        mlflow.set_tracking_uri(self.mlflow_url)
-        try:
-            self.experiment_id = mlflow.set_experiment(name)
-            print("mlflow ui is already running at %s:%s"%(self.host, self.port))
-        except: 
-            print("starting mlflow ui, please wait ...")
-            self.start_ui()
+        #in DDP runs only rank 0 talks to the server, on the other ranks
+        #every method is a no-op (Train & Evaluate also log from rank 0 only)
+        self.active = is_main_process()
+        if not self.active: return
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.worker = None
+        self.staging_dir = None
+
+        if tracking_uri != None:
+            mlflow.set_tracking_uri(tracking_uri)
             self.experiment_id = mlflow.set_experiment(name)
-            print("mlflow ui is running at %s:%s"%(self.host, self.port))
-    
+        else:
+            mlflow.set_tracking_uri(self.mlflow_url)
+            try:
+                self.experiment_id = mlflow.set_experiment(name)
+                print("mlflow ui is already running at %s:%s"%(self.host, self.port))
+            except:
+                print("starting mlflow ui, please wait ...")
+                self.start_ui()
+                self.experiment_id = mlflow.set_experiment(name)
+                print("mlflow ui is running at %s:%s"%(self.host, self.port))
+        self.client = MlflowClient(mlflow.get_tracking_uri())
+
     def start_ui(self):
         mlflow_thread = Thread(target=
                        os.system("mlflow ui --host %s --port %s &"%(self.host, self.port)))
         mlflow_thread.start()
         time.sleep(5)
-        
+
     def start(self, run_name: str, nested = False):
-        mlflow.start_run(run_name = run_name, nested = nested)        
-        
-    def log_metric(self, name: str, value: float):
-        mlflow.log_metric(name, value)
+        if not self.active: return
+        mlflow.start_run(run_name = run_name, nested = nested)
 
-    def log_parameter(self, name: str, value: str):        
-        mlflow.log_param(name, value)
+    def log_metric(self, name: str, value: float, step: int = None):
+        if not self.active: return
+        self._put('metric', Metric(name, float(value), int(time.time()*1000), step or 0))
+
+    def log_parameter(self, name: str, value: str):
+        if not self.active: return
+        self._put('param', Param(name, str(value)))
 
     def log_artifact(self, path: str):
-        mlflow.log_artifact(path)
+        if not self.active: return
+        #the experiments remove their artifacts right after logging them,
+        #so the upload gets a copy of the file
+        if self.staging_dir == None: self.staging_dir = tempfile.mkdtemp(prefix='sapsan_mlflow_')
+        staged = os.path.join(tempfile.mkdtemp(dir=self.staging_dir), os.path.basename(path))
+        shutil.copy2(path, staged)
+        self._put('artifact', staged)
+
+    def flush(self):
+        #blocks until everything logged so far is sent
+        if not self.active or self.worker == None: return
+        self.queue.join()
 
     def close_active_run(self):
+        if not self.active: return
+        self.flush()
         if mlflow.active_run()!=None: mlflow.end_run()
-        
+
     def end(self):
-        mlflow.end_run()
\ No newline at end of file
+        if not self.active: return
+        self.flush()
+        mlflow.end_run()
+
+    def _put(self, kind, entry):
+        #the run is captured now: it may have ended by the time the entry is sent
+        run = mlflow.active_run()
+        if run == None: run = mlflow.start_run()
+
+        if self.worker == None:
+            self.worker = Thread(target=self._send, daemon=True)
+            self.worker.start()
+            atexit.register(self.flush)
+        self.queue.put((kind, run.info.run_id, entry))
+
+    def _send(self):
+        while True:
+            entries = [self.queue.get()]
+            #take whatever else is waiting, up to the size of one batch
+            while len(entries) < MAX_BATCH_METRICS:
+                try: entries.append(self.queue.get_nowait())
+                except queue.Empty: break
+
+            try: self._send_batch(entries)
+            except Exception as e:
+                print("Warning: failed to log %d entries to mlflow: %s"%(len(entries), e))
+            finally:
+                for entry in entries: self.queue.task_done()
+
+    def _send_batch(self, entries):
+        runs = dict()
+        for kind, run_id, entry in entries:
+            metrics, params, artifacts = runs.setdefault(run_id, ([], dict(), []))
+            if kind == 'metric': metrics.append(entry)
+            elif kind == 'param': params[entry.key] = entry   #the last value of a key wins
+            else: artifacts.append(entry)
+
+        for run_id, (metrics, params, artifacts) in runs.items():
+            params = list(params.values())
+            for i in range(0, len(params), MAX_BATCH_PARAMS):
+                self.client.log_batch(run_id, params = params[i:i+MAX_BATCH_PARAMS])
+            for i in range(0, len(metrics), MAX_BATCH_METRICS):
+                self.client.log_batch(run_id, metrics = metrics[i:i+MAX_BATCH_METRICS])
+
+            for path in artifacts:
+                self.client.log_artifact(run_id, path)
+                shutil.rmtree(os.path.dirname(path))
@@ -1,3 +1,25 @@
-from .sampling.equidistant_sampler import EquidistantSampling
-from .hdf5_dataset import HDF5Dataset
-from .data_functions import torch_splitter, flatten, get_loader_shape
+from sapsan._lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'EquidistantSampling': '.sampling.equidistant_sampler',
+    'BlockMeanSampling': '.sampling.block_mean_sampler',
+    'SpectralSampling': '.sampling.spectral_sampler',
+    'GaussianSampling': '.sampling.gaussian_sampler',
+    'HDF5Dataset': '.hdf5_dataset',
+    'ATHDFDataset': '.athdf_dataset',
+    'DomainDecomposition': '.domain_decomposition',
+    'Hyperslab': '.hyperslab',
+    'SyntheticTurbulence': '.synthetic_turbulence',
+    'FilterPyramid': '.pyramid',
+    'Preprocessor': '.preprocess',
+    'PatchDataset': '.patch_dataset',
+    'ArrayPatchDataset': '.patch_dataset',
+    'HDF5PatchDataset': '.patch_dataset',
+    'EpochSampler': '.patch_dataset',
+    'ChunkCache': '.patch_dataset',
+    'torch_splitter': '.data_functions',
+    'make_loader': '.data_functions',
+    'distributed_loaders': '.data_functions',
+    'flatten': '.data_functions',
+    'get_loader_shape': '.data_functions',
+})
@@ -1,31 +1,32 @@
 """
-HDF5 dataset classes
+Athena++ dataset classes
 
 Usage:
-    ds = HDF5Dataset(path="/Users/icekhan/Documents/development/myprojects/sapsan/repo/Sapsan/dataset",
-                      features=['u', 'b', 'a',
-                                'du0', 'du1', 'du2',
-                                'db0', 'db1', 'db2',
-                                'da0', 'da1', 'da2'],
-                      target=['tn'],
-                      checkpoints=[0.0, 0.01, 0.025, 0.25])
-
-    plugin = HDF5DatasetPyTorchSplitterPlugin(4)
-    loaders = plugin.apply(ds)
+    data_loader = ATHDFDataset(path="/path/to/run/out.prim.{checkpoint:05.0f}.athdf",
+                      features=['vel1', 'vel2', 'vel3'],
+                      target=['rho'],
+                      checkpoints=[10, 11, 12],
+                      batch_size=BATCH_SIZE,
+                      x1_min=-0.5, x1_max=0.5)
+
+    x, y = data_loader.load_numpy()
+
+Every .athdf file is opened once per checkpoint, and all the quantities
+(features and target) it holds are read in a single pass. The coordinates
+and block index maps are shared by the checkpoints with the same mesh,
+see athena_read.athdf. x1_min...x3_max select a subvolume, so only the
+blocks that intersect it are read; level, subsample and fast_restrict
+set the resolution of AMR data, as in athena_read.athdf.
 """
 
 from typing import List, Tuple, Dict, Optional
 import numpy as np
-from skimage.util.shape import view_as_blocks
-from sklearn.model_selection import train_test_split
-from torch import from_numpy
-from torch.utils.data import DataLoader, TensorDataset
 
 from sapsan.core.models import Dataset, DatasetPlugin, Sampling
-from sapsan.utils.shapes import split_cube_by_grid
-
+from .hdf5_dataset import HDF5Dataset
 from .athena_read import athdf
 
+
 class ATHDFDatasetPyTorchSplitterPlugin(DatasetPlugin):
     def __init__(self,
                  batch_size: int,
@@ -35,7 +36,11 @@ class ATHDFDatasetPyTorchSplitterPlugin(DatasetPlugin):
         self.train_size = train_size
         self.shuffle = shuffle
 
-    def apply_on_x_y(self, x, y) -> Dict[str, DataLoader]:
+    def apply_on_x_y(self, x, y):
+        from sklearn.model_selection import train_test_split
+        from torch import from_numpy
+        from torch.utils.data import DataLoader, TensorDataset
+
         x_train, x_test, y_train, y_test = train_test_split(x, y,
                                                             train_size=self.train_size,
                                                             shuffle=True)
@@ -54,8 +59,8 @@ class ATHDFDatasetPyTorchSplitterPlugin(DatasetPlugin):
 
         return {"train": train_loader, "valid": val_loader}
 
-    def apply(self, dataset: Dataset) -> Dict[str, DataLoader]:
-        x, y = dataset.load()
+    def apply(self, dataset: Dataset):
+        x, y = dataset.load_numpy()
         return self.apply_on_x_y(x, y)
 
 
@@ -66,89 +71,137 @@ class OutputFlatterDatasetPlugin(DatasetPlugin):
         return output.reshape(output.shape[0], -1)
 
     def apply(self, dataset: Dataset):
-        x, y = dataset.load()
+        x, y = dataset.load_numpy()
         return x, self._flatten_output(y)
 
     def apply_on_x_y(self, x, y):
         return x, self._flatten_output(y)
 
 
-class ATHDFDataset(Dataset):
+class ATHDFDataset(HDF5Dataset):
     def __init__(self,
                  path: str,
-                 features: List[str],
-                 target: List[str],
-                 checkpoints: List[int],
-                 grid_size: int = 64,
-                 checkpoint_data_size: int = 128,
+                 input_size = None,
+                 checkpoints: List[int] = [0],
+                 features: List[str] = ['rho'],
+                 target = None,
+                 batch_size: int = None,
+                 batch_num: int = None,
                  sampler: Optional[Sampling] = None,
-                 time_granularity: float = 2.5e-3,
-                 features_label = None,
-                 target_label = None):
+                 time_granularity: float = 1,
+                 features_label: Optional[List[str]] = None,
+                 target_label: Optional[List[str]] = None,
+                 flat: bool = False,
+                 shuffle: bool = False,
+                 train_fraction = None,
+                 dtype = 'auto',
+                 level: int = None,
+                 subsample: bool = False,
+                 fast_restrict: bool = False,
+                 x1_min: float = None,
+                 x1_max: float = None,
+                 x2_min: float = None,
+                 x2_max: float = None,
+                 x3_min: float = None,
+                 x3_max: float = None):
         """
-        @param path:
-        @param features:
-        @param target:
-        @param checkpoints:
-        @param grid_size: size of cube that will be used to separate checkpoint data
+        @param path: template of the .athdf paths with {checkpoint}, and optionally {feature}
+        @param input_size: shape of the (selected) data, read from the first checkpoint if None;
+                           singleton axes of 2D and 1D runs are dropped
+        @param features: Athena++ quantities, e.g. ['vel1', 'vel2', 'vel3'];
+                         if features_label is given, features only fill {feature} in
+                         the path and the labels are the quantities
+        @param level: refinement level to read AMR data at, the finest by default
+        @param subsample: restrict finer blocks by taking a cell, instead of averaging
+        @param fast_restrict: average finer blocks without the volume weights
+        @param x1_min...x3_max: bounds of the subvolume to read, in the coordinates of the run
         """
+        self.region = dict(level = level, subsample = subsample, fast_restrict = fast_restrict,
+                           x1_min = x1_min, x1_max = x1_max,
+                           x2_min = x2_min, x2_max = x2_max,
+                           x3_min = x3_min, x3_max = x3_max)
         self.path = path
-        self.features = features
-        self.target = target
-        self.features_label = features_label
-        self.target_label = target_label
-        self.checkpoints = checkpoints
-        self.grid_size = grid_size
-        self.sampler = sampler
-        self.checkpoint_data_size = checkpoint_data_size
-        if sampler:
-            self.checkpoint_data_size = self.sampler.sample_dim
         self.time_granularity = time_granularity
+        #athdf of every file of the checkpoint being read
+        self._files = {}
+        self._files_checkpoint = None
+
+        if input_size is None:
+            quantity = features_label[0] if features_label else features[0]
+            data = athdf(self._get_path(checkpoints[0], features[0]), quantities=[quantity], **self.region)
+            input_size = data._shape()
+            #drop the singleton axes of 2D and 1D runs, e.g. (1, 64, 64) -> (64, 64)
+            while len(input_size) > 1 and input_size[0] == 1: input_size = input_size[1:]
+
+        super().__init__(path = path,
+                         input_size = tuple(int(n) for n in input_size),
+                         checkpoints = checkpoints,
+                         features = features,
+                         target = target,
+                         batch_size = batch_size,
+                         batch_num = batch_num,
+                         sampler = sampler,
+                         time_granularity = time_granularity,
+                         features_label = features_label,
+                         target_label = target_label,
+                         flat = flat,
+                         shuffle = shuffle,
+                         train_fraction = train_fraction,
+                         dtype = dtype)
+
+    def get_parameters(self):
+        parameters = super().get_parameters()
+        parameters.update({"data - %s"%key: value for key, value in self.region.items() if value})
+        return parameters
+
+    def _columns(self):
+        #(feature, quantity) of the features and the target
+        columns = list(zip(self.features, self.features_label or self.features))
+        if self.target != None: columns += list(zip(self.target, self.target_label or self.target))
+        return columns
+
+    def _open(self, checkpoint, path):
+        if checkpoint != self._files_checkpoint:
+            self._files = {}
+            self._files_checkpoint = checkpoint
+        if path not in self._files:
+            quantities = list(dict.fromkeys(quantity for feature, quantity in self._columns()
+                                            if self._get_path(checkpoint, feature) == path))
+            data = athdf(path, quantities=quantities, dtype=self.dtype, **self.region)
+            #every quantity of the file in a single pass
+            data._grab_quantities(quantities)
+            self._files[path] = data
+        return self._files[path]
+
+    def _read_columns(self, checkpoint, columns, labels):
+        input_data = []
+        for col in range(len(columns)):
+            path = self._get_path(checkpoint, columns[col])
+            key = labels[col] if labels != None else columns[col]
 
-    def load(self) -> Tuple[np.ndarray, np.ndarray]:
-        return self._load_data()
+            print("Loading '%s' from file '%s'"%(key, path))
 
-    def _get_path(self, checkpoint, feature):
-        """Return absolute path to required feature at specific checkpoint."""
-        timestep = self.time_granularity * checkpoint
-        relative_path = self.path.format(checkpoint=timestep, feature=feature)
-        return relative_path #"{0}/{1}".format(self.path, relative_path)
+            data = self._open(checkpoint, path)[key]
+            if data.size != np.prod(self.initial_size):
+                raise ValueError("input_size %s doesn't match the size %s of '%s' in '%s'"%(
+                                 self.initial_size, data.shape, key, path))
+            input_data.append(data.reshape(self.initial_size))
+            print('----------')
 
-    def _get_checkpoint_data(self, checkpoint, columns, labels):
-        all_data = []
-        # combine all features into cube with channels
-        
-        for col in range(len(columns)):
-            data = athdf(self._get_path(checkpoint, columns[col]), 'r')
-            
-            if labels==None: key = list(data.keys())[-1]
-            else: key = label[col]
-
-            print("Loading '%s' from file '%s'"%(key, self._get_path(checkpoint, columns[col])))
-            
-            data = data[key]
-            data = np.moveaxis(data, -1, 0)
-            all_data.append(data)
-        # checkpoint_data shape: (features, 128, 128, 128)
-        checkpoint_data = np.vstack(all_data)
-        # downsample if needed
+        # input_data shape ex: (features, 128, 128, 128)
+        input_data = np.stack(input_data)
         if self.sampler:
-            checkpoint_data = self.sampler.sample(checkpoint_data)
-        # columns_length: 12 features (or 1 label) * 3 dim = 36
-        columns_length = checkpoint_data.shape[0]
-
-        return split_cube_by_grid(checkpoint_data, self.checkpoint_data_size,
-                                  self.grid_size, columns_length)
-
-    def _load_data(self) -> Tuple[np.ndarray, np.ndarray]:
-        x = list()
-        y = list()
-        for checkpoint in self.checkpoints:
-            features_checkpoint_batch = self._get_checkpoint_data(checkpoint, 
-                                                                  self.features, self.features_label)
-            target_checkpoint_batch = self._get_checkpoint_data(checkpoint, 
-                                                                self.target, self.target_label)
-            x.append(features_checkpoint_batch)
-            y.append(target_checkpoint_batch)
-
-        return np.vstack(x), np.vstack(y)
+            input_data = self.sampler.sample(input_data)
+        return input_data
+
+    def _load_data_numpy(self) -> Tuple[np.ndarray, np.ndarray]:
+        try: return super()._load_data_numpy()
+        finally:
+            self._files = {}
+            self._files_checkpoint = None
+
+    def __iter__(self):
+        try: yield from super().__iter__()
+        finally:
+            self._files = {}
+            self._files_checkpoint = None
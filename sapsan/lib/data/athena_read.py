@@ -6,7 +6,9 @@ Read Athena++ output data files.
 import re
 import struct
 import sys
+import hashlib
 import warnings
+from collections import OrderedDict
 from io import open  # Consistent binary I/O from Python 2 and 3
 
 # Other Python modules
@@ -320,7 +322,8 @@ class athdf(dict):
             face_func_3=None,
             center_func_1=None,
             center_func_2=None,
-            center_func_3=None):
+            center_func_3=None,
+            vectorized=True):
 
         # Import necessary module for reading HDF5 files
         try:
@@ -359,6 +362,7 @@ class athdf(dict):
         self.center_func_1 = center_func_1
         self.center_func_2 = center_func_2
         self.center_func_3 = center_func_3
+        self.vectorized = vectorized
 
         # Open file
         with h5py.File(filename, 'r') as f:
@@ -427,9 +431,9 @@ class athdf(dict):
             coord = f.attrs['Coordinates'].decode('ascii', 'replace')
             if (self.level < self.max_level and not self.subsample
                     and not self.fast_restrict and self.vol_func is None):
-                x1_rat = f.attrs['RootGridX1'][2].decode('ascii', 'replace')
-                x2_rat = f.attrs['RootGridX2'][2].decode('ascii', 'replace')
-                x3_rat = f.attrs['RootGridX3'][2].decode('ascii', 'replace')
+                x1_rat = f.attrs['RootGridX1'][2]
+                x2_rat = f.attrs['RootGridX2'][2]
+                x3_rat = f.attrs['RootGridX3'][2]
                 if (coord == 'cartesian' or coord == 'minkowski' or coord == 'tilted'
                         or coord == 'sinusoidal'):
                     if (
@@ -467,6 +471,7 @@ class athdf(dict):
                             cosp = np.cos(thetap)
                             return ((rp**3 - rm**3) * abs(cosm - cosp) + a**2 *
                                     (rp - rm) * abs(cosm**3 - cosp**3)) * (phip - phim)
+                        self.vol_func = vol_func
                 else:
                     raise AthenaError('Coordinates not recognized')
 
@@ -594,48 +599,70 @@ class athdf(dict):
             self.x3m = f['x3f'][fine_block, 0]
             self.x3p = f['x3f'][fine_block, 1]
 
+            # Reuse coordinates of a previously read file with the same mesh
+            mesh_key = None
+            if all(func is None for func in (
+                    face_func_1, face_func_2, face_func_3,
+                    self.center_func_1, self.center_func_2, self.center_func_3)):
+                mesh_key = hashlib.sha1(
+                        self.levels.tobytes() + self.logical_locations.tobytes()
+                        + repr((coord, self.level, tuple(nx_vals), tuple(self.block_size),
+                                [tuple(f.attrs['RootGridX'+repr(d)]) for d in range(1, 4)],
+                                self.x1m, self.x1p, self.x2m, self.x2p, self.x3m,
+                                self.x3p)).encode()).hexdigest()
+            if mesh_key is not None and mesh_key in _coordinates_cache:
+                _coordinates_cache.move_to_end(mesh_key)
+                for key, value in _coordinates_cache[mesh_key].items():
+                    self[key] = value.copy()
+
             # Populate coordinate arrays
-            face_funcs = (face_func_1, face_func_2, face_func_3)
-            center_funcs = (center_func_1, center_func_2, center_func_3)
-            for d, nx, face_func, center_func in zip(
-                    range(1, 4), nx_vals, face_funcs, center_funcs):
-                xf = 'x' + repr(d) + 'f'
-                xv = 'x' + repr(d) + 'v'
-                if nx == 1:
-                    xm = (self.x1m, self.x2m, self.x3m)[d-1]
-                    xp = (self.x1p, self.x2p, self.x3p)[d-1]
-                    self[xf] = np.array([xm, xp])
-                else:
-                    xmin = f.attrs['RootGridX'+repr(d)][0]
-                    xmax = f.attrs['RootGridX'+repr(d)][1]
-                    xrat_root = f.attrs['RootGridX'+repr(d)][2]
-                    if xrat_root == -1.0 and face_func is None:
-                        raise AthenaError(
-                                'Must specify user-defined face_func_{0}'.format(d))
-                    elif face_func is not None:
-                        self[xf] = face_func(xmin, xmax, xrat_root, nx + 1)
-                    elif xrat_root == 1.0:
-                        if np.all(self.levels == self.level):
-                            self[xf] = np.empty(nx + 1)
-                            for n_block in range(int(nx / self.block_size[d-1])):
-                                sample_location = [0, 0, 0]
-                                sample_location[d-1] = n_block
-                                sample_block = np.where(np.all(
-                                    self.logical_locations == sample_location,
-                                    axis=1))[0][0]
-                                index_low = n_block * self.block_size[d-1]
-                                index_high = index_low + self.block_size[d-1] + 1
-                                self[xf][index_low:index_high] = f[xf][sample_block, :]
-                        else:
-                            self[xf] = np.linspace(xmin, xmax, nx + 1)
+            else:
+                face_funcs = (face_func_1, face_func_2, face_func_3)
+                center_funcs = (center_func_1, center_func_2, center_func_3)
+                for d, nx, face_func, center_func in zip(
+                        range(1, 4), nx_vals, face_funcs, center_funcs):
+                    xf = 'x' + repr(d) + 'f'
+                    xv = 'x' + repr(d) + 'v'
+                    if nx == 1:
+                        xm = (self.x1m, self.x2m, self.x3m)[d-1]
+                        xp = (self.x1p, self.x2p, self.x3p)[d-1]
+                        self[xf] = np.array([xm, xp])
                     else:
-                        xrat = xrat_root ** (1.0 / 2 ** self.level)
-                        self[xf] = (
-                                xmin + (1.0 - xrat**np.arange(nx+1)) / (1.0 - xrat**nx)
-                                * (xmax - xmin))
-                self[xv] = np.empty(nx)
-                for i in range(nx):
-                    self[xv][i] = center_func(self[xf][i], self[xf][i+1])
+                        xmin = f.attrs['RootGridX'+repr(d)][0]
+                        xmax = f.attrs['RootGridX'+repr(d)][1]
+                        xrat_root = f.attrs['RootGridX'+repr(d)][2]
+                        if xrat_root == -1.0 and face_func is None:
+                            raise AthenaError(
+                                    'Must specify user-defined face_func_{0}'.format(d))
+                        elif face_func is not None:
+                            self[xf] = face_func(xmin, xmax, xrat_root, nx + 1)
+                        elif xrat_root == 1.0:
+                            if np.all(self.levels == self.level):
+                                self[xf] = np.empty(nx + 1)
+                                for n_block in range(int(nx / self.block_size[d-1])):
+                                    sample_location = [0, 0, 0]
+                                    sample_location[d-1] = n_block
+                                    sample_block = np.where(np.all(
+                                        self.logical_locations == sample_location,
+                                        axis=1))[0][0]
+                                    index_low = n_block * self.block_size[d-1]
+                                    index_high = index_low + self.block_size[d-1] + 1
+                                    self[xf][index_low:index_high] = f[xf][sample_block, :]
+                            else:
+                                self[xf] = np.linspace(xmin, xmax, nx + 1)
+                        else:
+                            xrat = xrat_root ** (1.0 / 2 ** self.level)
+                            self[xf] = (
+                                    xmin + (1.0 - xrat**np.arange(nx+1)) / (1.0 - xrat**nx)
+                                    * (xmax - xmin))
+                    self[xv] = np.empty(nx)
+                    for i in range(nx):
+                        self[xv][i] = center_func(self[xf][i], self[xf][i+1])
+                if mesh_key is not None:
+                    _coordinates_cache[mesh_key] = {
+                            key: self[key].copy() for key in coord_quantities}
+                    while len(_coordinates_cache) > _index_maps_cache_size:
+                        _coordinates_cache.popitem(last=False)
 
             # Account for selection
             x1_select = False
@@ -733,9 +760,13 @@ class athdf(dict):
 
     # Function for setting all needed quantities
     def _grab_quantities(self, quantities):
+        if not self.vectorized:
+            return self._grab_quantities_blockwise(quantities)
 
         # Create list of quantities to be set
         quantities = [q for q in quantities if self._need_to_read(q)]
+        maps = self._index_maps()
+        exact_restrict = not self.subsample and not self.fast_restrict
 
         # Open file
         with h5py.File(self.filename, 'r') as f:
@@ -743,7 +774,174 @@ class athdf(dict):
             # Prepare arrays for data and bookkeeping
             if self.new_data:
                 for q in quantities:
-                    self[q] = np.zeros((self._shape()), dtype=self.dtype)
+                    dtype = self.dtype
+                    if dtype is None:
+                        dtype = f[self.quantity_datasets[q]].dtype
+                    self[q] = np.zeros((self._shape()), dtype=dtype)
+                if self.return_levels:
+                    self['Levels'] = np.empty((self._shape()), dtype=np.int32)
+            else:
+                for q in quantities:
+                    self[q].fill(0.0)
+
+            # Calculate volume weights of fine blocks for exact restriction, once
+            weights = {}
+            for n, group in enumerate(maps['groups']):
+                if group['factors'] is not None and exact_restrict:
+                    weights[n] = self._block_volumes(f, maps['blocks'][group['positions']])
+
+            # Set level information
+            if self.return_levels:
+                for group in maps['groups']:
+                    self._scatter(self['Levels'], group, group['level'])
+
+            # Read each quantity in bulk and scatter blocks into place
+            for q in quantities:
+                dataset = self.quantity_datasets[q]
+                index = self.quantity_indices[q]
+                if len(maps['blocks']) == self.num_blocks:
+                    block_data = f[dataset][index]
+                else:
+                    block_data = f[dataset][index, maps['blocks']]
+                for n, group in enumerate(maps['groups']):
+                    if len(maps['groups']) == 1:
+                        data = block_data
+                    else:
+                        data = block_data[group['positions']]
+                    if group['factors'] is not None:
+                        data = _restrict_blocks(data, group['factors'], weights.get(n))
+                    self._scatter(self[q], group, data)
+
+    # Function for calculating volumes of cells of given blocks
+    def _block_volumes(self, f, blocks):
+        x1f = f['x1f'][blocks]
+        x2f = f['x2f'][blocks]
+        x3f = f['x3f'][blocks]
+        vols = self.vol_func(
+                x1f[:, None, None, :-1], x1f[:, None, None, 1:],
+                x2f[:, None, :-1, None], x2f[:, None, 1:, None],
+                x3f[:, :-1, None, None], x3f[:, 1:, None, None])
+        shape = (len(blocks), x3f.shape[1] - 1, x2f.shape[1] - 1, x1f.shape[1] - 1)
+        return np.broadcast_to(vols, shape)
+
+    # Function for copying block data (or a constant) into an output array
+    def _scatter(self, out, group, data):
+        if len(group['inside']) > 0:
+            k_d, j_d, i_d = group['dest']
+            k_s, j_s, i_s = group['source']
+            values = data
+            if np.ndim(data) > 0:
+                values = data[group['inside'][:, None, None, None], k_s[None, :, None, None],
+                              j_s[None, None, :, None], i_s[None, None, None, :]]
+            out[k_d[:, :, None, None], j_d[:, None, :, None], i_d[:, None, None, :]] = values
+        for position, dest, source in group['partial']:
+            if np.ndim(data) > 0:
+                out[dest] = data[position][np.ix_(*source)]
+            else:
+                out[dest] = data
+
+    # Function for calculating where the cells of each block go in the output
+    def _index_maps(self):
+        """
+        Index maps are built once per mesh (LogicalLocations, Levels), output level,
+        selection and restriction method, and cached across files. Blocks are grouped
+        by refinement level; within a group every block is described by the output
+        indices along each axis (dest), shared cell indices within the (restricted)
+        block (source), and blocks cut by the selection are listed with slices.
+        """
+
+        # Look up cache
+        key = hashlib.sha1(
+                self.levels.tobytes() + self.logical_locations.tobytes()
+                + repr((tuple(self.block_size), self.level, self.nx1, self.nx2, self.nx3,
+                        self._shape(), self.i_min, self.j_min, self.k_min,
+                        bool(self.subsample), bool(self.fast_restrict))).encode()).hexdigest()
+        if key in _index_maps_cache:
+            _index_maps_cache.move_to_end(key)
+            return _index_maps_cache[key]
+
+        nx_vals = (self.nx3, self.nx2, self.nx1)
+        offsets = (self.k_min, self.j_min, self.i_min)
+        shape = self._shape()
+        block_size = [int(b) for b in self.block_size[::-1]]
+        locations = self.logical_locations[:, ::-1]
+
+        groups = []
+        for block_level in np.unique(self.levels):
+            blocks = np.where(self.levels == block_level)[0]
+            restrict = block_level > self.level
+            s = 2 ** abs(int(block_level) - int(self.level))
+
+            # Calculate destination (without selection) and source indices along each axis
+            dest = []
+            source = []
+            factors = []
+            for d in range(3):
+                if nx_vals[d] == 1:
+                    length = 1
+                    source.append(np.zeros(1, dtype=np.intp))
+                elif not restrict:
+                    length = block_size[d] * s
+                    source.append(np.arange(length) // s)
+                elif self.subsample:
+                    length = block_size[d] // s
+                    source.append(np.arange(length) * s + s // 2 - 1)
+                else:
+                    length = block_size[d] // s
+                    source.append(np.arange(length))
+                start = locations[blocks, d] * length if nx_vals[d] > 1 else 0 * blocks
+                dest.append(start[:, None] + np.arange(length) - offsets[d])
+                factors.append(s if restrict and nx_vals[d] > 1 else 1)
+
+            # Account for selection
+            valid = [(x >= 0) & (x < n) for x, n in zip(dest, shape)]
+            touching = np.all([v.any(axis=1) for v in valid], axis=0)
+            inside = np.all([v.all(axis=1) for v in valid], axis=0)
+            partial = []
+            for position in np.where(touching & ~inside)[0]:
+                ranges = [np.where(v[position])[0] for v in valid]
+                partial.append((
+                        np.searchsorted(np.where(touching)[0], position),
+                        tuple(slice(x[position, r[0]], x[position, r[-1]] + 1)
+                              for x, r in zip(dest, ranges)),
+                        tuple(src[r] for src, r in zip(source, ranges))))
+
+            groups.append({
+                    'level': block_level,
+                    'blocks': blocks[touching],
+                    'factors': tuple(factors) if restrict and not self.subsample else None,
+                    'inside': np.searchsorted(np.where(touching)[0], np.where(inside)[0]),
+                    'dest': tuple(x[inside] for x in dest),
+                    'source': tuple(source),
+                    'partial': partial})
+
+        # Locate blocks of each group among all blocks to be read (increasing, for h5py)
+        needed = np.sort(np.concatenate([group['blocks'] for group in groups]))
+        for group in groups:
+            group['positions'] = np.searchsorted(needed, group['blocks'])
+        maps = {'blocks': needed, 'groups': [group for group in groups if len(group['blocks'])]}
+
+        _index_maps_cache[key] = maps
+        while len(_index_maps_cache) > _index_maps_cache_size:
+            _index_maps_cache.popitem(last=False)
+        return maps
+
+    # Function for setting all needed quantities, one block at a time
+    def _grab_quantities_blockwise(self, quantities):
+
+        # Create list of quantities to be set
+        quantities = [q for q in quantities if self._need_to_read(q)]
+
+        # Open file
+        with h5py.File(self.filename, 'r') as f:
+
+            # Prepare arrays for data and bookkeeping
+            if self.new_data:
+                for q in quantities:
+                    dtype = self.dtype
+                    if dtype is None:
+                        dtype = f[self.quantity_datasets[q]].dtype
+                    self[q] = np.zeros((self._shape()), dtype=dtype)
                 if self.return_levels:
                     self['Levels'] = np.empty((self._shape()), dtype=np.int32)
             else:
@@ -983,6 +1181,24 @@ class athdf(dict):
                                             self[q][k, j, i] /= vol
 
 
+# Coordinates and index maps of recently read meshes, see athdf._index_maps
+_coordinates_cache = OrderedDict()
+_index_maps_cache = OrderedDict()
+_index_maps_cache_size = 8
+
+
+def _restrict_blocks(data, factors, vols=None):
+    """Average blocks of cells of each block (volume-weighted if vols given)."""
+    num_blocks, nb3, nb2, nb1 = data.shape
+    f3, f2, f1 = factors
+    shape = (num_blocks, nb3 // f3, f3, nb2 // f2, f2, nb1 // f1, f1)
+    if vols is None:
+        return np.reshape(data, shape).mean(axis=(2, 4, 6))
+    vals_sum = np.reshape(data * vols, shape).sum(axis=(2, 4, 6))
+    vols_sum = np.reshape(vols, shape).sum(axis=(2, 4, 6))
+    return vals_sum / vols_sum
+
+
 # ========================================================================================
 
 
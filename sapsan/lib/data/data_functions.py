@@ -1,60 +1,173 @@
 from typing import List, Tuple, Dict, Optional
+import os
 import numpy as np
 from collections import OrderedDict
-from sklearn.model_selection import train_test_split
+import torch
 from torch import from_numpy
-from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data import DataLoader, TensorDataset, Subset, DistributedSampler, RandomSampler
 from sapsan.core.models import Dataset, DatasetPlugin
+from sapsan.utils.distributed import is_main_process
 import warnings
 
+def to_float_tensor(x: np.ndarray):
+    # shares memory with the numpy array if it is already float32,
+    # otherwise makes a single float32 copy (load the data as float32,
+    # e.g. with HDF5Dataset, to avoid it)
+    return from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+
+
+def make_loader(dataset,
+                batch_num: int = 1,
+                shuffle: bool = False,
+                num_workers: int = None,
+                pin_memory: bool = None,
+                prefetch_factor: int = None,
+                persistent_workers: bool = None,
+                batch_sampler = None,
+                generator = None,
+                sharded: bool = False):
+    """
+    Builds a DataLoader with defaults depending on where the data lives:
+        in-memory (TensorDataset) - no worker processes, since indexing is
+                                    cheaper than forking and IPC
+        lazy (any other Dataset)  - up to 4 persistent workers prefetching batches
+    @param batch_sampler: callable returning a batch sampler for the given dataset;
+                          overrides batch_num and shuffle
+    @param sharded: the dataset already is the shard of this process (e.g. its
+                    subdomain), so it won't be split again between DDP processes
+    """
+    in_memory = isinstance(dataset, TensorDataset) or \
+                (isinstance(dataset, Subset) and isinstance(dataset.dataset, TensorDataset))
+    
+    if num_workers == None: 
+        num_workers = 0 if in_memory else min(4, os.cpu_count() or 1)
+    if pin_memory == None: pin_memory = torch.cuda.is_available()
+    if persistent_workers == None: persistent_workers = not in_memory
+        
+    kwargs = dict(num_workers = num_workers, pin_memory = pin_memory, generator = generator)
+    # both are only allowed with worker processes
+    if num_workers > 0:
+        kwargs['persistent_workers'] = persistent_workers
+        if prefetch_factor != None: kwargs['prefetch_factor'] = prefetch_factor
+            
+    if batch_sampler != None: 
+        loader = DataLoader(dataset=dataset, batch_sampler=batch_sampler(dataset), **kwargs)
+    else:
+        loader = DataLoader(dataset=dataset, batch_size=batch_num, shuffle=shuffle, **kwargs)
+    
+    # checked by distributed_loaders() and ShardedRunner
+    loader.sharded = sharded
+    return loader
+
+    
 def torch_splitter(loaders, 
                    batch_num: int = 1,
                    train_fraction = None,
-                   shuffle: bool = False):
-
+                   shuffle: bool = False,
+                   seed: int = 42,
+                   **loader_kwargs):
+    """
+    Converts numpy [x, y] (or [x]) into torch train & valid loaders.
+    The split is done on indices: train and valid are Subsets of a single
+    dataset, so the data is never duplicated.
+    @param train_fraction: fraction (float) or number (int) of the train samples
+    @param seed: seed for the split permutation and loader shuffling
+    @param loader_kwargs: DataLoader options passed to make_loader(), such as
+                          num_workers, pin_memory, prefetch_factor, 
+                          persistent_workers, batch_sampler, and sharded
+    """
+    if shuffle: loader_kwargs.setdefault('generator', torch.Generator().manual_seed(seed))
+    
     if len(loaders)==1: 
         x = loaders[0]
-        dataset=TensorDataset(from_numpy(x).float())
-        train_loader = DataLoader(dataset=TensorDataset(from_numpy(x).float()),
-                                  batch_size=batch_num,
-                                  shuffle=shuffle,
-                                  num_workers=4)
+        train_loader = make_loader(TensorDataset(to_float_tensor(x)),
+                                   batch_num=batch_num,
+                                   shuffle=shuffle,
+                                   **loader_kwargs)
         return OrderedDict({"train": train_loader})   
         
     else: 
         x, y = loaders
+        nsamples = np.shape(x)[0]
         
-        if np.shape(x)[0]==1 and train_fraction!=None:
-            print('\nWARNING: your batch_num=1, hence the data cannot be split into train and valid (perhaps you only loaded 1 checkpoint). Setting valid = test data...\n')
+        if nsamples==1 and train_fraction!=None:
+            if is_main_process(): print('\nWARNING: your batch_num=1, hence the data cannot be split into train and valid (perhaps you only loaded 1 checkpoint). Setting valid = test data...\n')
             train_fraction = None
 
-        if train_fraction != None:            
-            x_train, x_valid, y_train, y_valid = train_test_split(x, y,
-                                                                  train_size=train_fraction,
-                                                                  shuffle=shuffle)
+        dataset = TensorDataset(to_float_tensor(x), to_float_tensor(y))
+        
+        if train_fraction != None:
+            train_indices, valid_indices = split_indices(nsamples, train_fraction, shuffle, seed)
+            train_dataset = Subset(dataset, train_indices)
+            valid_dataset = Subset(dataset, valid_indices)
         else:
-            x_train = x_valid = x
-            y_train = y_valid = y
+            train_dataset = valid_dataset = dataset
 
-        dataset=TensorDataset(from_numpy(x_train).float(),
-                              from_numpy(y_train).float())
-        train_loader = DataLoader(dataset=TensorDataset(from_numpy(x_train).float(),
-                                                        from_numpy(y_train).float()),
-                                  batch_size=batch_num,
-                                  shuffle=shuffle,
-                                  num_workers=4)
+        train_loader = make_loader(train_dataset,
+                                   batch_num=batch_num,
+                                   shuffle=shuffle,
+                                   **loader_kwargs)
 
-        valid_loader = DataLoader(dataset=TensorDataset(from_numpy(x_valid).float(),
-                                                      from_numpy(y_valid).float()),
-                                  batch_size=batch_num,
-                                  shuffle=shuffle,
-                                  num_workers=4)
-        print('Train data shapes: ', x_train.shape, y_train.shape)
-        print('Valid data shapes: ', x_valid.shape, y_valid.shape)
+        valid_loader = make_loader(valid_dataset,
+                                   batch_num=batch_num,
+                                   shuffle=shuffle,
+                                   **loader_kwargs)
+        if is_main_process():
+            print('Train data shapes: ', (len(train_dataset),)+x.shape[1:], (len(train_dataset),)+y.shape[1:])
+            print('Valid data shapes: ', (len(valid_dataset),)+x.shape[1:], (len(valid_dataset),)+y.shape[1:])
 
         return OrderedDict({"train": train_loader, "valid": valid_loader})    
 
     
+def split_indices(nsamples: int, 
+                  train_fraction,
+                  shuffle: bool = False,
+                  seed: int = 42):
+    # deterministic train/valid split of sample indices;
+    # as in sklearn, a float is a fraction and an int is the number of train samples
+    if shuffle: indices = torch.randperm(nsamples, generator=torch.Generator().manual_seed(seed))
+    else: indices = torch.arange(nsamples)
+    
+    if isinstance(train_fraction, (int, np.integer)): ntrain = train_fraction
+    else: ntrain = np.floor(train_fraction*nsamples)
+    ntrain = int(np.clip(ntrain, 1, nsamples-1))
+    return indices[:ntrain].tolist(), indices[ntrain:].tolist()
+
+    
+def distributed_loaders(loaders, rank: int, world_size: int, seed: int = None):
+    """
+    Shards the loaders between DDP processes: every loader is rebuilt with
+    a DistributedSampler, keeping the rest of its settings. Loaders that
+    already hold the data of this process only (sharded=True) are kept as is.
+    @param seed: shuffling seed, by default the seed of the loader's generator
+                 (set by torch_splitter), so that all processes shuffle alike
+    """
+    sharded = OrderedDict()
+    for key, loader in loaders.items():
+        if getattr(loader, 'sharded', False) or isinstance(loader.sampler, DistributedSampler): 
+            sharded[key] = loader
+            continue
+        if seed != None: loader_seed = seed
+        elif loader.generator != None: loader_seed = loader.generator.initial_seed()
+        else: loader_seed = 0
+        sampler = DistributedSampler(loader.dataset, 
+                                     num_replicas=world_size, rank=rank,
+                                     shuffle=isinstance(loader.sampler, RandomSampler),
+                                     seed=loader_seed)
+        kwargs = dict(num_workers=loader.num_workers, pin_memory=loader.pin_memory)
+        if loader.num_workers > 0: 
+            kwargs['persistent_workers'] = loader.persistent_workers
+            kwargs['prefetch_factor'] = loader.prefetch_factor
+        # a custom batch_sampler is replaced by plain batches of its batch_size
+        batch_size = loader.batch_size or getattr(loader.batch_sampler, 'batch_size', 1)
+        sharded[key] = DataLoader(dataset=loader.dataset,
+                                  batch_size=batch_size,
+                                  sampler=sampler,
+                                  drop_last=loader.drop_last,
+                                  **kwargs)
+    return sharded
+    
+    
 def flatten(data: np.ndarray):
     return data.reshape(data.shape[0], -1)
 
@@ -65,6 +178,6 @@ def get_loader_shape(loaders, name = None):
         name = next(iter(loaders))
     else: pass     
     
-    x, y = iter(loaders['%s'%name]).next()
+    x, y = next(iter(loaders['%s'%name]))
     
     return x.shape, y.shape
\ No newline at end of file
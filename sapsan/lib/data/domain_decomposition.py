@@ -0,0 +1,157 @@
+"""
+Spatial domain decomposition of a single snapshot between processes
+
+Every process (rank) reads only its own subdomain of the HDF5 dataset via
+hyperslab selection, extended by a halo of ghost cells that covers the
+receptive field of the convolutions. Since the halo cells are read straight
+from the file (periodically wrapped at the domain boundary), no halo exchange
+between the processes is needed.
+
+Usage:
+    decomposition = DomainDecomposition(halo = 4)    #rank & ndomains from torchrun
+
+    data_loader = HDF5Dataset(path = "/path/to/{feature}_{checkpoint}.h5",
+                              features = ['u'],
+                              target = ['tn'],
+                              input_size = [1024,1024,1024],
+                              decomposition = decomposition)
+    x, y = data_loader.load_numpy()     #only this rank's slab + halo
+    ...
+    pred = decomposition.gather(pred, data_loader.initial_size)  #full field on rank 0
+"""
+
+import itertools
+import numpy as np
+
+from sapsan.utils.distributed import get_rank, get_world_size
+
+
+class DomainDecomposition():
+    def __init__(self,
+                 ndomains: int = None,
+                 rank: int = None,
+                 halo: int = 0,
+                 mode: str = 'slab',
+                 periodic: bool = True):
+        """
+        @param ndomains: number of subdomains, world size by default
+        @param rank: subdomain of this process, process rank by default
+        @param halo: number of ghost cells added on each side of the decomposed axes
+        @param mode: 'slab' splits the 1st axis, 'pencil' splits the first two axes
+        @param periodic: wrap the halo around the domain boundary, otherwise clip it
+        """
+        if mode not in ['slab', 'pencil']:
+            raise ValueError("Decomposition mode can be either 'slab' or 'pencil', but recieved '%s'"%mode)
+        self.ndomains = get_world_size() if ndomains==None else ndomains
+        self.rank = get_rank() if rank==None else rank
+        self.halo = halo
+        self.mode = mode
+        self.periodic = periodic
+
+    def __repr__(self):
+        return "DomainDecomposition(%s, ndomains=%d, halo=%d, periodic=%s)"%(self.mode, self.ndomains,
+                                                                              self.halo, self.periodic)
+
+    def grid(self, ndim: int):
+        #number of subdomains along each axis
+        if self.mode == 'slab': split = [self.ndomains]
+        else:
+            #the most even factorization n = n0*n1
+            n0 = int(np.sqrt(self.ndomains))
+            while self.ndomains % n0: n0 -= 1
+            split = [self.ndomains//n0, n0]
+        return tuple(split + [1]*(ndim-len(split)))
+
+    def region(self, shape, rank: int = None):
+        #interior (start, stop) of the subdomain along each axis
+        if rank == None: rank = self.rank
+        grid = self.grid(len(shape))
+        if any(g > n for n, g in zip(shape, grid)):
+            raise ValueError("Cannot split the domain %s into %s subdomains: "
+                             "too many subdomains for the axis size"%(tuple(shape), grid))
+        index = np.unravel_index(rank, grid)
+        return [(i*n//g, (i+1)*n//g) for i, n, g in zip(index, shape, grid)]
+
+    def halo_region(self, shape, rank: int = None):
+        #(start, stop) including the halo; can extend past the domain if periodic
+        region = []
+        for (start, stop), n, g in zip(self.region(shape, rank), shape, self.grid(len(shape))):
+            if g > 1:
+                start, stop = start-self.halo, stop+self.halo
+                if not self.periodic: start, stop = max(start, 0), min(stop, n)
+            region.append((start, stop))
+        return region
+
+    def local_shape(self, shape, rank: int = None):
+        return tuple(stop-start for start, stop in self.halo_region(shape, rank))
+
+    def read(self, dataset, ndim: int, dest: np.ndarray = None, rank: int = None):
+        """
+        Reads the subdomain (with halo) from the last 'ndim' axes of an
+        h5py dataset; leading (channel) axes are read whole
+        """
+        shape = dataset.shape[-ndim:]
+        nlead = len(dataset.shape) - ndim
+
+        if dest is None:
+            dest = np.empty(dataset.shape[:nlead]+self.local_shape(shape, rank), dtype=dataset.dtype)
+
+        # a periodic halo wraps around the boundary: read each region
+        # as up to 2 contiguous hyperslabs per axis
+        pieces = [self._wrap(start, stop, n) for (start, stop), n in zip(self.halo_region(shape, rank), shape)]
+        for piece in itertools.product(*pieces):
+            source_sel = (slice(None),)*nlead + tuple(src for src, dst in piece)
+            dest_sel = (slice(None),)*nlead + tuple(dst for src, dst in piece)
+            dataset.read_direct(dest, source_sel=source_sel, dest_sel=dest_sel)
+        return dest
+
+    @staticmethod
+    def _wrap(start, stop, n):
+        #splits [start, stop) into (source, destination) slices within [0, n)
+        pieces = []
+        position = start
+        while position < stop:
+            source_start = position % n
+            length = min(stop - position, n - source_start)
+            pieces.append((slice(source_start, source_start+length),
+                           slice(position-start, position-start+length)))
+            position += length
+        return pieces
+
+    def crop(self, data: np.ndarray, shape, rank: int = None):
+        #removes the halo from the last len(shape) axes of the local data
+        local = []
+        for (start, stop), (hstart, hstop) in zip(self.region(shape, rank), self.halo_region(shape, rank)):
+            local.append(slice(start-hstart, start-hstart+stop-start))
+        return data[(Ellipsis,)+tuple(local)]
+
+    def combine(self, pieces, shape):
+        #assembles the interiors of all subdomains (ordered by rank) into the full domain
+        full = np.empty(pieces[0].shape[:-len(shape)]+tuple(shape), dtype=pieces[0].dtype)
+        for rank, piece in enumerate(pieces):
+            region = tuple(slice(start, stop) for start, stop in self.region(shape, rank))
+            full[(Ellipsis,)+region] = piece
+        return full
+
+    def gather(self, data: np.ndarray, shape, group = None):
+        """
+        Crops the halo and gathers the subdomains from all ranks into the
+        full domain on rank 0 (other ranks get None)
+        @param shape: shape of the full domain
+        @param group: torch.distributed process group, the default one if None;
+                      it has to be initialized, e.g. by
+                      sapsan.utils.distributed.init_process_group()
+        """
+        interior = np.ascontiguousarray(self.crop(data, shape))
+        if self.ndomains == 1: return interior
+
+        import torch.distributed as dist
+        if not dist.is_initialized():
+            raise RuntimeError("gather() needs an initialized process group, "
+                               "see sapsan.utils.distributed.init_process_group()")
+
+        pieces = [None]*self.ndomains if self.rank == 0 else None
+        dist.gather_object(interior, pieces, dst=0, group=group)
+
+        if self.rank == 0: return self.combine(pieces, shape)
+        else: return None
@@ -12,6 +12,26 @@ Usage:
                       flat = False)
 
     x, y = data_loader.load_numpy()
+
+    # every rank reads only its slab (+ halo) of a single large snapshot
+    data_loader = HDF5Dataset(path="/path/to/data.h5",
+                      features=['a', 'b'],
+                      target=['c'],
+                      input_size=INPUT_SIZE,
+                      decomposition=DomainDecomposition(halo=4))
+
+    x, y = data_loader.load_numpy()
+
+    # read only a region of the box: the first quarter along x, in physical units
+    data_loader = HDF5Dataset(path="/path/to/data.h5",
+                      features=['a', 'b'],
+                      target=['c'],
+                      input_size=INPUT_SIZE,
+                      roi=[(0, np.pi/2), None, None],
+                      domain=[(0, 2*np.pi)]*3)
+
+    # one checkpoint at a time, e.g. for incremental estimators
+    for x, y in data_loader: ...
 """
 
 from typing import List, Tuple, Dict, Optional
@@ -21,7 +41,8 @@ import warnings
 
 from sapsan.core.models import Dataset, Sampling
 from sapsan.utils.shapes import split_cube_by_batch, split_square_by_batch
-from .data_functions import torch_splitter, flatten
+from .domain_decomposition import DomainDecomposition
+from .hyperslab import Hyperslab
 
 class HDF5Dataset(Dataset):
     def __init__(self,
@@ -38,7 +59,12 @@ class HDF5Dataset(Dataset):
                  target_label: Optional[List[str]] = None,
                  flat: bool = False,
                  shuffle: bool = False,
-                 train_fraction = None):
+                 train_fraction = None,
+                 dtype = 'auto',
+                 decomposition: Optional[DomainDecomposition] = None,
+                 roi = None,
+                 domain = None,
+                 level: int = None):
 
         """
         @param path:
@@ -46,6 +72,19 @@ class HDF5Dataset(Dataset):
         @param target:
         @param checkpoints:
         @param batch_size: size of cube that will be used to separate checkpoint data
+        @param dtype: dtype the data is read into (converted by HDF5 on read);
+                      None keeps the dtype stored in the file; 'auto' reads
+                      float32 for torch models and keeps the file dtype 
+                      for flat=True (sklearn models)
+        @param decomposition: read only the subdomain of this process
+                              (DomainDecomposition), input_size is the full domain
+        @param roi: region of interest to read, a (start, stop) per axis or None
+                    for the whole axis; only the region is read from the files
+                    (and, with a strided sampler, only its sampled points)
+        @param domain: physical extent of the data, a (min, max) per axis; 
+                       if given, roi is in physical units, otherwise in cell indices
+        @param level: level of a FilterPyramid file to read (its group 'level_{level}');
+                      by default the dataset named as the feature is read from it
         """
         self.path = path
         self.features = features
@@ -53,18 +92,40 @@ class HDF5Dataset(Dataset):
         self.features_label = features_label
         self.target_label = target_label
         self.checkpoints = checkpoints
-        self.batch_size = batch_size
+        self.batch_size = tuple(batch_size) if batch_size!=None else None
         self.batch_num = batch_num
         self.sampler = sampler
-        self.input_size = input_size
-        self.initial_size = input_size
+        self.input_size = tuple(input_size)
+        self.initial_size = tuple(input_size)
         self.axis = len(self.input_size)
         self.flat = flat
         self.shuffle = shuffle
         self.train_fraction = train_fraction
+        if dtype == 'auto': dtype = None if flat else np.float32
+        self.dtype = dtype
+        self.decomposition = decomposition
+        self.roi = self._roi_selection(roi, domain) if roi!=None else None
+        self.domain = domain
+        self.level = level
+
+        if self.roi:
+            if decomposition:
+                raise ValueError("'roi' cannot be used with 'decomposition': the halo "
+                                 "of the region is not periodic")
+            self.input_size = tuple(s.stop - s.start for s in self.roi)
+
+        if decomposition:
+            #the halo belongs to the whole subdomain, so it can be neither split nor sampled
+            if sampler:
+                raise ValueError("'sampler' cannot be used with 'decomposition': sample the data "
+                                 "beforehand or decompose the sampled domain")
+            if batch_size!=None or batch_num not in [None, 1]:
+                raise ValueError("'batch_size' and 'batch_num' cannot be set with 'decomposition': "
+                                 "every process uses its whole subdomain (with halo) as a single batch")
+            self.input_size = decomposition.local_shape(self.input_size)
 
         if sampler:
-            self.input_size = self.sampler.sample_dim
+            self.input_size = tuple(self.sampler.sample_dim)
             
         if self.batch_size==None and self.batch_num==None: 
             self.batch_num = 1
@@ -83,6 +144,10 @@ class HDF5Dataset(Dataset):
             "data - target_label": self.target_label,
             "data - axis": self.axis,
             "data - shuffle": self.shuffle,
+            "data - dtype": np.dtype(self.dtype).name if self.dtype!=None else None,
+            "data - decomposition": str(self.decomposition) if self.decomposition else None,
+            "data - roi": [(s.start, s.stop) for s in self.roi] if self.roi else None,
+            "data - level": self.level,
             "chkpnt - time": self.checkpoints,
             "chkpnt - initial size": self.initial_size,
             "chkpnt - sample to size": self.input_size,
@@ -97,20 +162,66 @@ class HDF5Dataset(Dataset):
         #return loaded data as a numpy array only
         return self._load_data_numpy()
     
-    def convert_to_torch(self, loaders: np.ndarray):
+    def __iter__(self):
+        #yields the data of one checkpoint at a time, as load_numpy() would for that checkpoint alone
+        for checkpoint in self.checkpoints:
+            x = self._get_input_data(checkpoint, self.features, self.features_label)
+            if self.target!=None: yield x, self._get_input_data(checkpoint, self.target, self.target_label)
+            else: yield x
+    
+    def convert_to_torch(self, loaders: np.ndarray, **loader_kwargs):
         #split into batches and convert numpy to torch dataloader
+        #loader_kwargs: num_workers, pin_memory, prefetch_factor, persistent_workers, batch_sampler
+        #torch is imported only when it's needed, data-only scripts don't pay for it
+        from .data_functions import torch_splitter
         loaders = torch_splitter(loaders, 
                                  batch_num = self.batch_num, 
                                  train_fraction = self.train_fraction,
-                                 shuffle = self.shuffle)
+                                 shuffle = self.shuffle,
+                                 sharded = self.decomposition!=None,
+                                 **loader_kwargs)
         return loaders
     
-    def load(self):
+    def load(self, **loader_kwargs):
         #load numpy, split into batches, convert to torch dataloader, and return it        
         loaders = self.load_numpy()
-        return self.convert_to_torch(loaders)                
+        return self.convert_to_torch(loaders, **loader_kwargs)                
     
         
+    def _group(self, file):
+        #the group of the pyramid level, or the whole file
+        if self.level==None: return file
+        from .pyramid import level_group
+        if level_group(self.level) not in file:
+            raise ValueError("level %d is not in '%s', it has %s"%(self.level, file.filename, list(file.keys())))
+        return file[level_group(self.level)]
+    
+    
+    def _roi_selection(self, roi, domain = None):
+        #roi as slices of the cell indices of every axis
+        if len(roi) != self.axis:
+            raise ValueError("'roi' needs a (start, stop) or None for each of %d axes, but recieved %s"%(self.axis, roi))
+        if domain!=None and len(domain) != self.axis:
+            raise ValueError("'domain' needs a (min, max) for each of %d axes, but recieved %s"%(self.axis, domain))
+        
+        selection = []
+        for i, (bounds, n) in enumerate(zip(roi, self.input_size)):
+            if bounds==None: 
+                selection.append(slice(0, n))
+                continue
+            start, stop = bounds
+            if domain!=None:
+                # cells [start, stop) that overlap the physical bounds
+                xmin, xmax = domain[i]
+                dx = (xmax - xmin)/n
+                start = int(np.floor((start - xmin)/dx + 1e-6))
+                stop = int(np.ceil((stop - xmin)/dx - 1e-6))
+            if not 0 <= start < stop <= n:
+                raise ValueError("'roi' of axis %d is out of bounds: recieved %s for the size %d"%(i, bounds, n))
+            selection.append(slice(start, stop))
+        return tuple(selection)
+    
+    
     def split_batch(self, input_data):
         # columns_length ex: 12 features * 3 dim = 36  
         columns_length = input_data.shape[0]
@@ -128,40 +239,73 @@ class HDF5Dataset(Dataset):
         return relative_path
 
     
-    def _get_input_data(self, checkpoint, columns, labels):
-        all_data = []
-        # combine all features into cube with channels
-                
+    def _read_columns(self, checkpoint, columns, labels):
+        files = []
+        datasets = []
+        nchannels = []
         for col in range(len(columns)):
             file = h5.File(self._get_path(checkpoint, columns[col]), 'r')
+            files.append(file)
+            group = self._group(file)
             
-            if labels==None: key = list(file.keys())[-1]
-            else: key = label[col]
+            if labels!=None: key = labels[col]
+            elif self.level!=None and columns[col] in group: key = columns[col]
+            else: key = list(group.keys())[-1]
 
             print("Loading '%s' from file '%s'"%(key, self._get_path(checkpoint, columns[col])))
             
-            data = file.get(key)
-
-            if (self.axis==3 and len(np.shape(data))==5) or (self.axis==2 and len(np.shape(data))==4):
-                print("Warning: combining axis for %s"%key)
-                data = np.reshape(data, np.append(data.shape[0]*data.shape[1],data.shape[2:]))
+            data = group.get(key)
             
-            if (self.axis==3 and len(np.shape(data))==3) or (self.axis==2 and len(np.shape(data))==2): 
-                data = [data]     
-            all_data.append(data)
+            if len(data.shape)==self.axis+2:
+                print("Warning: combining axis for %s"%key)
+                nchannels.append(data.shape[0]*data.shape[1])
+            elif len(data.shape)==self.axis: nchannels.append(1)
+            else: nchannels.append(data.shape[0])            
+            # select the region in the file, nothing is read yet
+            if self.roi: data = Hyperslab(data, (slice(None),)*(len(data.shape)-self.axis) + self.roi)
+            datasets.append(data)
             print('----------')
-            
+        
         # input_data shape ex: (features, 128, 128, 128) 
-        input_data = np.vstack(all_data)
+        # read every column straight into its channels of a single array,
+        # letting HDF5 convert to the requested dtype on read        
+        dtype = self.dtype if self.dtype!=None else datasets[0].dtype
+        if self.sampler:
+            # only the sampled data is kept in memory (and, for a strided sampler, read)
+            sampled = [self.sampler.read(data) for data in datasets]
+            input_data = np.concatenate([column.reshape((nch,)+column.shape[-self.axis:])
+                                         for column, nch in zip(sampled, nchannels)]).astype(dtype, copy=False)
+            for file in files: file.close()
+            return input_data
+
+        spatial_shape = datasets[0].shape[-self.axis:]
+        if self.decomposition:
+            spatial_shape = self.decomposition.local_shape(spatial_shape)
+        input_data = np.empty((sum(nchannels),)+tuple(spatial_shape), dtype=dtype)
+        
+        start = 0
+        for data, nch in zip(datasets, nchannels):
+            dest = input_data[start:start+nch].reshape(data.shape[:-self.axis]+tuple(spatial_shape))
+            if self.decomposition: self.decomposition.read(data, self.axis, dest)
+            else: data.read_direct(dest)
+            start += nch
+            
+        for file in files: file.close()
+            
+        return input_data
+    
+    def _get_input_data(self, checkpoint, columns, labels):
+        input_data = self._read_columns(checkpoint, columns, labels)
 
-        # downsample if needed
+        # the data is downsampled on read
         if self.sampler:
-            input_data = self.sampler.sample(input_data)
             self.input_size = input_data.shape[1:]
             if self.batch_num==1: self.batch_size = self.input_size
                 
-        if self.flat: return flatten(input_data)
-        elif self.batch_size == self.input_size: return np.array([input_data])
+        if self.flat: 
+            from .data_functions import flatten
+            return flatten(input_data)
+        elif self.batch_size == self.input_size: return input_data[np.newaxis]
         elif len(input_data.shape)==(self.axis+2):             
             nsnaps_to_use = self._check_batch_num(input_data.shape)
             input_data = input_data[:nsnaps_to_use]
@@ -173,32 +317,33 @@ class HDF5Dataset(Dataset):
 
 
     def _load_data_numpy(self) -> Tuple[np.ndarray, np.ndarray]:
-        for i, checkpoint in enumerate(self.checkpoints):
-            features_checkpoint_batch = self._get_input_data(checkpoint, 
-                                                             self.features, self.features_label)
-            
-            if i == 0: x = features_checkpoint_batch
-            else: x = np.vstack((x, features_checkpoint_batch))
+        x = []
+        y = []
+        for checkpoint in self.checkpoints:
+            x.append(self._get_input_data(checkpoint, self.features, self.features_label))
                                         
             if self.target!=None:
-                target_checkpoint_batch = self._get_input_data(checkpoint, 
-                                                               self.target, self.target_label)
-                if i == 0: y = target_checkpoint_batch
-                else: y = np.vstack((y,target_checkpoint_batch))                       
-                
-        if self.target!=None: return x, y
+                y.append(self._get_input_data(checkpoint, self.target, self.target_label))
+        
+        # concatenate once, instead of growing the array checkpoint by checkpoint
+        x = self._concatenate(x)
+        if self.target!=None: return x, self._concatenate(y)
         else: return x
     
     
+    @staticmethod
+    def _concatenate(arrays):
+        if len(arrays)==1: return arrays[0]
+        else: return np.concatenate(arrays)
+    
+    
     def _check_batch_size(self):
         if self.batch_size == None:
             single_batch_dim = (np.prod(self.input_size)/self.batch_num)**(1/self.axis)
             single_batch_dim = np.around(single_batch_dim, decimals=6)
             if single_batch_dim.is_integer() == False: 
                 raise ValueError('Incorrect number of batches - input data cannot be evenly split')
-            self.batch_size = []
-            for i in range(self.axis):
-                self.batch_size.append(int(single_batch_dim))    
+            self.batch_size = (int(single_batch_dim),)*self.axis
         else: return
         
         
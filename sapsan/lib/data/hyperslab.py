@@ -0,0 +1,73 @@
+"""
+A region of an h5py dataset that reads like the dataset itself
+
+Selections on a Hyperslab (slices with steps, integers, Ellipsis) are
+composed with the region and passed to h5py as a single hyperslab, so
+only the selected points are read from the file, e.g.
+
+    region = Hyperslab(file['u'], (slice(None), slice(0, 64), slice(0, 64), slice(0, 32)))
+    region.shape            # (3, 64, 64, 32)
+    region[..., ::4, ::4, ::2]   # reads 16x16x16 points of the file
+"""
+
+import numpy as np
+
+
+class Hyperslab():
+    def __init__(self, dataset, selection):
+        """
+        @param dataset: h5py dataset (or anything with shape, dtype and numpy indexing)
+        @param selection: a slice (step >= 1) per axis, missing trailing axes are whole
+        """
+        selection = tuple(selection) + (slice(None),)*(len(dataset.shape) - len(selection))
+        self.dataset = dataset
+        self.ranges = [range(*s.indices(n)) for s, n in zip(selection, dataset.shape)]
+        for r in self.ranges:
+            if r.step < 1: raise ValueError("Hyperslab steps have to be positive, but recieved %d"%r.step)
+
+    @property
+    def shape(self):
+        return tuple(len(r) for r in self.ranges)
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def chunks(self):
+        return getattr(self.dataset, 'chunks', None)
+
+    @property
+    def selection(self):
+        #the region as a selection of the dataset
+        return self._compose(())
+
+    def _compose(self, key):
+        #the selection of the dataset that 'key' selects from the region
+        if not isinstance(key, tuple): key = (key,)
+        if Ellipsis in key:
+            position = key.index(Ellipsis)
+            key = key[:position] + (slice(None),)*(len(self.ranges) - len(key) + 1) + key[position+1:]
+        key = key + (slice(None),)*(len(self.ranges) - len(key))
+
+        selection = []
+        for r, k in zip(self.ranges, key):
+            if isinstance(k, slice) and k.step is not None and k.step < 1:
+                raise ValueError("Hyperslab steps have to be positive, but recieved %d"%k.step)
+            r = r[k]
+            if isinstance(r, range): r = slice(r.start, r.start + len(r)*r.step, r.step)
+            selection.append(r)
+        return tuple(selection)
+
+    def __getitem__(self, key):
+        return self.dataset[self._compose(key)]
+
+    def read_direct(self, dest, source_sel=None, dest_sel=None):
+        source_sel = self._compose(source_sel if source_sel is not None else ())
+        if hasattr(self.dataset, 'read_direct'):
+            self.dataset.read_direct(dest, source_sel=source_sel, dest_sel=dest_sel)
+        else:
+            dest[dest_sel if dest_sel is not None else ()] = self.dataset[source_sel]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[()], dtype=dtype)
@@ -0,0 +1,394 @@
+"""
+Random patch datasets
+
+Patches (sub-cubes) are drawn at random positions every epoch, instead of
+the fixed grid of split_cube_by_batch, and read at __getitem__ time.
+
+ArrayPatchDataset crops the patches from arrays, loaded (e.g. by
+HDF5Dataset.load_numpy) or memory-mapped (np.memmap, np.load(mmap_mode='r')),
+without copying the arrays.
+
+HDF5PatchDataset reads the patches straight from the files of an HDF5Dataset.
+Patches are grouped by the HDF5 chunks they touch and decompressed chunks are
+kept in an LRU cache bounded in memory, so random patches of chunked,
+compressed data don't decompress the same chunks over and over.
+
+Usage:
+    data_loader = HDF5Dataset(path="/path/to/data.h5",
+                              features=['u'], target=['tn'],
+                              checkpoints=[0, 1], input_size=(512,512,512))
+
+    patches = HDF5PatchDataset(data_loader, patch_size=(32,32,32),
+                               npatches=1024, seed=0, cache_size=1024**3)
+    loader = patches.loader(batch_num=16)
+    ...
+    print(patches.cache.stats())
+
+Patches can be randomly flipped and rotated by multiples of 90 degrees (flip,
+rotate). Vector and rank-2 tensor components listed in 'vectors' are
+permuted and negated along with the axes, e.g. vectors=[[(0,1,2)], [range(9)]]
+for x = u (3 components) and y = its 3x3 tensor; component k of a vector
+is along the spatial axis k of the array. Positions and augmentations of
+every patch follow from (seed, epoch, index), so they are reproducible.
+
+The epoch is a part of the index (epoch*npatches + i), which EpochSampler
+(used by .loader()) advances every pass, so new patches are drawn every epoch,
+also in persistent worker processes. Every worker process has its own cache.
+"""
+
+import os
+import itertools
+from collections import OrderedDict
+import numpy as np
+import h5py as h5
+import torch
+from torch.utils.data import Dataset, Sampler, BatchSampler
+
+from .data_functions import make_loader, to_float_tensor
+
+
+class ChunkCache():
+    def __init__(self, max_bytes: int = 256*1024**2):
+        """
+        LRU cache of decompressed chunks
+        @param max_bytes: memory bound of the cached chunks
+        """
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, read):
+        """
+        @param key: id of the chunk
+        @param read: function reading the chunk on a cache miss
+        """
+        if key in self.chunks:
+            self.hits += 1
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+
+        self.misses += 1
+        chunk = read()
+        if chunk.nbytes <= self.max_bytes:
+            self.chunks[key] = chunk
+            self.nbytes += chunk.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.chunks.popitem(last=False)[1].nbytes
+        return chunk
+
+    @property
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'nbytes': self.nbytes, 'nchunks': len(self.chunks)}
+
+    def clear(self):
+        self.chunks.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+class EpochSampler(Sampler):
+    """
+    Yields the indices of the next epoch on every pass, epoch*len(dataset) + i,
+    so that a PatchDataset draws new patches every epoch
+    """
+    def __init__(self, dataset, shuffle: bool = False, seed: int = None):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __iter__(self):
+        n = len(self.dataset)
+        if self.shuffle: order = np.random.default_rng([self.seed or 0, self.epoch]).permutation(n)
+        else: order = np.arange(n)
+        start = self.epoch * n
+        self.epoch += 1
+        return iter((start + order).tolist())
+
+
+class PatchDataset(Dataset):
+    def __init__(self,
+                 shape,
+                 patch_size,
+                 npatches: int,
+                 nsnaps: int = 1,
+                 seed: int = None,
+                 flip: bool = False,
+                 rotate: bool = False,
+                 vectors = None):
+        """
+        @param shape: spatial shape of a snapshot
+        @param patch_size: spatial shape of a patch
+        @param npatches: number of patches per epoch
+        @param nsnaps: number of snapshots the patches are drawn from
+        @param seed: seed of the patch positions; the same seed draws the same patches
+        @param flip: randomly reverse every spatial axis
+        @param rotate: randomly rotate by multiples of 90 degrees (cubic patches only);
+                       with flip, any symmetry of the cube
+        @param vectors: for every returned tensor (x, y), a list of its channel groups
+                        that are vectors (axis channels) or rank-2 tensors (axis**2
+                        channels, row-major) to transform along with the axes
+        """
+        self.shape = tuple(shape)
+        self.patch_size = tuple(patch_size)
+        self.axis = len(self.shape)
+        self.npatches = npatches
+        self.nsnaps = nsnaps
+        self.seed = seed if seed != None else int(np.random.SeedSequence().entropy % 2**32)
+        if len(self.patch_size) != self.axis or any(p > n for p, n in zip(self.patch_size, self.shape)):
+            raise ValueError("patch_size %s doesn't fit into the data of size %s"%(self.patch_size, self.shape))
+        if rotate and len(set(self.patch_size)) > 1:
+            raise ValueError("'rotate' requires a cubic patch_size, but recieved %s"%(self.patch_size,))
+        self.flip = flip
+        self.rotate = rotate
+        self.vectors = [[tuple(group) for group in groups] for groups in vectors] if vectors else []
+        for groups in self.vectors:
+            for group in groups:
+                if len(group) not in [self.axis, self.axis**2]:
+                    raise ValueError("vectors need %d (vector) or %d (tensor) channels, but recieved %s"%(
+                                     self.axis, self.axis**2, group))
+        self._epoch = None
+
+    def __len__(self):
+        return self.npatches
+
+    def draw(self, epoch: int):
+        """
+        Snapshot indices and patch origins of the epoch
+        """
+        rng = np.random.default_rng([self.seed, epoch])
+        snaps = rng.integers(self.nsnaps, size=self.npatches)
+        origins = rng.integers(0, np.array(self.shape) - np.array(self.patch_size) + 1,
+                               size=(self.npatches, self.axis))
+        return snaps, origins
+
+    def positions(self, epoch: int):
+        #patches of the last epoch are kept, so that they are drawn once per process
+        if self._epoch != epoch:
+            self._snaps, self._origins = self.draw(epoch)
+            self._epoch = epoch
+        return self._snaps, self._origins
+
+    def __getitem__(self, index):
+        epoch, i = divmod(int(index), self.npatches)
+        snaps, origins = self.positions(epoch)
+        patches = self.read(int(snaps[i]), tuple(int(o) for o in origins[i]))
+        if self.flip or self.rotate:
+            permutation, signs = self.symmetry(np.random.default_rng([self.seed, epoch, i]))
+            patches = tuple(self.transform(patch, permutation, signs,
+                                           self.vectors[n] if n < len(self.vectors) else [])
+                            for n, patch in enumerate(patches))
+        return patches
+
+    def symmetry(self, rng):
+        """
+        A random symmetry x'_m = signs[m] * x_permutation[m] of the patch
+        """
+        permutation = rng.permutation(self.axis) if self.rotate else np.arange(self.axis)
+        signs = rng.choice([-1, 1], size=self.axis) if self.flip else np.ones(self.axis, dtype=int)
+        if self.rotate and not self.flip:
+            #a proper rotation: an odd permutation is compensated by a reflection
+            parity = np.linalg.det(np.eye(self.axis)[permutation])
+            signs = rng.choice([-1, 1], size=self.axis)
+            if np.prod(signs) != parity: signs[-1] *= -1
+        return permutation, signs
+
+    def transform(self, patch, permutation, signs, vectors = []):
+        #moves the spatial axes and transforms the vector and tensor components alike
+        patch = patch.permute((0,) + tuple(1 + int(p) for p in permutation))
+        patch = patch.flip([1 + m for m in range(self.axis) if signs[m] < 0])
+        patch = patch.clone()
+        source = patch.clone() if vectors else None
+        for group in vectors:
+            if len(group) == self.axis:
+                for m in range(self.axis):
+                    patch[group[m]] = signs[m] * source[group[permutation[m]]]
+            else:
+                for m, n in itertools.product(range(self.axis), repeat=2):
+                    patch[group[m*self.axis + n]] = signs[m] * signs[n] * \
+                        source[group[permutation[m]*self.axis + permutation[n]]]
+        return patch
+
+    def read(self, snap: int, origin):
+        """
+        @return: tuple of tensors of the patch at 'origin' of the snapshot 'snap'
+        """
+        raise NotImplementedError
+
+    def loader(self, batch_num: int = 1, shuffle: bool = False, **loader_kwargs):
+        """
+        DataLoader drawing new patches every epoch, see make_loader() for loader_kwargs
+        """
+        sampler = EpochSampler(self, shuffle=shuffle, seed=self.seed)
+        return make_loader(self, batch_sampler=lambda dataset: BatchSampler(sampler, batch_num, drop_last=False),
+                           **loader_kwargs)
+
+
+class ArrayPatchDataset(PatchDataset):
+    def __init__(self,
+                 x: np.ndarray,
+                 y: np.ndarray = None,
+                 patch_size = None,
+                 npatches: int = None,
+                 seed: int = None,
+                 flip: bool = False,
+                 rotate: bool = False,
+                 vectors = None):
+        """
+        @param x, y: arrays of shape (snapshots, channels, *spatial), e.g. from
+                     HDF5Dataset.load_numpy(); np.memmap reads only the patches
+        @param npatches: number of patches per epoch, by default as many as
+                         the fixed grid of patch_size would give
+        @param flip, rotate, vectors: random symmetries of the patches, see PatchDataset
+        """
+        self.arrays = [x] if y is None else [x, y]
+        shape = x.shape[2:]
+        if npatches == None: npatches = len(x) * int(np.prod(np.array(shape) // np.array(patch_size)))
+        super().__init__(shape = shape,
+                         patch_size = patch_size,
+                         npatches = npatches,
+                         nsnaps = len(x),
+                         seed = seed,
+                         flip = flip,
+                         rotate = rotate,
+                         vectors = vectors)
+
+    def read(self, snap: int, origin):
+        region = (snap, slice(None)) + tuple(slice(o, o+p) for o, p in zip(origin, self.patch_size))
+        return tuple(to_float_tensor(array[region]) for array in self.arrays)
+
+
+class HDF5PatchDataset(PatchDataset):
+    def __init__(self,
+                 dataset,
+                 patch_size,
+                 npatches: int,
+                 seed: int = None,
+                 cache_size: int = 256*1024**2,
+                 align: bool = False,
+                 group_by_chunk: bool = True,
+                 flip: bool = False,
+                 rotate: bool = False,
+                 vectors = None):
+        """
+        @param dataset: HDF5Dataset with the files, features, target, checkpoints,
+                        dtype and roi to read the patches from
+        @param cache_size: memory bound of the chunk cache (per process), bytes
+        @param align: snap the patch origins to the chunk grid, so that a patch
+                      touches as few chunks as possible
+        @param group_by_chunk: order the patches of an epoch by the chunk they start in,
+                               so that the patches sharing chunks are read together;
+                               neighbouring patches then end up in the same batches
+        @param flip, rotate, vectors: random symmetries of the patches, see PatchDataset
+        """
+        self.dataset = dataset
+        self.align = align
+        self.group_by_chunk = group_by_chunk
+        self.cache = ChunkCache(cache_size)
+        self.offset = tuple(s.start for s in dataset.roi) if dataset.roi else (0,)*dataset.axis
+        self._files = {}
+        self._pid = None
+        super().__init__(shape = tuple(s.stop - s.start for s in dataset.roi) if dataset.roi else dataset.initial_size,
+                         patch_size = patch_size,
+                         npatches = npatches,
+                         nsnaps = len(dataset.checkpoints),
+                         seed = seed,
+                         flip = flip,
+                         rotate = rotate,
+                         vectors = vectors)
+        self.tile = self._tile()
+
+    def _columns(self, checkpoint):
+        #(path, dataset name) of the features, and of the target;
+        #the datasets of a pyramid level are named by the feature
+        def columns(features, labels):
+            labels = labels or [None]*len(features)
+            return [(self.dataset._get_path(checkpoint, feature),
+                     label if label != None or self.dataset.level == None else feature)
+                    for feature, label in zip(features, labels)]
+        if self.dataset.target == None: return [columns(self.dataset.features, self.dataset.features_label)]
+        return [columns(self.dataset.features, self.dataset.features_label),
+                columns(self.dataset.target, self.dataset.target_label)]
+
+    def _open(self, path, label):
+        #files are opened by every (worker) process on first use
+        if self._pid != os.getpid():
+            self._files = {}
+            self._pid = os.getpid()
+        if path not in self._files: self._files[path] = h5.File(path, 'r')
+        group = self.dataset._group(self._files[path])
+        return group[label if label != None else list(group.keys())[-1]]
+
+    def _tile(self):
+        #spatial chunk shape of the first feature, the unit of the cache and of the patch grouping
+        data = self._open(*self._columns(self.dataset.checkpoints[0])[0][0])
+        if data.chunks == None: return None
+        return tuple(data.chunks[-self.axis:])
+
+    def draw(self, epoch: int):
+        snaps, origins = super().draw(epoch)
+        if self.tile == None: return snaps, origins
+        tile = np.array(self.tile)
+        offset = np.array(self.offset)
+        if self.align:
+            #chunk boundaries (in the file) at or before the drawn origins, within the data
+            aligned = (origins + offset)//tile*tile - offset
+            origins = np.where(aligned >= 0, aligned, origins)
+        if self.group_by_chunk:
+            first_chunk = (origins + offset)//tile
+            order = np.lexsort(tuple(first_chunk.T[::-1]) + (snaps,))
+            snaps, origins = snaps[order], origins[order]
+        return snaps, origins
+
+    def read(self, snap: int, origin):
+        checkpoint = self.dataset.checkpoints[snap]
+        patches = []
+        for columns in self._columns(checkpoint):
+            channels = [self._read_patch(path, label, origin) for path, label in columns]
+            patches.append(torch.from_numpy(np.concatenate(channels)))
+        return tuple(patches)
+
+    def _read_patch(self, path, label, origin):
+        data = self._open(path, label)
+        nlead = len(data.shape) - self.axis
+        start = [o + offset for o, offset in zip(origin, self.offset)]
+        stop = [s + p for s, p in zip(start, self.patch_size)]
+        dtype = self.dataset.dtype if self.dataset.dtype != None else data.dtype
+
+        if data.chunks == None:
+            #contiguous data: a single hyperslab, nothing to decompress
+            patch = data[(slice(None),)*nlead + tuple(slice(a, b) for a, b in zip(start, stop))]
+            return patch.astype(dtype, copy=False).reshape((-1,)+self.patch_size)
+
+        tile = data.chunks[nlead:]
+        patch = np.empty(data.shape[:nlead] + self.patch_size, dtype=dtype)
+        ranges = [range(a//t, (b-1)//t + 1) for a, b, t in zip(start, stop, tile)]
+        for index in itertools.product(*ranges):
+            lo = [i*t for i, t in zip(index, tile)]
+            hi = [min(l + t, n) for l, t, n in zip(lo, tile, data.shape[nlead:])]
+            chunk_sel = (slice(None),)*nlead + tuple(slice(l, h) for l, h in zip(lo, hi))
+            chunk = self.cache.get((path, data.name, index), lambda: data[chunk_sel])
+            #the part of the chunk within the patch
+            a = [max(s, l) for s, l in zip(start, lo)]
+            b = [min(s, h) for s, h in zip(stop, hi)]
+            patch[(Ellipsis,) + tuple(slice(x-s, y-s) for x, y, s in zip(a, b, start))] = \
+                chunk[(Ellipsis,) + tuple(slice(x-l, y-l) for x, y, l in zip(a, b, lo))]
+        return patch.reshape((-1,)+self.patch_size)
+
+    def __getstate__(self):
+        #open files can't be sent to worker processes
+        state = self.__dict__.copy()
+        state['_files'] = {}
+        state['_pid'] = None
+        return state
@@ -0,0 +1,270 @@
+"""
+Out-of-core preprocessing of raw snapshots into training data
+
+Computes the filtered features, their gradients and the stress tensor
+(as in sapsan.utils.physics.tensor) slab by slab along the first spatial
+axis, so only a few slabs of a snapshot are in memory at a time. Every
+slab is read with a halo that covers the filter (and gradient) stencil,
+the halo is cropped after the computation, hence the result is identical
+to processing the whole field at once. Slabs are computed in a process
+pool and written by the main process into chunked HDF5 datasets:
+
+    {feature}       filtered feature, e.g. u: (3, D, H, W)
+    grad_{feature}  its gradient, (3, 3, D, H, W): d u_i / d x_j
+    tn              stress tensor of the 'tensor' feature, (3, 3, D, H, W)
+
+Usage:
+    preprocessor = Preprocessor(features = ['u'], filt_size = 2, tensor = 'u', nproc = 8)
+    preprocessor.build(input_path = "raw/t{checkpoint:1.0f}/{feature}.h5",
+                       output_path = "train/t{checkpoint:1.0f}/{feature}_filtered.h5",
+                       checkpoints = [0, 1])
+
+    data_loader = HDF5Dataset(path = "train/t{checkpoint:1.0f}/{feature}_filtered.h5",
+                              features = ['u', 'grad_u'], target = ['tn'], checkpoints = [0, 1],
+                              input_size = [1024,1024,1024])
+
+or from the command line:
+    sapsan preprocess "raw/t{checkpoint:1.0f}/{feature}.h5" "train/t{checkpoint:1.0f}/{feature}_filtered.h5" \\
+                      --checkpoints 0,1 --filt-size 2 --nproc 8
+
+The filter is gaussian (filt_size is sigma, as in sapsan.utils.filters.gaussian);
+a spectral filter is global and can't be computed slab by slab.
+"""
+
+import os
+import numpy as np
+import h5py as h5
+from concurrent.futures import ProcessPoolExecutor
+
+from .domain_decomposition import DomainDecomposition
+
+
+class Preprocessor():
+    #bytes of (float64) input data per slab
+    max_read = 256*2**20
+
+    def __init__(self,
+                 features = ['u'],
+                 features_label = None,
+                 filt_size: float = 2,
+                 truncate: float = 4.0,
+                 gradients: bool = True,
+                 tensor: str = 'u',
+                 only_x_components: bool = False,
+                 factor: int = 1,
+                 axis: int = 3,
+                 periodic: bool = False,
+                 dx: float = 1,
+                 nproc: int = 1,
+                 slab_size: int = None,
+                 chunk_size: int = 32,
+                 dtype = np.float32):
+        """
+        @param features: raw features to filter, they fill {feature} of the input path
+        @param features_label: dataset names in the input files, the last dataset by default
+        @param filt_size: sigma of the gaussian filter; 0 keeps the features unfiltered
+        @param truncate: truncate the filter at this many sigmas
+        @param gradients: write the gradients of the filtered features
+        @param tensor: feature to compute the stress tensor 'tn' of, None to skip it
+        @param only_x_components: compute only the tn[0] components, as in utils.physics.tensor
+        @param factor: downsample the results by taking every factor-th point
+        @param axis: number of spatial (last) axes, the leading ones are channels
+        @param periodic: periodic boundaries ('wrap'), otherwise 'reflect' as in utils.physics.tensor
+        @param dx: grid spacing of the gradients
+        @param nproc: number of processes computing the slabs
+        @param slab_size: thickness of a slab in grid points, derived from max_read by default
+        @param chunk_size: edge of the HDF5 chunks of the outputs
+        """
+        if tensor != None and tensor not in features:
+            raise ValueError("tensor has to be one of the features %s, but recieved '%s'"%(features, tensor))
+        if features_label != None and len(features_label) != len(features):
+            raise ValueError("'features_label' needs a label for each of the features %s, but recieved %s"%(
+                             features, features_label))
+        self.features = list(features)
+        self.features_label = features_label
+        self.filt_size = filt_size
+        self.truncate = truncate
+        self.gradients = gradients
+        self.tensor = tensor
+        self.only_x_components = only_x_components
+        self.factor = int(factor)
+        self.axis = axis
+        self.periodic = periodic
+        self.dx = dx
+        self.nproc = nproc
+        self.slab_size = slab_size
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+
+    @property
+    def halo(self):
+        #filter radius (as in scipy.ndimage) + 1 cell for the central differences
+        return int(self.truncate*self.filt_size + 0.5) + int(self.gradients)
+
+    def outputs(self, shapes: dict):
+        """
+        @param shapes: {feature: leading (channel) shape of its raw dataset}
+        @return: {output name: its leading shape}
+        """
+        outputs = {}
+        for feature in self.features:
+            outputs[feature] = shapes[feature]
+            if self.gradients: outputs['grad_'+feature] = shapes[feature] + (self.axis,)
+        if self.tensor != None:
+            ncomp = int(np.prod(shapes[self.tensor]))
+            outputs['tn'] = (ncomp,) if self.only_x_components else (ncomp, ncomp)
+        return outputs
+
+    def slabs(self, shape, itemsize: int = 8):
+        """
+        Splits the first spatial axis into slabs aligned to the output chunks
+        @param shape: shape of all the raw features read per slab, (channels, D, H, W)
+        @return: list of (start, stop)
+        """
+        n = shape[-self.axis]
+        unit = self.factor*self.chunk_size
+        if self.slab_size != None: size = self.slab_size
+        else:
+            plane = np.prod(shape[:-self.axis]) * np.prod(shape[-self.axis+1:]) * itemsize
+            size = int(self.max_read // max(plane, 1))
+            #at least one slab per process
+            size = min(size, -(-n // self.nproc))
+        size = max(unit, size // unit * unit)
+        return [(start, min(start+size, n)) for start in range(0, n, size)]
+
+    def _filter(self, field, nlead):
+        from scipy import ndimage
+        if self.filt_size == 0: return field
+        return ndimage.gaussian_filter(field, (0,)*nlead + (self.filt_size,)*self.axis, truncate=self.truncate,
+                                       mode='wrap' if self.periodic else 'reflect')
+
+    def _gradient(self, field, nlead):
+        #d field / d x_j stacked along a new axis after the channels
+        axes = range(nlead, nlead+self.axis)
+        if self.periodic:
+            return np.stack([(np.roll(field, -1, ax)-np.roll(field, 1, ax))/(2*self.dx) for ax in axes], axis=nlead)
+        return np.stack(np.gradient(field, self.dx, axis=tuple(axes)), axis=nlead)
+
+    def _read_slab(self, path, key, start, stop):
+        #[start-halo, stop+halo) of the first spatial axis, wrapped if periodic, otherwise clipped
+        with h5.File(path, 'r') as file:
+            dataset = file[key]
+            nlead = len(dataset.shape) - self.axis
+            n = dataset.shape[nlead]
+            before, after = self.halo, self.halo
+            if not self.periodic: before, after = min(before, start), min(after, n-stop)
+            slab = np.empty(dataset.shape[:nlead] + (stop-start+before+after,) + dataset.shape[nlead+1:])
+            for source, dest in DomainDecomposition._wrap(start-before, stop+after, n):
+                dataset.read_direct(slab, source_sel=(slice(None),)*nlead+(source,),
+                                    dest_sel=(slice(None),)*nlead+(dest,))
+        return slab, before
+
+    def process_slab(self, sources: dict, start: int, stop: int):
+        """
+        Computes the outputs on [start, stop) of the first spatial axis
+        @param sources: {feature: (path, key)}
+        @return: {output name: array}
+        """
+        results = {}
+        for feature, (path, key) in sources.items():
+            u, before = self._read_slab(path, key, start, stop)
+            nlead = len(u.shape) - self.axis
+            interior = (slice(None),)*nlead + (slice(before, before+stop-start),)
+
+            filtered = self._filter(u, nlead)
+            results[feature] = filtered[interior]
+            if self.gradients:
+                results['grad_'+feature] = self._gradient(filtered, nlead)[(slice(None),)+interior]
+
+            if feature == self.tensor:
+                u = u.reshape((-1,)+u.shape[nlead:])
+                filtered = filtered.reshape(u.shape)
+                ncomp = u.shape[0]
+                tn = np.empty((1 if self.only_x_components else ncomp, ncomp, stop-start)+u.shape[2:])
+                for i in range(tn.shape[0]):
+                    for j in range(ncomp):
+                        tn[i,j] = (self._filter(u[i]*u[j], 0)-filtered[i]*filtered[j])[before:before+stop-start]
+                results['tn'] = tn[0] if self.only_x_components else tn
+
+        #slabs start at multiples of the factor
+        strides = (Ellipsis,) + (slice(None, None, self.factor),)*self.axis
+        return {name: result[strides].astype(self.dtype) for name, result in results.items()}
+
+    def build(self,
+              input_path: str,
+              output_path: str,
+              checkpoints = [0],
+              time_granularity: float = 1):
+        """
+        Preprocesses every checkpoint, holding at most 2*nproc slabs in memory
+        @param input_path: template of the raw data paths with {checkpoint} and {feature},
+                           as in HDF5Dataset
+        @param output_path: template of the output paths with {checkpoint}, and {feature}
+                            to write every output into its own file
+        @return: paths of the written files
+        """
+        paths = []
+        with ProcessPoolExecutor(self.nproc) if self.nproc > 1 else _SerialExecutor() as executor:
+            for checkpoint in checkpoints:
+                paths += self._build_checkpoint(executor, input_path, output_path, time_granularity*checkpoint)
+        return paths
+
+    def _build_checkpoint(self, executor, input_path, output_path, timestep):
+        sources, shapes, spatial = {}, {}, None
+        for i, feature in enumerate(self.features):
+            path = input_path.format(checkpoint=timestep, feature=feature)
+            with h5.File(path, 'r') as file:
+                key = self.features_label[i] if self.features_label else list(file.keys())[-1]
+                shape = file[key].shape
+            if spatial != None and shape[-self.axis:] != spatial:
+                raise ValueError("'%s' in '%s' has a spatial shape %s, but the other features have %s"%(
+                                 key, path, shape[-self.axis:], spatial))
+            spatial = shape[-self.axis:]
+            sources[feature] = (path, key)
+            shapes[feature] = shape[:-self.axis]
+
+        nchannels = sum(int(np.prod(shape)) for shape in shapes.values())
+        slabs = self.slabs((nchannels,)+spatial)
+        output_spatial = tuple(-(-n // self.factor) for n in spatial)
+        print("Preprocessing %s at checkpoint %s in %d slabs of %s"%(self.features, timestep, len(slabs), spatial))
+
+        files, datasets = {}, {}
+        try:
+            for name, lead in self.outputs(shapes).items():
+                path = output_path.format(checkpoint=timestep, feature=name)
+                if path not in files:
+                    if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+                    files[path] = h5.File(path, 'w')
+                chunks = lead + tuple(min(self.chunk_size, n) for n in output_spatial)
+                datasets[name] = files[path].create_dataset(name, shape=lead+output_spatial,
+                                                            dtype=self.dtype, chunks=chunks)
+
+            pending = []
+            def write(future, start):
+                first = start//self.factor
+                for name, result in future.result().items():
+                    region = (slice(first, first+result.shape[-self.axis]),) + (slice(None),)*(self.axis-1)
+                    datasets[name][(Ellipsis,)+region] = result
+
+            for start, stop in slabs:
+                pending.append((executor.submit(self.process_slab, sources, start, stop), start))
+                if len(pending) >= 2*self.nproc: write(*pending.pop(0))
+            while pending: write(*pending.pop(0))
+        finally:
+            for file in files.values(): file.close()
+        return list(files)
+
+
+class _SerialExecutor():
+    #runs the slabs in the main process when nproc = 1
+
+    class _Result():
+        def __init__(self, value): self.value = value
+        def result(self): return self.value
+
+    def submit(self, function, *args):
+        return self._Result(function(*args))
+
+    def __enter__(self): return self
+
+    def __exit__(self, *args): return False
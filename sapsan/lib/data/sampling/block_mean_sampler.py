@@ -0,0 +1,17 @@
+import numpy as np
+from sapsan.lib.data.sampling.down_sampler import DownSampling
+
+
+class BlockMeanSampling(DownSampling):
+    """
+    Averages non-overlapping blocks of scale points along every axis
+    (a box filter followed by a stride), e.g. (128,128,64) -> (32,32,32)
+    averages 4x4x2 blocks. The data size has to be a multiple of the target size.
+    """
+
+    def _sample(self, data: np.ndarray, scales, halo = (0, 0)):
+        nlead = len(data.shape) - len(self.target_dim)
+        blocks = data.shape[:nlead]
+        for n, scale in zip(data.shape[nlead:], scales):
+            blocks += (n // scale, scale)
+        return data.reshape(blocks).mean(axis=tuple(range(nlead+1, len(blocks), 2)))
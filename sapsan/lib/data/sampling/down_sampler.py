@@ -0,0 +1,97 @@
+"""
+Base class of the samplers that downsample the spatial axes of the data
+
+The last len(target_dim) axes of the data are sampled, every axis by its own
+integer factor (original_dim // target_dim), so the target can be anisotropic,
+e.g. (64, 64, 32). Leading (batch, channel) axes are kept as they are.
+
+read() samples an h5py dataset without loading it whole: the dataset is
+read in slabs along the first sampled axis, every slab (plus the halo
+a filter needs) is sampled, so only the sampled data is kept in memory.
+"""
+
+import numpy as np
+
+from sapsan.core.models import Sampling
+from sapsan.lib.data.domain_decomposition import DomainDecomposition
+
+
+class DownSampling(Sampling):
+    #max size of a slab read from the file at once, bytes
+    max_read = 256*1024**2
+    #read the halo across the boundary of the domain (periodic data)
+    periodic = True
+
+    def __init__(self, target_dim):
+        """
+        @param target_dim: shape to sample the spatial axes to
+        """
+        self.target_dim = tuple(target_dim)
+
+    @property
+    def sample_dim(self):
+        return self.target_dim
+
+    def scales(self, original_dim):
+        #integer sampling factor of every axis
+        original_dim = tuple(original_dim)
+        if len(original_dim) != len(self.target_dim) or any(t > n for n, t in zip(original_dim, self.target_dim)):
+            raise ValueError("Cannot sample the data of size %s into size %s"%(original_dim, self.target_dim))
+        if any(n % t for n, t in zip(original_dim, self.target_dim)):
+            raise ValueError("%s requires the data size %s to be a multiple of the target size %s"%(
+                             type(self).__name__, original_dim, self.target_dim))
+        return tuple(n // t for n, t in zip(original_dim, self.target_dim))
+
+    def halo(self, scales):
+        #number of extra input cells needed on each side of a slab along the first axis
+        return 0
+
+    def sample(self, data: np.ndarray):
+        original_dim = data.shape[-len(self.target_dim):]
+        print("Sampling the input data of size", original_dim, "into size", self.target_dim)
+        return self._sample(data, self.scales(original_dim))
+
+    def _sample(self, data: np.ndarray, scales, halo = (0, 0)):
+        """
+        Samples the data; halo = (before, after) cells at the ends of
+        the first sampled axis are used, but are not a part of the output
+        """
+        raise NotImplementedError
+
+    def read(self, dataset):
+        """
+        Reads & samples an h5py dataset (or any array) slab by slab
+        """
+        ndim = len(self.target_dim)
+        nlead = len(dataset.shape) - ndim
+        original_dim = dataset.shape[nlead:]
+        scales = self.scales(original_dim)
+        halo = self.halo(scales)
+        print("Sampling the input data of size", original_dim, "into size", self.target_dim)
+
+        sampled = None
+        #number of output planes per slab
+        plane = np.prod(dataset.shape[:nlead]+original_dim[1:]) * dataset.dtype.itemsize * scales[0]
+        step = max(1, int(self.max_read // max(plane, 1)))
+        for start in range(0, self.target_dim[0], step):
+            stop = min(start+step, self.target_dim[0])
+            slab, slab_halo = self.read_slab(dataset, nlead, start*scales[0], stop*scales[0], halo)
+            result = self._sample(slab, scales, slab_halo)
+            if sampled is None: sampled = np.empty(result.shape[:nlead]+self.target_dim, dtype=result.dtype)
+            sampled[(Ellipsis, slice(start, stop))+(slice(None),)*(ndim-1)] = result
+        return sampled
+
+    def read_slab(self, dataset, nlead: int, start: int, stop: int, halo: int = 0):
+        """
+        Reads [start-halo, stop+halo) of the first sampled axis; the halo wraps
+        around the domain if periodic, otherwise it's clipped
+        @return: slab, (before, after) halo cells
+        """
+        n = dataset.shape[nlead]
+        before, after = halo, halo
+        if not self.periodic: before, after = min(halo, start), min(halo, n-stop)
+        shape = dataset.shape[:nlead] + (stop-start+before+after,) + dataset.shape[nlead+1:]
+        slab = np.empty(shape, dtype=dataset.dtype)
+        for source, dest in DomainDecomposition._wrap(start-before, stop+after, n):
+            slab[(slice(None),)*nlead+(dest,)] = dataset[(slice(None),)*nlead+(source,)]
+        return slab, (before, after)
@@ -1,43 +1,52 @@
 import numpy as np
-from sapsan.core.models import Sampling
+from sapsan.lib.data.sampling.down_sampler import DownSampling
 
 
-class EquidistantSampling(Sampling):
-    def __init__(self, target_dim):
-        self.target_dim = target_dim
+class EquidistantSampling(DownSampling):
+    """
+    Takes every scale-th point along every axis; the axes can be sampled
+    by different factors, e.g. (128,128,64) -> (32,32,32).
+    An h5py dataset is read as a strided hyperslab, so only the sampled
+    points are read from the file.
+    """
 
     @property
     def scale(self):
-        return int(self.original_dim[0] / self.target_dim[0])
+        return self.scales(self.original_dim)[0]
 
-    @property
-    def sample_dim(self):
-        return self.target_dim
+    def scales(self, original_dim):
+        original_dim = tuple(original_dim)
+        if len(original_dim) != len(self.target_dim) or any(t > n for n, t in zip(original_dim, self.target_dim)):
+            raise ValueError("Cannot sample the data of size %s into size %s"%(original_dim, self.target_dim))
+        return tuple(n // t for n, t in zip(original_dim, self.target_dim))
 
     def dim_warning(self, new_dim):
-        if self.target_dim not in [new_dim, new_dim[1:]]: 
+        if self.target_dim not in [new_dim, new_dim[1:]]:
             print("Warning: couldn't cover the whole domain and sample to ", self.target_dim,
                   ", new sampled shape is ", new_dim)
-    
+
     def sample(self, data: np.ndarray):
         self.original_dim = data.shape[-len(self.target_dim):]
 
         print("Sampling the input data of size", self.original_dim, "into size", self.target_dim)
-        
-        one_dim = self.original_dim[0]
-        for i in self.original_dim:
-            if i==one_dim: pass
-            else: 
-                raise ValueError('Error: Equidistant sampling can only be applied to axi of equal dimensions, but recieved', self.original_dim)
-                return data
-            one_dim = i
-            
-        
-        if len(self.original_dim) == 3:
-            data = data[..., ::self.scale, ::self.scale, ::self.scale]
-        if len(self.original_dim) == 2:
-            data = data[..., ::self.scale, ::self.scale]
-        
-        self.dim_warning(data.shape)
-        
-        return data
\ No newline at end of file
+
+        data = self._sample(data, self.scales(self.original_dim))
+        self.dim_warning(data.shape[-len(self.target_dim):])
+
+        return data
+
+    def _sample(self, data: np.ndarray, scales, halo = (0, 0)):
+        return data[self._strides(scales)]
+
+    def _strides(self, scales):
+        return (Ellipsis,) + tuple(slice(None, None, scale) for scale in scales)
+
+    def read(self, dataset):
+        self.original_dim = dataset.shape[-len(self.target_dim):]
+
+        print("Sampling the input data of size", self.original_dim, "into size", self.target_dim)
+
+        data = dataset[self._strides(self.scales(self.original_dim))]
+        self.dim_warning(data.shape[-len(self.target_dim):])
+
+        return data
@@ -0,0 +1,44 @@
+import numpy as np
+from scipy import ndimage
+from sapsan.lib.data.sampling.down_sampler import DownSampling
+
+
+class GaussianSampling(DownSampling):
+    """
+    Smooths the data with a gaussian filter to suppress the scales the
+    target grid can't resolve, then takes every scale-th point.
+    An h5py dataset is filtered in slabs, each read with the halo the
+    filter needs, so the result is the same as filtering it whole.
+    """
+
+    def __init__(self, target_dim, sigma = None, mode: str = 'wrap', truncate: float = 4.0):
+        """
+        @param target_dim: shape to sample the spatial axes to
+        @param sigma: width of the filter, in grid points of the original data,
+                      a number or one per axis; scale/2 of every axis by default
+        @param mode: boundary mode of scipy.ndimage.gaussian_filter, 'wrap' for periodic data
+        @param truncate: the filter is cut at truncate*sigma
+        """
+        super().__init__(target_dim)
+        self.sigma = sigma
+        self.mode = mode
+        self.truncate = truncate
+        self.periodic = mode == 'wrap'
+
+    def sigmas(self, scales):
+        if self.sigma is None: return tuple(scale/2 for scale in scales)
+        if np.iterable(self.sigma): return tuple(self.sigma)
+        return (self.sigma,)*len(scales)
+
+    def halo(self, scales):
+        #radius of the filter kernel along the first axis, as in scipy.ndimage
+        return int(self.truncate*self.sigmas(scales)[0] + 0.5)
+
+    def _sample(self, data: np.ndarray, scales, halo = (0, 0)):
+        nlead = len(data.shape) - len(self.target_dim)
+        #leading (batch, channel) axes are not filtered
+        sigma = (0,)*nlead + self.sigmas(scales)
+        if not np.issubdtype(data.dtype, np.floating): data = data.astype(np.float64)
+        data = ndimage.gaussian_filter(data, sigma, mode=self.mode, truncate=self.truncate)
+        data = data[(slice(None),)*nlead + (slice(halo[0], data.shape[nlead]-halo[1]),)]
+        return data[(Ellipsis,) + tuple(slice(None, None, scale) for scale in scales)]
@@ -0,0 +1,40 @@
+import numpy as np
+from scipy import fft
+from sapsan.lib.data.sampling.down_sampler import DownSampling
+
+
+class SpectralSampling(DownSampling):
+    """
+    Keeps the Fourier modes resolved by the target grid and transforms
+    them back on it, i.e. a sharp spectral filter without aliasing;
+    suited for periodic data. The Nyquist modes of the target grid are
+    zeroed. The data size has to be a multiple of the target size.
+
+    The transform is global, so the whole dataset is read.
+    """
+
+    def _sample(self, data: np.ndarray, scales, halo = (0, 0)):
+        ndim = len(self.target_dim)
+        axes = tuple(range(-ndim, 0))
+        modes = fft.rfftn(data, axes=axes, workers=-1)
+
+        for axis, target in zip(axes[:-1], self.target_dim[:-1]):
+            #non-negative and negative frequencies resolved by the target grid
+            n = modes.shape[axis]
+            keep = np.r_[0:(target+1)//2, n-target//2:n]
+            modes = np.take(modes, keep, axis=axis)
+            if target % 2 == 0: self._nyquist(modes, axis, target//2)
+        target = self.target_dim[-1]
+        modes = modes[..., :target//2+1]
+        if target % 2 == 0: self._nyquist(modes, -1, target//2)
+
+        return fft.irfftn(modes, s=self.target_dim, axes=axes, workers=-1) \
+               * (np.prod(self.target_dim) / np.prod(data.shape[-ndim:]))
+
+    def _nyquist(self, modes, axis, index):
+        selection = [slice(None)]*len(modes.shape)
+        selection[axis] = index
+        modes[tuple(selection)] = 0
+
+    def read(self, dataset):
+        return self.sample(dataset[()])
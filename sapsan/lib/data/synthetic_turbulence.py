@@ -0,0 +1,171 @@
+"""
+Synthetic turbulence generator
+
+Writes divergence-free random velocity fields with a prescribed energy
+spectrum, at any resolution and number of checkpoints, in the layout
+HDF5Dataset reads: one file per feature, named by the path template.
+Useful to test & benchmark loading and training at large sizes
+(e.g. 512^3) without shipping the data.
+
+The field is built in Fourier space: complex gaussian noise is scaled
+to the spectrum E(k), projected onto the plane normal to k (so that
+k.u(k) = 0, i.e. div u = 0), and transformed back. Checkpoints are
+the same field with every mode rotated in phase by its eddy frequency
+w(k) ~ k^(2/3), so consecutive snapshots are correlated.
+
+Usage:
+    generator = SyntheticTurbulence(size = 512, seed = 0)
+    generator.write(path = "data/t{checkpoint:1.0f}/{feature}_dim512.h5",
+                    checkpoints = [0, 1],
+                    features = ['u', 'tn'])
+
+    data_loader = HDF5Dataset(path = "data/t{checkpoint:1.0f}/{feature}_dim512.h5",
+                              features = ['u'], target = ['tn'],
+                              checkpoints = [0, 1], input_size = [512,512,512])
+"""
+
+import os
+import numpy as np
+import h5py as h5
+from scipy import fft
+
+
+def von_karman(k, k_peak):
+    #k^4 at large scales, peaks at k_peak, and k^(-5/3) in the inertial range
+    return (k/k_peak)**4 / (1 + (k/k_peak)**2)**(17/6)
+
+
+def kolmogorov(k, k_peak):
+    return np.where(k > 0, k, 1)**(-5/3)
+
+
+SPECTRA = {'von_karman': von_karman, 'kolmogorov': kolmogorov}
+
+
+class SyntheticTurbulence():
+    def __init__(self,
+                 size = 64,
+                 ndim: int = 3,
+                 spectrum = 'von_karman',
+                 k_peak: float = 4,
+                 u_rms: float = 1,
+                 seed: int = None,
+                 dtype = np.float32,
+                 chunks = None):
+        """
+        @param size: resolution, an int or a tuple of ndim ints
+        @param ndim: 2 or 3; the velocity has ndim components
+        @param spectrum: 'von_karman', 'kolmogorov', or a function E(k, k_peak)
+        @param k_peak: wavenumber of the spectrum peak (energy-containing scale)
+        @param u_rms: rms of the velocity components
+        @param seed: seed of the random field; the same seed gives the same data
+        @param chunks: HDF5 chunk shape of the written datasets (h5py 'chunks')
+        """
+        if ndim not in [2, 3]: raise ValueError("ndim can be either 2 or 3, but recieved %s"%ndim)
+        if isinstance(spectrum, str):
+            if spectrum not in SPECTRA:
+                raise ValueError("spectrum can be %s or a function, but recieved '%s'"%(list(SPECTRA), spectrum))
+            spectrum = SPECTRA[spectrum]
+        self.shape = tuple(size) if np.iterable(size) else (size,)*ndim
+        self.ndim = ndim
+        self.spectrum = spectrum
+        self.k_peak = k_peak
+        self.u_rms = u_rms
+        self.seed = seed
+        self.dtype = dtype
+        self.chunks = chunks
+        self.modes = None
+        self.scale = None
+
+    def wavenumbers(self):
+        #integer wavenumbers of the real FFT, as broadcastable 1D arrays
+        ks = [np.fft.fftfreq(n, 1/n) for n in self.shape[:-1]] + [np.fft.rfftfreq(self.shape[-1], 1/self.shape[-1])]
+        return [k.astype(np.float32).reshape([-1 if i == j else 1 for j in range(self.ndim)])
+                for i, k in enumerate(ks)]
+
+    def generate_modes(self):
+        #random divergence-free Fourier modes with the prescribed spectrum, (ndim, *rfft shape)
+        rng = np.random.default_rng(self.seed)
+        ks = self.wavenumbers()
+        k2 = sum(k**2 for k in ks)
+        kmag = np.sqrt(k2)
+
+        #E(k) is spread over the shell of modes at |k|: 4 pi k^2 in 3D, 2 pi k in 2D
+        shell = 2*(self.ndim-1)*np.pi*np.where(kmag > 0, kmag, 1)**(self.ndim-1)
+        amplitude = np.sqrt(self.spectrum(kmag, self.k_peak) / shell).astype(np.float32)
+        amplitude[kmag == 0] = 0
+        #the Nyquist modes have no sign, so they can't be projected consistently
+        for k, n in zip(ks, self.shape):
+            amplitude[np.broadcast_to(np.abs(k) == n//2, amplitude.shape) & (n % 2 == 0)] = 0
+
+        modes = np.empty((self.ndim,)+amplitude.shape, dtype=np.complex64)
+        for i in range(self.ndim):
+            modes[i].real = rng.standard_normal(amplitude.shape, dtype=np.float32)
+            modes[i].imag = rng.standard_normal(amplitude.shape, dtype=np.float32)
+            modes[i] *= amplitude
+
+        #remove the component along k: k.u(k) = 0
+        k2[k2 == 0] = 1
+        projection = sum(k*mode for k, mode in zip(ks, modes)) / k2
+        for k, mode in zip(ks, modes): mode -= k*projection
+
+        self.omega = (self.u_rms*kmag**(2/3)).astype(np.float32)
+        self.modes = modes
+        self.scale = None
+        return modes
+
+    def velocity(self, time: float = 0):
+        """
+        Velocity at the given time, shape (ndim, *size)
+        """
+        if self.modes is None: self.generate_modes()
+        phase = np.exp(-1j*self.omega*time).astype(np.complex64) if time else 1
+
+        u = np.empty((self.ndim,)+self.shape, dtype=self.dtype)
+        for i in range(self.ndim):
+            u[i] = fft.irfftn(self.modes[i]*phase, s=self.shape, workers=-1)
+        #the phases don't change the energy, so the same scale holds for every time
+        if self.scale == None: 
+            self.scale = self.u_rms / np.sqrt(sum(float(np.dot(c.ravel(), c.ravel())) for c in u) / u.size)
+        u *= self.scale
+        return u
+
+    def write(self,
+              path: str,
+              checkpoints = [0],
+              features = ['u'],
+              time_granularity: float = 1,
+              filt_size: float = 2):
+        """
+        Writes every feature of every checkpoint into its own file
+        @param path: template of the file paths with {checkpoint} and {feature},
+                     as in HDF5Dataset
+        @param features: 'u' - the velocity,
+                         'tn' - its subgrid stress tensor (3D only),
+                                sapsan.utils.physics.tensor with a gaussian filter
+        @param time_granularity: time = time_granularity * checkpoint, as in HDF5Dataset
+        @param filt_size: width of the gaussian filter for 'tn'
+        @return: paths of the written files
+        """
+        for feature in features:
+            if feature not in ['u', 'tn']:
+                raise ValueError("features can be 'u' or 'tn', but recieved '%s'"%feature)
+        if 'tn' in features and self.ndim != 3: raise ValueError("'tn' can only be computed in 3D")
+
+        paths = []
+        for checkpoint in checkpoints:
+            timestep = time_granularity * checkpoint
+            u = self.velocity(timestep)
+            for feature in features:
+                if feature == 'u': data = u
+                else:
+                    from sapsan.utils.physics import tensor
+                    from sapsan.utils.filters import gaussian
+                    data = tensor(u, filt=gaussian, filt_size=filt_size).astype(self.dtype)
+
+                file_path = path.format(checkpoint=timestep, feature=feature)
+                if os.path.dirname(file_path): os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with h5.File(file_path, 'w') as file:
+                    file.create_dataset(feature, data=data, chunks=self.chunks)
+                paths.append(file_path)
+        return paths
@@ -1,5 +1,17 @@
-from .krr.krr_estimator import KRR, KRRConfig
-from .cnn.cnn3d_estimator import CNN3d, CNN3dConfig
-from .picae.picae_estimator import PICAE, PICAEConfig
-from .torch_backend import load_estimator, TorchBackend
-from .sklearn_backend import load_sklearn_estimator, SklearnBackend
+from sapsan._lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'KRR': '.krr.krr_estimator',
+    'KRRConfig': '.krr.krr_estimator',
+    'Incremental': '.incremental.incremental_estimator',
+    'IncrementalConfig': '.incremental.incremental_estimator',
+    'CNN3d': '.cnn.cnn3d_estimator',
+    'CNN3dConfig': '.cnn.cnn3d_estimator',
+    'PICAE': '.picae.picae_estimator',
+    'PICAEConfig': '.picae.picae_estimator',
+    'load_estimator': '.torch_backend',
+    'TorchBackend': '.torch_backend',
+    'load_sklearn_estimator': '.sklearn_backend',
+    'SklearnBackend': '.sklearn_backend',
+    'IncrementalSklearnBackend': '.sklearn_backend',
+})
@@ -11,14 +11,17 @@ import numpy as np
 import torch
 
 from sapsan.core.models import EstimatorConfig
-from sapsan.lib.estimator.torch_backend import TorchBackend
+from sapsan.lib.estimator.torch_backend import TorchBackend, checkpoint_stage
 from sapsan.lib.data import get_loader_shape
 
 
 class CNN3dModel(torch.nn.ModuleDict):
-    def __init__(self, D_in = 1, D_out = 1):
+    def __init__(self, D_in = 1, D_out = 1, checkpointing = False):
         super(CNN3dModel, self).__init__()
         
+        #recompute the convolutional encoder activations in backward to save memory
+        self.checkpointing = checkpointing
+        
         self.conv3d = torch.nn.Conv3d(D_in, D_in*2, kernel_size=2, stride=2, padding=1)
         self.conv3d2 = torch.nn.Conv3d(D_in*2, D_in*2, kernel_size=2, stride=2, padding=1)
         self.conv3d3 = torch.nn.Conv3d(D_in*2, D_in*4, kernel_size=2, stride=2, padding=1)
@@ -30,15 +33,28 @@ class CNN3dModel(torch.nn.ModuleDict):
         self.linear = torch.nn.Linear(D_in*4, D_in*8)
         self.linear2 = torch.nn.Linear(D_in*8, D_out)
 
+    def encode(self, x):
+        #every stage is a separate checkpoint segment: only the stage
+        #inputs are stored, the rest is recomputed one stage at a time
+        for stage in [self.stage1, self.stage2, self.stage3]:
+            if self.checkpointing and self.training and torch.is_grad_enabled():
+                x = checkpoint_stage(stage, x)
+            else: x = stage(x)
+        return x
+
+    def stage1(self, x):
+        return self.pool(self.conv3d(x))
+
+    def stage2(self, x):
+        return self.pool(self.conv3d2(self.relu(x)))
+
+    def stage3(self, x):
+        return self.pool2(self.conv3d3(self.relu(x)))
+        
     def forward(self, x): 
 
         x = x.float()
-        c1 = self.conv3d(x)
-        p1 = self.pool(c1)
-        c2 = self.conv3d2(self.relu(p1))
-        p2 = self.pool(c2)
-        c3 = self.conv3d3(self.relu(p2))
-        p3 = self.pool2(c3)
+        p3 = self.encode(x)
 
         v1 = p3.view(p3.size(0), -1)  
         
@@ -56,6 +72,7 @@ class CNN3dConfig(EstimatorConfig):
                  logdir: str = "./logs/",
                  lr: float = 1e-3,
                  min_lr = None,
+                 checkpointing: bool = False,
                  *args, **kwargs):
         self.n_epochs = n_epochs
         self.logdir = logdir
@@ -64,6 +81,7 @@ class CNN3dConfig(EstimatorConfig):
         self.lr = lr
         if min_lr==None: self.min_lr = lr*1e-2
         else: self.min_lr = min_lr
+        self.checkpointing = checkpointing
         self.kwargs = kwargs
         
         #everything in self.parameters will get recorded by MLflow
@@ -81,7 +99,8 @@ class CNN3d(TorchBackend):
         self.loaders = loaders
         
         x_shape, y_shape = get_loader_shape(self.loaders)
-        self.model = CNN3dModel(x_shape[1], y_shape[1])
+        self.model = CNN3dModel(x_shape[1], y_shape[1], 
+                                checkpointing = self.config.checkpointing)
         
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.config.lr)        
         self.loss_func = torch.nn.SmoothL1Loss()        
@@ -0,0 +1,91 @@
+"""
+Incremental (online) sklearn estimators
+
+    - uses sklearn_backend (IncrementalSklearnBackend) for backend
+    - trains with partial_fit on the data streamed checkpoint by checkpoint,
+      so only a single checkpoint is in memory at a time
+
+Usage:
+    data_loader = HDF5Dataset(path = path, features = ['u'], target = ['tn'],
+                              checkpoints = [0, 1, 2], input_size = INPUT_SIZE, flat = True)
+
+    estimator = Incremental(config = IncrementalConfig(model = 'rff', n_components = 2000, gamma = 0.1),
+                            loaders = data_loader)
+    estimator = Train(model = estimator, data_parameters = data_loader).run()
+
+To evaluate, set estimator.loaders = [x, y] of the test data, as for KRR.
+"""
+import numpy as np
+from typing import Dict
+
+from sapsan.core.models import EstimatorConfig
+from sapsan.lib.estimator.sklearn_backend import IncrementalSklearnBackend
+
+
+class IncrementalModel():
+    def __init__(self, model = 'sgd', batch_size = 100000, random_state = None, **kwargs):
+        if model == 'sgd':
+            from sklearn.linear_model import SGDRegressor
+            self.model = SGDRegressor(random_state = random_state, **kwargs)
+        elif model == 'ipca':
+            from sklearn.decomposition import IncrementalPCA
+            self.model = IncrementalPCA(**kwargs)
+        elif model in ['nystroem', 'rff']:
+            from sapsan.lib.estimator.krr.krr_estimator import ApproximateKernelRidge
+            self.model = ApproximateKernelRidge(approximation = model, batch_size = batch_size,
+                                                random_state = random_state, **kwargs)
+        else:
+            raise ValueError("model can be 'sgd', 'ipca', 'nystroem' or 'rff', but recieved '%s'"%model)
+
+
+class IncrementalConfig(EstimatorConfig):
+    def __init__(self,
+                 model: str = 'sgd',
+                 n_epochs: int = 1,
+                 batch_size: int = 100000,
+                 shuffle: bool = False,
+                 random_state: int = None,
+                 n_jobs: int = 1,
+                 *args, **kwargs):
+        """
+        @param model: 'sgd' (SGDRegressor, single target), 'ipca' (IncrementalPCA, no target),
+                      'nystroem' or 'rff' (random-feature ridge regression, see KRR);
+                      kwargs are passed to the model, e.g. alpha, n_components, gamma
+        @param n_epochs: number of passes over the checkpoints
+        @param batch_size: number of samples per partial_fit call (and per prediction block)
+        @param shuffle: shuffle the samples within every checkpoint
+        @param n_jobs: number of threads predicting the batches
+        """
+        self.model = model
+        self.n_epochs = n_epochs
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.kwargs = kwargs
+
+        #everything in self.parameters will get recorded by MLflow
+        self.parameters = {f'model - {k}': v for k, v in self.__dict__.items() if k != 'kwargs'}
+        if bool(self.kwargs): self.parameters.update({f'model - {k}': v for k, v in self.kwargs.items()})
+
+
+class Incremental(IncrementalSklearnBackend):
+    def __init__(self, loaders,
+                       config = IncrementalConfig(),
+                       model = None):
+        """
+        @param loaders: [x, y] or a dataset yielding them per checkpoint, e.g. HDF5Dataset(flat = True)
+        @param model: any sklearn estimator with partial_fit, built from config.model if None
+        """
+        if model == None:
+            model = IncrementalModel(model = config.model, batch_size = config.batch_size,
+                                     random_state = config.random_state, **config.kwargs).model
+        if not hasattr(model, 'partial_fit'):
+            raise ValueError("Incremental needs an estimator with partial_fit, but recieved %s"%type(model).__name__)
+        super().__init__(config, model)
+        self.config = config
+        self.loaders = loaders
+
+        for param, value in self.model.get_params().items():
+            self.config.parameters["model - %s"%param] = value
+        self.model_metrics = dict()
@@ -1,31 +1,150 @@
+"""
+Kernel Ridge Regression estimator
+
+    - uses sklearn_backend for backend
+
+Exact KRR (sklearn KernelRidge) needs O(n^2) memory and O(n^3) time in the
+number of samples (voxels). approximation = 'nystroem' or 'rff' (random
+Fourier features, rbf kernel only) maps the inputs onto n_components
+features instead, and solves the ridge regression in that space:
+(Z^T Z + alpha I) w = Z^T y is accumulated over mini-batches of batch_size
+rows in a single pass, so training takes O(batch_size*n_components +
+n_components^2) memory and predicting is done batch by batch as well.
+ApproximateKernelRidge.partial_fit adds more samples to the system, see
+sapsan.lib.estimator.incremental for training it checkpoint by checkpoint.
+
+For example see sapsan/examples/krr_example.ipynb
+"""
 import json
 import os
 
 import numpy as np
 from typing import Optional, Dict
+from sklearn.base import BaseEstimator, RegressorMixin
 from sklearn.kernel_ridge import KernelRidge
 from sapsan.core.models import Estimator, EstimatorConfig
 from sapsan.lib.estimator.sklearn_backend import SklearnBackend
 
+class ApproximateKernelRidge(BaseEstimator, RegressorMixin):
+    def __init__(self, kernel='rbf', alpha=1.0, gamma=None, approximation='nystroem',
+                 n_components=1000, batch_size=100000, random_state=None):
+        """
+        @param approximation: 'nystroem' (any sklearn pairwise kernel) or 'rff' (rbf kernel)
+        @param n_components: rank of the approximation, i.e. number of landmarks or features
+        @param batch_size: number of samples (rows) processed at a time
+        """
+        self.kernel = kernel
+        self.alpha = alpha
+        self.gamma = gamma
+        self.approximation = approximation
+        self.n_components = n_components
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def _batches(self, n):
+        batch_size = self.batch_size or n
+        return [slice(start, min(start+batch_size, n)) for start in range(0, n, batch_size)]
+
+    def _feature_map(self, X):
+        from sklearn.kernel_approximation import Nystroem, RBFSampler
+        rng = np.random.default_rng(self.random_state)
+        #gamma=False of KRRConfig means the sklearn default 1/n_features
+        gamma = self.gamma if self.gamma else None
+        if self.approximation == 'nystroem':
+            #landmarks are random samples, read in file order
+            n_components = min(self.n_components, X.shape[0])
+            landmarks = np.sort(rng.choice(X.shape[0], n_components, replace=False))
+            feature_map = Nystroem(kernel = self.kernel, gamma = gamma, n_components = n_components,
+                                   random_state = self.random_state)
+            return feature_map.fit(np.asarray(X[landmarks], dtype=np.float64))
+        elif self.approximation == 'rff':
+            if self.kernel != 'rbf':
+                raise ValueError("Random Fourier features approximate the 'rbf' kernel only, "
+                                 "but recieved kernel '%s'"%self.kernel)
+            feature_map = RBFSampler(gamma = gamma if gamma else 1/X.shape[1], n_components = self.n_components,
+                                     random_state = self.random_state)
+            return feature_map.fit(np.asarray(X[:1], dtype=np.float64))
+        else:
+            raise ValueError("approximation can be 'nystroem' or 'rff', but recieved '%s'"%self.approximation)
+
+    def fit(self, X, y):
+        for attr in ['feature_map_', 'ZtZ_', 'Zty_']:
+            if hasattr(self, attr): delattr(self, attr)
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        """
+        Adds the samples to the ridge system and solves it, so the data can be
+        fed in chunks (e.g. checkpoint by checkpoint); the Nystroem landmarks
+        are drawn from the first chunk
+        """
+        from scipy import linalg
+        if not hasattr(self, 'feature_map_'):
+            self.feature_map_ = self._feature_map(X)
+            self.single_target_ = len(y.shape) == 1
+            self.ZtZ_, self.Zty_ = 0, 0
+
+        for batch in self._batches(X.shape[0]):
+            Z = self.feature_map_.transform(np.asarray(X[batch], dtype=np.float64))
+            y_batch = np.asarray(y[batch], dtype=np.float64).reshape(Z.shape[0], -1)
+            self.ZtZ_ = self.ZtZ_ + Z.T @ Z
+            self.Zty_ = self.Zty_ + Z.T @ y_batch
+        self.coef_ = linalg.solve(self.ZtZ_ + self.alpha*np.eye(self.ZtZ_.shape[0]), self.Zty_, assume_a='pos')
+        return self
+
+    def predict(self, X):
+        pred = np.empty((X.shape[0], self.coef_.shape[1]))
+        for batch in self._batches(X.shape[0]):
+            pred[batch] = self.feature_map_.transform(np.asarray(X[batch], dtype=np.float64)) @ self.coef_
+        return pred[:, 0] if self.single_target_ else pred
+
+
 class KRRModel():
-    def __init__(self, kernel='rbf', alpha=1.0, gamma=None):
+    def __init__(self, kernel='rbf', alpha=1.0, gamma=None, approximation=None,
+                 n_components=1000, batch_size=100000, random_state=None):
         super(KRRModel, self).__init__()
         self.kernel = kernel
         self.alpha = alpha
         self.gamma = gamma
-        self.model = KernelRidge(kernel = self.kernel,
-                                 alpha = self.alpha,
-                                 gamma = self.gamma)
+        if approximation == None:
+            self.model = KernelRidge(kernel = self.kernel,
+                                     alpha = self.alpha,
+                                     gamma = self.gamma)
+        else:
+            self.model = ApproximateKernelRidge(kernel = self.kernel,
+                                                alpha = self.alpha,
+                                                gamma = self.gamma,
+                                                approximation = approximation,
+                                                n_components = n_components,
+                                                batch_size = batch_size,
+                                                random_state = random_state)
     
 class KRRConfig(EstimatorConfig):
     def __init__(self,
                  alpha: float = 1.0,
                  gamma = False,
                  kernel: str = 'rbf',
+                 approximation: str = None,
+                 n_components: int = 1000,
+                 batch_size: int = 100000,
+                 random_state: int = None,
+                 n_jobs: int = 1,
                  *args, **kwargs):
+        """
+        @param approximation: None for exact KRR, 'nystroem' or 'rff' (random Fourier features)
+        @param n_components: rank of the approximation
+        @param batch_size: number of samples per mini-batch of the approximate training and prediction
+        @param random_state: seed of the landmarks / random features
+        @param n_jobs: number of threads predicting the batches
+        """
         self.alpha = alpha
         self.gamma = gamma
         self.kernel = kernel
+        self.approximation = approximation
+        self.n_components = n_components
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.n_jobs = n_jobs
         self.kwargs = kwargs
         
         #everything in self.parameters will get recorded by MLflow
@@ -42,7 +161,9 @@ class KRR(SklearnBackend):
         self.config = config
         self.loaders = loaders
         
-        self.estimator = KRRModel(kernel=config.kernel, alpha=config.alpha, gamma=config.gamma)
+        self.estimator = KRRModel(kernel=config.kernel, alpha=config.alpha, gamma=config.gamma,
+                                  approximation=config.approximation, n_components=config.n_components,
+                                  batch_size=config.batch_size, random_state=config.random_state)
         self.model = self.estimator.model
         
         for param, value in self.model.get_params().items():
@@ -53,9 +174,6 @@ class KRR(SklearnBackend):
         trained_model = self.model.fit(self._move_axis_to_sklearn(self.loaders[0]),
                                        self._move_axis_to_sklearn(self.loaders[1]))
         return trained_model        
-        
-    def _move_axis_to_sklearn(self, inputs: np.ndarray) -> np.ndarray:
-        return np.moveaxis(inputs, 0, 1)    
 
     def metrics(self) -> Dict[str, float]:
         return self.model_metrics
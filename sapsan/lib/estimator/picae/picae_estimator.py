@@ -13,7 +13,7 @@ from torch.utils import data
 from torch.utils.data import DataLoader
 
 from sapsan.core.models import EstimatorConfig
-from sapsan.lib.estimator.torch_backend import TorchBackend
+from sapsan.lib.estimator.torch_backend import TorchBackend, checkpoint_stage
 from sapsan.lib.data import get_loader_shape
 
 
@@ -27,7 +27,8 @@ class PICAEModel(torch.nn.Module):
                        nfilters = 6, 
                        kernel_size = (3,3,3), 
                        enc_nlayers = 3, 
-                       dec_nlayers = 3):        
+                       dec_nlayers = 3,
+                       checkpointing = False):        
         super(PICAEModel, self).__init__()
         self.il = input_dim[0]
         self.jl = input_dim[1]
@@ -41,6 +42,8 @@ class PICAEModel(torch.nn.Module):
         self.decoder_nlayers= dec_nlayers
         self.total_layers = self.encoder_nlayers + self.decoder_nlayers
         self.outlayer_padding = kernel_size[0] // 2, kernel_size[1] // 2, kernel_size[2] // 2
+        #recompute the activations of every encoder and decoder cell in backward to save memory
+        self.checkpointing = checkpointing
         
         self.tb = TorchBackend
         self.device = self.tb.set_device(self) 
@@ -164,18 +167,30 @@ class PICAEModel(torch.nn.Module):
         newField[:,:,:,:,-1] = newField[:,:,:,:,2] # k axis
         return newField      
 
+    def encode(self, x):
+        for layer in range(self.encoder_nlayers):
+            x = self.run_cell(self.encoder_cell_list[layer], x)
+        return x
+    
+    def decode(self, x):
+        for layer in range(self.decoder_nlayers):
+            x = self.run_cell(self.decoder_cell_list[layer], x)
+        return x
+
+    def run_cell(self, cell, x):
+        #every cell is a separate checkpoint segment, so only the cell inputs
+        #are stored and the peak memory doesn't grow with the number of layers
+        if self.checkpointing and self.training and torch.is_grad_enabled():
+            return checkpoint_stage(cell, x)
+        else: return cell(x)
+
     def forward(self,x):
         x = x.float()
         
         cur_input = x
         
-        # Encoder
-        for layer in range(self.encoder_nlayers):
-            x = self.encoder_cell_list[layer](x)
-            
-        # Decoder
-        for layer in range(self.decoder_nlayers):
-            x = self.decoder_cell_list[layer](x)
+        x = self.encode(x)
+        x = self.decode(x)
             
         # Physics Layers
         x = self.padHITperiodic(x) # PADDING with periodic BC
@@ -206,6 +221,7 @@ class PICAEConfig(EstimatorConfig):
                        logdir: str = "./logs/",
                        lr: float = 1e-4,
                        min_lr = None,
+                       checkpointing: bool = False,
                        *args, **kwargs):
         self.nfilters = nfilters
         self.kernel_size = kernel_size
@@ -219,6 +235,7 @@ class PICAEConfig(EstimatorConfig):
         self.lr = lr
         if min_lr==None: self.min_lr = lr*1e-2
         else: self.min_lr = min_lr        
+        self.checkpointing = checkpointing
         self.kwargs = kwargs
         
         #everything in self.parameters will get recorded by MLflow
@@ -243,7 +260,8 @@ class PICAE(TorchBackend):
                                 nfilters = self.config.nfilters, 
                                 kernel_size = self.config.kernel_size, 
                                 enc_nlayers = self.config.enc_nlayers, 
-                                dec_nlayers = self.config.dec_nlayers)        
+                                dec_nlayers = self.config.dec_nlayers,
+                                checkpointing = self.config.checkpointing)        
         
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.config.lr, 
                                           weight_decay=self.config.weight_decay)
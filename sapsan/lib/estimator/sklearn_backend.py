@@ -3,29 +3,71 @@ Backend for sklearn-based models
 
     - output the metrics and model details 
     - saving and loading trained models    
-    - predicting
+    - predicting: row blocks of the samples are predicted in parallel with joblib,
+      so kernel models only hold a block of the kernel matrix in memory
+    - IncrementalSklearnBackend: training of partial_fit estimators on data
+      streamed checkpoint by checkpoint
 """
 import json
+import time
 from typing import Dict
 import numpy as np
 import warnings
 import os
 import shutil
-from joblib import dump, load
+from joblib import dump, load, Parallel, delayed
 
 from sapsan.core.models import Estimator, EstimatorConfig
 
 class SklearnBackend(Estimator):
+    #bytes of the kernel matrix block of a prediction chunk
+    max_predict_bytes = 256*2**20
+    
     def __init__(self, config: EstimatorConfig, model):
         super().__init__(config)
         
         self.model_metrics = dict()
         self.model = model
         
-    def predict(self, inputs, config):
-        pred = self.model.predict(self._move_axis_to_sklearn(inputs))
-        self.model_metrics['eval - R2'] = self.model.score(self._move_axis_to_sklearn(inputs), pred)
+    def predict(self, inputs, config, targets = None):
+        """
+        Predicts the samples in row blocks, in parallel over config.n_jobs (1 by default) threads
+        @param inputs: (features, samples), as loaded with flat=True
+        @param targets: (outputs, samples) to compute the R2 score against
+        """
+        inputs = self._move_axis_to_sklearn(inputs)
+        chunk_size = self._chunk_size(config)
+        blocks = [slice(start, min(start+chunk_size, inputs.shape[0]))
+                  for start in range(0, inputs.shape[0], chunk_size)]
+
+        #transformers, e.g. IncrementalPCA, return the transformed inputs
+        predict = self.model.predict if hasattr(self.model, 'predict') else self.model.transform
+
+        start = time.time()
+        if len(blocks) == 1: pred = predict(inputs)
+        else:
+            #threads share the model, and the kernel & BLAS computations release the GIL
+            pred = Parallel(n_jobs = getattr(config, 'n_jobs', 1), prefer = 'threads')(
+                            delayed(predict)(inputs[block]) for block in blocks)
+            pred = np.concatenate(pred)
+        self.model_metrics['eval - prediction time'] = time.time() - start
+
+        if targets is not None:
+            from sklearn.metrics import r2_score
+            targets = self._move_axis_to_sklearn(targets).reshape(pred.shape)
+            self.model_metrics['eval - R2'] = r2_score(targets, pred)
         return pred  
+
+    def _chunk_size(self, config):
+        #samples per block: config.batch_size, limited so that the block of
+        #the kernel matrix against the training samples fits max_predict_bytes
+        chunk_size = getattr(config, 'batch_size', None) or 100000
+        nfit = getattr(self.model, 'X_fit_', np.empty((0, 0))).shape[0]
+        if nfit: chunk_size = min(chunk_size, self.max_predict_bytes // (8*nfit))
+        return max(1, int(chunk_size))
+
+    def _move_axis_to_sklearn(self, inputs: np.ndarray) -> np.ndarray:
+        return np.moveaxis(inputs, 0, 1)
     
     def save(self, path):
         model_save_path = "{path}/model.json".format(path=path)
@@ -56,6 +98,51 @@ class SklearnBackend(Estimator):
             del cfg['parameters']
             return cfg
         
+class IncrementalSklearnBackend(SklearnBackend):
+    def train(self):
+        """
+        Feeds the data to model.partial_fit in mini-batches of config.batch_size samples,
+        config.n_epochs times; self.loaders is either [x, y] or an iterable yielding (x, y)
+        or x per checkpoint, e.g. HDF5Dataset(flat = True), which is read again every epoch
+        """
+        n_epochs = getattr(self.config, 'n_epochs', 1)
+        batch_size = getattr(self.config, 'batch_size', None)
+        shuffle = getattr(self.config, 'shuffle', False)
+        rng = np.random.default_rng(getattr(self.config, 'random_state', None))
+        
+        nsamples = 0
+        for epoch in range(n_epochs):
+            for x, y in self._chunks():
+                x = self._move_axis_to_sklearn(x)
+                if y is not None:
+                    y = self._move_axis_to_sklearn(y)
+                    #single-output regressors (e.g. SGDRegressor) expect a 1D target
+                    if y.shape[1] == 1: y = y[:, 0]
+                
+                order = rng.permutation(x.shape[0]) if shuffle else np.arange(x.shape[0])
+                step = batch_size or x.shape[0]
+                for start in range(0, x.shape[0], step):
+                    rows = order[start:start+step]
+                    if shuffle == False: rows = slice(rows[0], rows[-1]+1)
+                    if y is None: self.model.partial_fit(x[rows])
+                    else: self.model.partial_fit(x[rows], y[rows])
+                nsamples += x.shape[0]
+            print("Epoch %d: trained on %d samples"%(epoch+1, nsamples))
+        
+        self.model_metrics['train - samples'] = nsamples
+        return self.model
+    
+    def _chunks(self):
+        #(x, y) of every checkpoint, y is None without a target
+        chunks = [self.loaders] if isinstance(self.loaders, (list, tuple)) else self.loaders
+        for chunk in chunks:
+            if isinstance(chunk, (list, tuple)): yield chunk[0], (chunk[1] if len(chunk) > 1 else None)
+            else: yield chunk, None
+    
+    def metrics(self) -> Dict[str, float]:
+        return self.model_metrics
+    
+        
 class load_sklearn_estimator(SklearnBackend):
     def __init__(self, config, 
                        model):
@@ -4,10 +4,25 @@ Backend for pytorch-based models
     - configuring to run either on cpu or gpu
     - loading parameters into a catalyst runner
     - output the metrics and model details 
+    - log the time split into data wait, copy to device, forward, backward 
+      and optimizer step, the throughput and the peak memory of each loader
+    - profile the selected epochs with torch.profiler
+        - set profile_epochs=N or (first, last) in the model config
+    - stream the batch & epoch metrics to the tracking backend while training
+    - gradient checkpointing of model stages to trade compute for memory
+    - periodic checkpoints of the training state, written in a background
+      thread, and resuming from them
+        - set resume=True (and checkpoint_every) in the model config,
+          or call torch_train(..., resume=True)
     - saving and loading trained models
     - predicting
     - customize Catalyst Runner
         - set self.runner in TorchBackend to the one you like or custom
+    - Distributed Data Parallel (DDP) run, e.g. on CPU cores with gloo
+        - set ddp=True (and nproc) in the model config to spawn the processes,
+          or launch the script with torchrun / 'sapsan train --nproc N'
+        - loaders are sharded with DistributedSampler by ShardedRunner
+        - only rank 0 writes logs and model details
     - setup a custom Distributed Data Parallel (DDP) run
         - adjust loaders in TorchBackend.torch_train()
         - adjust self.runner.train() settings
@@ -16,30 +31,495 @@ import json
 from typing import Dict
 import numpy as np
 import warnings
+import time
 import os
 import shutil
+import copy
+from threading import Thread
 
 import torch
-from catalyst.dl import SupervisedRunner, EarlyStoppingCallback, CheckpointCallback, SchedulerCallback, DeviceEngine
+from torch.utils.checkpoint import checkpoint
+from torch.profiler import record_function
+from torch.nn.parallel import DistributedDataParallel
+from catalyst.dl import SupervisedRunner, EarlyStoppingCallback, SchedulerCallback, DeviceEngine
+from catalyst.callbacks.checkpoint import ICheckpointCallback
+from catalyst.loggers.csv import CSVLogger
+from catalyst.engines.torch import DistributedDataParallelEngine
+from catalyst.core.callback import Callback, CallbackOrder, CallbackNode
+from catalyst.utils.misc import set_global_seed
 from sapsan.core.models import Estimator, EstimatorConfig
+from sapsan.lib.data import distributed_loaders
+from sapsan.utils.distributed import (is_launched, is_main_process, get_rank, get_local_rank, 
+                                      get_world_size, get_local_world_size)
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows
+    resource = None
+
+class AsyncCheckpointCallback(ICheckpointCallback):
+    """
+    Saves the model, optimizer, scheduler and epoch every 'every' epochs
+    and at the end of training. The state is copied to the CPU on the
+    training thread, while the file is written by a background thread,
+    so the training doesn't stall on the disk.
+    Replaces catalyst's default CheckpointCallback.
+    """
+    def __init__(self, path: str, every: int = 1):
+        super().__init__(order=CallbackOrder.ExternalExtra, node=CallbackNode.Master)
+        self.path = path
+        self.every = every
+        self.thread = None
+        self.saved_epoch = None
+
+    def on_epoch_end(self, runner):
+        if self.every and runner.stage_epoch_step % self.every == 0: self.save(runner)
+
+    def on_stage_end(self, runner):
+        if self.saved_epoch != runner.stage_epoch_step: self.save(runner)
+        self.wait()
+        
+    def on_exception(self, runner):
+        #keep the last complete checkpoint for resuming
+        self.wait()
+
+    def save(self, runner):
+        model = runner.model.module if isinstance(runner.model, DistributedDataParallel) else runner.model
+        state = to_cpu({'epoch': runner.stage_epoch_step,
+                        'model_state_dict': model.state_dict(),
+                        'optimizer_state_dict': runner.optimizer.state_dict(),
+                        'scheduler_state_dict': runner.scheduler.state_dict() if runner.scheduler else None})
+        #one write at a time: wait for the previous checkpoint to be written
+        self.wait()
+        self.thread = Thread(target=save_checkpoint, args=(state, self.path))
+        self.thread.start()
+        self.saved_epoch = runner.stage_epoch_step
+
+    def wait(self):
+        if self.thread != None: self.thread.join()
+
+
+class AppendCSVLogger(CSVLogger):
+    """
+    CSVLogger that appends to the logs of a resumed run without
+    writing the header again
+    """
+    def _make_header(self, metrics, loader_key: str):
+        if self.loggers[loader_key].tell() == 0: super()._make_header(metrics, loader_key)
+
+
+class PerformanceCallback(Callback):
+    """
+    Adds per-loader performance metrics to the training log, to tell
+    whether a run is I/O- or compute-bound:
+        step_time      - mean wall-clock time of a batch (copy to device + forward 
+                         + backward + step), sec
+        loader_stall   - total time spent waiting on the DataLoader for batches, sec
+        h2d_time       - total time of copying the batches to the device, sec
+        forward_time   - total time of the forward passes, sec
+        backward_time  - total time of the backward passes, sec
+        optimizer_time - total time of the optimizer steps (and zeroing the grads), sec
+        throughput     - samples per second over the whole loader (all DDP processes)
+    The batch arrival, copy and forward pass are timed by ShardedRunner, 
+    the backward pass and the optimizer step by the engine (TimedEngine);
+    on GPU every stage is synchronized to time it.
+    """
+    stages = ['h2d_time', 'forward_time', 'backward_time', 'optimizer_time']
+
+    def __init__(self):
+        super().__init__(order=CallbackOrder.External)
+
+    def on_loader_start(self, runner):
+        self.step_time = 0
+        self.loader_stall = 0
+        self.times = dict.fromkeys(self.stages, 0)
+        self.nsteps = 0
+        self.loader_start = self.batch_end = time.perf_counter()
+        runner.engine.backward_time = runner.engine.optimizer_time = 0
+
+    def on_batch_start(self, runner):
+        self.batch_start = getattr(runner, 'batch_fetched', None) or time.perf_counter()
+        self.loader_stall += self.batch_start - self.batch_end
+
+    def on_batch_end(self, runner):
+        synchronize(runner.device)
+        self.batch_end = time.perf_counter()
+        self.step_time += self.batch_end - self.batch_start
+        self.nsteps += 1
+        #custom runners may not time the stages
+        if hasattr(runner, 'batch_forwarded'):
+            self.times['h2d_time'] += runner.batch_copied - runner.batch_fetched
+            self.times['forward_time'] += runner.batch_forwarded - runner.batch_copied
+
+    def on_loader_end(self, runner):
+        runner.loader_metrics['step_time'] = self.step_time / max(self.nsteps, 1)
+        runner.loader_metrics['loader_stall'] = self.loader_stall
+        self.times['backward_time'] = getattr(runner.engine, 'backward_time', 0)
+        self.times['optimizer_time'] = getattr(runner.engine, 'optimizer_time', 0)
+        for key, value in self.times.items(): runner.loader_metrics[key] = value
+        runner.loader_metrics['throughput'] = runner.loader_sample_step / max(time.perf_counter()-self.loader_start, 1e-9)
+
+
+class ProfilerCallback(Callback):
+    """
+    Records the selected epochs with torch.profiler (rank 0 only) and writes
+        {path}/trace.json   - chrome trace, open in chrome://tracing or perfetto
+        {path}/summary.txt  - operators sorted by their total self time
+    The h2d, forward, backward and optimizer stages are labelled in the trace.
+    """
+    def __init__(self, path: str, epochs):
+        """
+        @param epochs: an epoch or (first, last) epochs to profile, both included
+        """
+        super().__init__(order=CallbackOrder.Internal, node=CallbackNode.Master)
+        self.path = path
+        self.first, self.last = (epochs, epochs) if np.isscalar(epochs) else epochs
+        self.profiler = None
+
+    def on_epoch_start(self, runner):
+        if runner.global_epoch_step == self.first:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if 'cuda' in str(runner.device): activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(activities=activities)
+            self.profiler.__enter__()
+
+    def on_epoch_end(self, runner):
+        if runner.global_epoch_step == self.last: self.stop()
+
+    def on_stage_end(self, runner):
+        #training stopped early, before the last profiled epoch
+        self.stop()
+
+    def on_exception(self, runner):
+        self.stop()
+
+    def stop(self):
+        if self.profiler == None: return
+        self.profiler.__exit__(None, None, None)
+        os.makedirs(self.path, exist_ok=True)
+        self.profiler.export_chrome_trace(os.path.join(self.path, 'trace.json'))
+        with open(os.path.join(self.path, 'summary.txt'), 'w') as file:
+            file.write(self.profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=50))
+        self.profiler = None
+
+
+class PeakMemoryCallback(Callback):
+    """
+    Adds the peak memory of each loader to the training log, MB:
+        peak_memory - GPU: max allocated memory since the start of the loader
+                      CPU: same as peak_rss
+        peak_rss    - max RSS of the process sampled after every forward pass, 
+                      when the activations kept for the backward pass are alive
+                      (process-lifetime max RSS where the current RSS is unavailable)
+    Runs right before the backward pass, so it shows the effect of
+    gradient checkpointing.
+    """
+    def __init__(self):
+        super().__init__(order=CallbackOrder.Optimizer - 1)
+
+    def on_loader_start(self, runner):
+        self.peak_rss = 0
+        if torch.cuda.is_available() and 'cuda' in str(runner.device):
+            torch.cuda.reset_peak_memory_stats(runner.device)
+
+    def on_batch_end(self, runner):
+        self.peak_rss = max(self.peak_rss, current_memory('cpu'))
+
+    def on_loader_end(self, runner):
+        if 'cuda' in str(runner.device): peak = torch.cuda.max_memory_allocated(runner.device) / 1024**2
+        else: peak = self.peak_rss
+        runner.loader_metrics['peak_memory'] = peak
+        runner.loader_metrics['peak_rss'] = self.peak_rss
+
+
+class MetricStreamCallback(Callback):
+    """
+    Streams the training progress to the tracking backend as it happens,
+    instead of only logging the final metrics after training:
+        every 'every' train batches - loss, lr, throughput (samples/s) and 
+                                      memory (MB) with the global batch step 
+                                      (counts the batches of all loaders)
+        every epoch                 - the epoch metrics of all loaders (loss, 
+                                      step_time, loader_stall, peak_memory, ...) 
+                                      with the epoch
+    Runs on rank 0 only.
+    """
+    def __init__(self, backend, every: int = 1):
+        super().__init__(order=CallbackOrder.ExternalExtra, node=CallbackNode.Master)
+        self.backend = backend
+        self.every = every
+
+    def on_loader_start(self, runner):
+        self.nbatches = 0
+        self.batch_end = time.perf_counter()
+
+    def on_batch_end(self, runner):
+        start, self.batch_end = self.batch_end, time.perf_counter()
+        self.nbatches += 1
+        if not runner.is_train_loader or not self.every or self.nbatches % self.every: return
+
+        step = runner.global_batch_step
+        #every DDP process trains on a batch of its own
+        samples = runner.batch_size * runner.engine.world_size
+        metrics = {'loss': runner.batch_metrics['loss'],
+                   'lr': runner.optimizer.param_groups[0]['lr'],
+                   'throughput': samples / max(self.batch_end - start, 1e-9),
+                   'memory': current_memory(runner.device)}
+        for key, value in metrics.items():
+            self.backend.stream_metric('%s - batch %s'%(runner.loader_key, key), float(value), step)
+
+    def on_epoch_end(self, runner):
+        step = runner.global_epoch_step
+        for loader_key, metrics in runner.epoch_metrics.items():
+            #'_epoch_' repeats the lr & momentum every loader already has
+            if loader_key == '_epoch_': continue
+            for key, value in metrics.items():
+                if "/" in key: key = key.replace("/", " over ")
+                self.backend.stream_metric('%s - %s'%(loader_key, key), float(value), step)
+
+
+class TimedEngine():
+    """
+    Engine mixin timing the backward passes and the optimizer steps,
+    read & reset by PerformanceCallback every loader
+    """
+    backward_time = 0
+    optimizer_time = 0
+
+    def backward_loss(self, loss, model, optimizer):
+        start = time.perf_counter()
+        with record_function('backward'):
+            super().backward_loss(loss, model, optimizer)
+            synchronize(self.device)
+        self.backward_time += time.perf_counter() - start
+
+    def optimizer_step(self, loss, model, optimizer):
+        start = time.perf_counter()
+        with record_function('optimizer'):
+            super().optimizer_step(loss, model, optimizer)
+            synchronize(self.device)
+        self.optimizer_time += time.perf_counter() - start
+
+    def zero_grad(self, loss, model, optimizer):
+        start = time.perf_counter()
+        super().zero_grad(loss, model, optimizer)
+        self.optimizer_time += time.perf_counter() - start
+
+
+class TimedDeviceEngine(TimedEngine, DeviceEngine):
+    """ Single device engine, see TimedEngine """
+
+
+class DDPEngine(TimedEngine, DistributedDataParallelEngine):
+    """
+    Distributed Data Parallel engine for both CPU (gloo) and GPU (nccl) runs.
+    Either spawns nproc processes itself, or, if the script was started by 
+    torchrun, joins the already launched processes.
+    """
+    def __init__(self, nproc: int = None, 
+                       backend: str = 'gloo', 
+                       address: str = '127.0.0.1', 
+                       port: int = 2112):
+        self.launched = is_launched()
+        nlocal = nproc
+        if self.launched:
+            nproc = get_world_size()
+            nlocal = get_local_world_size()
+            address = os.environ.get('MASTER_ADDR', address)
+            port = os.environ.get('MASTER_PORT', port)
+            
+        super().__init__(address = address, port = port,
+                         world_size = nproc, num_node_workers = nlocal,
+                         process_group_kwargs = {'backend': backend})
+        if self.launched: self.workers_global_rank = get_rank() - get_local_rank()
+        
+    @property
+    def device(self):
+        return self._device or 'cpu'
+    
+    def spawn(self, fn, *args, **kwargs):
+        if self.launched: return fn(get_local_rank(), self.world_size)
+        else: return super().spawn(fn, *args, **kwargs)
+        
+    def setup_process(self, rank: int = -1, world_size: int = 1):
+        self._rank = self.workers_global_rank + rank
+
+        if self.backend == 'nccl':
+            torch.cuda.set_device(int(rank))
+            self._device = f"cuda:{int(rank)}"
+        else:
+            #split the cores between the processes to avoid oversubscription
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.num_local_workers))
+
+        os.environ["MASTER_ADDR"] = str(self.address)
+        os.environ["MASTER_PORT"] = str(self.port)
+        os.environ["WORLD_SIZE"] = str(self._world_size)
+        os.environ["RANK"] = str(self._rank)
+        os.environ["LOCAL_RANK"] = str(rank)
+        #the group of a torchrun process outlives the training, see cleanup_process()
+        if not torch.distributed.is_initialized():
+            torch.distributed.init_process_group(**self.process_group_kwargs)
+
+    def cleanup_process(self):
+        #processes launched by torchrun keep the group till they exit, e.g. to 
+        #gather the results of all ranks (re-joining torchrun's store would hang)
+        if not self.launched: super().cleanup_process()
+        
+
+class ShardedRunner(SupervisedRunner):
+    """
+    SupervisedRunner that gives every DDP process its own shard
+    of the data through DistributedSampler; loaders marked as sharded
+    (e.g. a domain decomposition) already hold the data of their process
+    """
+    def _setup_loaders(self):
+        #replaces catalyst's validate_loaders(), which would re-shard every 
+        #loader without a DistributedSampler
+        set_global_seed(self.seed + max(0, self.engine.rank) + self.global_epoch_step)
+        loaders = self.get_loaders(stage=self.stage_key)
+        if self.engine.is_ddp: 
+            loaders = distributed_loaders(loaders, self.engine.rank, self.engine.world_size)
+        self.loaders = loaders
+    
+    def on_stage_start(self, runner):
+        super().on_stage_start(runner)
+        #a resumed run continues the epoch count of its checkpoint
+        self.stage_epoch_step = self.global_epoch_step = getattr(self, 'start_epoch', 0)
+
+    def get_loggers(self):
+        loggers = super().get_loggers()
+        if '_csv' in loggers: loggers['_csv'] = AppendCSVLogger(logdir=self._logdir, use_logdir_postfix=True)
+        return loggers
+
+    def on_batch_start(self, runner):
+        #the batch has just arrived from the loader and is about to be copied to the device
+        self.batch_fetched = time.perf_counter()
+        with record_function('h2d'):
+            super().on_batch_start(runner)
+            synchronize(self.device)
+        self.batch_copied = time.perf_counter()
+
+    def handle_batch(self, batch):
+        with record_function('forward'):
+            super().handle_batch(batch)
+            synchronize(self.device)
+        self.batch_forwarded = time.perf_counter()
+    
+    def on_experiment_end(self, runner):
+        #processes launched by torchrun already closed their loggers at the stage end
+        if self.engine.is_ddp and getattr(self.engine, 'launched', False): return
+        super().on_experiment_end(runner)
 
-class SkipCheckpointCallback(CheckpointCallback):
-    def on_epoch_end(self, state):
-        pass
     
+class DDPResultCallback(Callback):
+    """
+    Spawned DDP processes train copies of the model: rank 0 saves the
+    trained state for the parent process to load after the run
+    """
+    def __init__(self, path: str):
+        super().__init__(order=CallbackOrder.External, node=CallbackNode.Master)
+        self.path = path
+
+    def on_stage_end(self, runner):
+        model = runner.model.module if isinstance(runner.model, DistributedDataParallel) else runner.model
+        torch.save({
+                    'epoch': runner.stage_epoch_step,
+                    'model_state_dict': model.state_dict(),
+                    'optimizer_state_dict': runner.optimizer.state_dict(),
+                    'scheduler_state_dict': runner.scheduler.state_dict(),
+                    'epoch_metrics': {key: dict(value) for key, value in runner.epoch_metrics.items()},
+                    }, self.path)
+        
+        
+def synchronize(device):
+    #waits for the queued GPU work, so that it can be timed
+    if 'cuda' in str(device): torch.cuda.synchronize(device)
+
+
+def current_memory(device = 'cpu'):
+    #memory in use in MB: allocated on the GPU if used, otherwise RSS of the process
+    if 'cuda' in str(device):
+        return torch.cuda.memory_allocated(device) / 1024**2
+    try:
+        #Linux: resident pages of the process
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError, AttributeError):
+        return peak_memory(device)
+
+
+def peak_memory(device = 'cpu'):
+    #peak memory in MB: allocated on the GPU if used, otherwise 
+    #max RSS over the lifetime of the process
+    if 'cuda' in str(device):
+        return torch.cuda.max_memory_allocated(device) / 1024**2
+    elif resource != None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #ru_maxrss is in bytes on macOS and in kB on Linux
+        if os.uname().sysname == 'Darwin': return maxrss / 1024**2
+        else: return maxrss / 1024
+    else: return float('nan')
+
+
+def to_cpu(state):
+    #copy of a (nested) state dict with all tensors copied to the CPU
+    if isinstance(state, torch.Tensor): return state.detach().to('cpu', copy=True)
+    elif isinstance(state, dict): return {key: to_cpu(value) for key, value in state.items()}
+    elif isinstance(state, (list, tuple)): return type(state)(to_cpu(value) for value in state)
+    else: return copy.deepcopy(state)
+
+
+def save_checkpoint(state, path):
+    #write to a temporary file first, so a killed job never leaves a broken checkpoint
+    torch.save(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def checkpoint_stage(stage, x):
+    """
+    Gradient (activation) checkpointing of a model stage: activations inside
+    the stage are not stored, but recomputed during the backward pass
+    """
+    try:
+        return checkpoint(stage, x, use_reentrant=False)
+    except TypeError:
+        #torch<1.11 only has the reentrant checkpoint, which backpropagates
+        #into the stage parameters only if the input requires grad
+        if not x.requires_grad: x = x.detach().requires_grad_()
+        return checkpoint(stage, x)
+
+
 class TorchBackend(Estimator):
     def __init__(self, config: EstimatorConfig, model):
         super().__init__(config)
 
-        self.runner = SupervisedRunner()
+        self.runner = ShardedRunner()
         self.model_metrics = dict()
         self.model = model
-        self.ddp = False
+        #processes started by torchrun always run in DDP
+        self.ddp = is_launched() and get_world_size() > 1
+        self.nproc = None
+        self.ddp_backend = None
+        #save a checkpoint every N epochs; resume from it if the run was interrupted
+        self.checkpoint_every = 1
+        self.resume = False
+        #tracking backend to stream the metrics to while training (set by Train),
+        #every N train batches (0 streams the epoch metrics only)
+        self.tracking_backend = None
+        self.stream_every = 1
+        #epoch or (first, last) epochs to record with torch.profiler
+        self.profile_epochs = None
+        self.profiler_artifacts = []
         self.set_device()
 
     def torch_train(self, loaders, model, 
                     optimizer, loss_func, scheduler, 
-                    config):
+                    config, resume: bool = None):
+        """
+        @param resume: continue from the checkpoint in the logdir,
+                       if there is one (resume in the config by default)
+        """
         self.config = config
         self.model = model        
         self.optimizer = optimizer
@@ -48,14 +528,20 @@ class TorchBackend(Estimator):
         self.loader_key = list(loaders)[0]
         self.metric_key = 'loss'        
         self.import_from_config()
+        if resume != None: self.resume = resume
+
+        self.runner.start_epoch = self.load_checkpoint() if self.resume else 0
 
         if 'cuda' in str(self.device):
             self.optimizer_to(optimizer, self.device)
-            
-        self.print_info()
         
-        ##checks if logdir exists - deletes it if yes
-        self.check_logdir()               
+        if self.ddp: engine = self.ddp_engine()
+        else: engine = TimedDeviceEngine(self.device)
+            
+        if is_main_process(): 
+            self.print_info()
+            ##checks if logdir exists - deletes it if yes, unless resuming
+            if not self.resume: self.check_logdir()               
         
         if self.loader_key != 'train': 
             warnings.warn("WARNING: loader to be used for early-stop callback is '%s'. You can define it manually in /lib/estimator/pytorch_estimator.torch_train"%(self.loader_key))
@@ -64,6 +550,25 @@ class TorchBackend(Estimator):
         
         torch.cuda.empty_cache()
         
+        callbacks = [EarlyStoppingCallback(patience=self.config.patience,
+                                           min_delta=self.config.min_delta,
+                                           loader_key=self.loader_key,
+                                           metric_key=self.metric_key,
+                                           minimize=True),
+                     SchedulerCallback(loader_key=self.loader_key,
+                                       metric_key=self.metric_key,),
+                     AsyncCheckpointCallback(self.checkpoint_path(), every=self.checkpoint_every),
+                     PerformanceCallback(),
+                     PeakMemoryCallback()
+                    ]
+        if self.ddp and not engine.launched: 
+            callbacks.append(DDPResultCallback(self.ddp_result_path()))
+        elif self.tracking_backend != None:
+            #the spawned DDP processes can't reach the backend of this process
+            callbacks.append(MetricStreamCallback(self.tracking_backend, every=self.stream_every))
+        if self.profile_epochs != None:
+            callbacks.append(ProfilerCallback(self.profiler_path(), self.profile_epochs))
+        
         self.runner.train(model=model,
                           criterion=self.loss_func,
                           optimizer=self.optimizer,
@@ -71,32 +576,83 @@ class TorchBackend(Estimator):
                           loaders=loaders,
                           logdir=self.config.logdir,
                           num_epochs=self.config.n_epochs,
-                          callbacks=[EarlyStoppingCallback(patience=self.config.patience,
-                                                           min_delta=self.config.min_delta,
-                                                           loader_key=self.loader_key,
-                                                           metric_key=self.metric_key,
-                                                           minimize=True),
-                                    SchedulerCallback(loader_key=self.loader_key,
-                                                      metric_key=self.metric_key,),
-                                    SkipCheckpointCallback(logdir=self.config.logdir)
-                                    ],
+                          callbacks=callbacks,
                           verbose=False,
                           check=False,
-                          engine=DeviceEngine(self.device),
+                          engine=engine,
                           ddp=self.ddp
                           )
         
+        if self.ddp: self.collect_ddp_result(engine)
+        
         self.config.parameters['model - device'] = str(self.runner.device)
         self.model_metrics['final epoch'] = self.runner.stage_epoch_step
         for key,value in self.runner.epoch_metrics.items():
             self.model_metrics[key] = value
 
-        with open('model_details.txt', 'w') as file:
-            file.write('%s\n\n%s\n\n%s'%(str(self.runner.model),
-                                   str(self.runner.optimizer),
-                                   str(self.runner.scheduler)))
+        if self.profile_epochs != None:
+            self.profiler_artifacts = [os.path.join(self.profiler_path(), file) for file in ['trace.json', 'summary.txt']
+                                       if os.path.exists(os.path.join(self.profiler_path(), file))]
+
+        if is_main_process():
+            with open('model_details.txt', 'w') as file:
+                file.write('%s\n\n%s\n\n%s'%(str(self.runner.model),
+                                       str(self.runner.optimizer),
+                                       str(self.runner.scheduler)))
         
         return model
+    
+    
+    def ddp_engine(self):
+        if is_launched(): self.nproc = get_world_size()
+        elif self.nproc == None:
+            if 'cuda' in str(self.device): self.nproc = torch.cuda.device_count()
+            else: self.nproc = min(4, os.cpu_count() or 1)
+        if self.ddp_backend == None:
+            self.ddp_backend = 'nccl' if 'cuda' in str(self.device) else 'gloo'
+        return DDPEngine(nproc = self.nproc, backend = self.ddp_backend)
+    
+    def checkpoint_path(self):
+        return os.path.join(self.config.logdir, 'checkpoint.pt')
+
+    def profiler_path(self):
+        return os.path.join(self.config.logdir, 'profiler')
+    
+    def load_checkpoint(self):
+        #loads the training state saved by AsyncCheckpointCallback, returns its epoch
+        if not os.path.exists(self.checkpoint_path()):
+            if is_main_process(): print("No checkpoint found in '%s': training from scratch"%self.config.logdir)
+            return 0
+        
+        state = torch.load(self.checkpoint_path(), map_location='cpu')
+        self.model.load_state_dict(state['model_state_dict'])
+        self.optimizer.load_state_dict(state['optimizer_state_dict'])
+        if state['scheduler_state_dict'] != None: self.scheduler.load_state_dict(state['scheduler_state_dict'])
+        if is_main_process(): print("Resuming from epoch %d of '%s'"%(state['epoch'], self.checkpoint_path()))
+        return state['epoch']
+    
+    def ddp_result_path(self):
+        return os.path.join(self.config.logdir, 'ddp_result.pt')
+    
+    def collect_ddp_result(self, engine):
+        if engine.launched:
+            #this process trained the model itself: only unwrap it from DDP
+            if isinstance(self.runner.model, DistributedDataParallel): 
+                self.runner.model = self.runner.model.module
+            return
+        
+        #the model was trained by the spawned processes: load the state saved by rank 0
+        result = torch.load(self.ddp_result_path(), map_location='cpu')
+        os.remove(self.ddp_result_path())
+        self.model.load_state_dict(result['model_state_dict'])
+        self.optimizer.load_state_dict(result['optimizer_state_dict'])
+        self.scheduler.load_state_dict(result['scheduler_state_dict'])
+        
+        self.runner.model = self.model
+        self.runner.optimizer = self.optimizer
+        self.runner.scheduler = self.scheduler
+        self.runner.stage_epoch_step = result['epoch']
+        self.runner.epoch_metrics = result['epoch_metrics']
         
         
     def predict(self, inputs, config):
@@ -128,9 +684,10 @@ class TorchBackend(Estimator):
         return print('''
  ====== run info ======
  Device used:  {device}
- DDP:          {ddp}
+ DDP:          {ddp}{nproc}
  ======================
- '''.format(device=self.device, ddp=self.ddp))
+ '''.format(device=self.device, ddp=self.ddp,
+            nproc=' (%s processes, %s)'%(self.nproc, self.ddp_backend) if self.ddp and self.nproc else ''))
     
     def to_device(self, var):
         if str(self.device) == 'cpu': return var
@@ -1,2 +1,6 @@
-from .evaluate import Evaluate
-from .train import Train
+from sapsan._lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'Evaluate': '.evaluate',
+    'Train': '.train',
+})
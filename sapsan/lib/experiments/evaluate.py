@@ -5,6 +5,10 @@ evaluation_experiment = Evaluate(backend=tracking_backend,
                                  data_parameters = data_loader)
 
 cubes = evaluation_experiment.run()
+
+With a domain-decomposed dataset every rank predicts its own subdomain,
+then the predictions are gathered into the full domain on rank 0,
+which computes the metrics and plots.
 """
 
 import os
@@ -20,6 +24,7 @@ from sapsan.core.models import Experiment, ExperimentBackend, Estimator
 from sapsan.lib.backends.fake import FakeBackend
 from sapsan.utils.plot import pdf_plot, cdf_plot, slice_plot, plot_params
 from sapsan.utils.shapes import combine_cubes, slice_of_cube
+from sapsan.utils.distributed import is_main_process, init_process_group
 
 class Evaluate(Experiment):
     def __init__(self,
@@ -37,6 +42,10 @@ class Evaluate(Experiment):
         self.batch_num = self.data_parameters.batch_num
         self.cmap = cmap
         self.axis = len(self.input_size)
+        self.decomposition = getattr(self.data_parameters, 'decomposition', None)
+        
+        #DDP run launched by torchrun: only rank 0 logs and writes artifacts
+        if not is_main_process(): self.backend = FakeBackend(self.backend.name)
         self.targets_given = True
         self.flat = flat
         self.artifacts = []        
@@ -50,10 +59,10 @@ class Evaluate(Experiment):
                 print('Warning: no target given; only predicting...')
         else:
             try:
-                self.inputs, self.targets = iter(self.model.loaders['train']).next()
+                self.inputs, self.targets = next(iter(self.model.loaders['train']))
                 self.targets = self.targets.numpy()
             except: 
-                self.inputs = iter(self.model.loaders['train']).next()[0]
+                self.inputs = next(iter(self.model.loaders['train']))[0]
                 self.targets_given = False
                 print('Warning: no target given; only predicting...')
         
@@ -88,7 +97,17 @@ class Evaluate(Experiment):
         
         self.backend.start('evaluate', nested = True)
         
-        pred = self.model.predict(self.inputs, self.model.config)              
+        from sapsan.lib.estimator.sklearn_backend import SklearnBackend
+        if isinstance(self.model, SklearnBackend) and self.targets_given:
+            #scored against the targets while predicting
+            pred = self.model.predict(self.inputs, self.model.config, targets = self.targets)
+        else: pred = self.model.predict(self.inputs, self.model.config)              
+
+        if self.decomposition:
+            pred = self.gather(pred)
+            if not is_main_process():
+                self.backend.end()
+                return dict()
 
         end = time.time()
         runtime = end - start
@@ -139,6 +158,21 @@ class Evaluate(Experiment):
         return cube_series
     
     
+    def gather(self, pred):
+        #collects the subdomains predicted by all ranks into the full domain on rank 0
+        if self.flat or len(pred.shape) != self.axis+2:
+            raise ValueError("Only field predictions of shape (batch, channels, %s) can be "
+                             "gathered from the subdomains, got %s"%(', '.join(['n']*self.axis), pred.shape))
+        
+        if self.decomposition.ndomains > 1: init_process_group()
+        shape = self.data_parameters.initial_size
+        pred = self.decomposition.gather(pred, shape)
+        if self.targets_given: self.targets = self.decomposition.gather(self.targets, shape)
+        
+        self.input_size = self.batch_size = tuple(shape)
+        return pred
+    
+    
     def flatten(self, pred):
         slices_cubes = dict()        
         if self.axis == 3:
@@ -184,6 +218,12 @@ class Evaluate(Experiment):
                       
                       
     def analytic_plots(self, series, names):
+        pred = series[0]
+        if self.flat: slices_cubes = self.flatten(pred)
+        else: slices_cubes = self.split_batch(pred)
+        
+        if not is_main_process(): return slices_cubes
+        
         mpl.rcParams.update(plot_params())
                       
         fig = plt.figure(figsize=(12,6), dpi=60)
@@ -193,10 +233,6 @@ class Evaluate(Experiment):
         cdf = cdf_plot(series, names=names, ax=ax2)
         plt.savefig("pdf_cdf.png")
         self.artifacts.append("pdf_cdf.png")                        
-
-        pred = series[0]
-        if self.flat: slices_cubes = self.flatten(pred)
-        else: slices_cubes = self.split_batch(pred)
         
         slice_series = []
         slice_names = []
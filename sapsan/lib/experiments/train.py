@@ -5,6 +5,7 @@ import numpy as np
 from sapsan.core.models import Experiment, ExperimentBackend, Estimator
 from sapsan.lib.backends.fake import FakeBackend
 from sapsan.utils.plot import log_plot
+from sapsan.utils.distributed import is_main_process
 
 import os
 import sys
@@ -40,6 +41,14 @@ class Train(Experiment):
     
     def run(self):
         
+        #pytorch models stream their progress to the backend while training
+        if hasattr(self.model, 'tracking_backend'): self.model.tracking_backend = self.backend
+        
+        if not is_main_process():
+            #DDP run launched by torchrun: only rank 0 logs and writes artifacts
+            self.model.train()
+            return self.model
+        
         start = time.time() 
         self.backend.close_active_run()
         self.backend.start('train')
@@ -61,14 +70,19 @@ class Train(Experiment):
             log = log_plot(self.show_log)
             log.write_html("runtime_log.html")
             self.artifacts.append("runtime_log.html")
+            
+            #torch.profiler trace of the profiled epochs stays in the logdir
+            for artifact in getattr(self.model, 'profiler_artifacts', []):
+                self.backend.log_artifact(artifact)
         else: pass        
         
         #only if catalyst.runner is used
         if 'train' in self.get_metrics():
-            self.backend.log_metric( 'train - final epoch', self.get_metrics()['final epoch'])        
+            final_epoch = self.get_metrics()['final epoch']
+            self.backend.log_metric( 'train - final epoch', final_epoch)        
             for metric, value in self.get_metrics()['train'].items():
                 if "/" in metric: metric = metric.replace("/", " over ")
-                self.backend.log_metric('train - %s'%metric, value)            
+                self.backend.log_metric('train - %s'%metric, value, final_epoch)            
 
         for param, value in self.get_parameters().items():
             self.backend.log_parameter(param, value)
@@ -1,10 +1,16 @@
 import os
 import shutil
+import tempfile
 import unittest
 import numpy as np
+import torch
 
 from sapsan.lib.data.data_functions import torch_splitter
 from sapsan.lib.estimator import CNN3d, CNN3dConfig, PICAE, PICAEConfig, KRR, KRRConfig, load_estimator, load_sklearn_estimator
+from sapsan.lib.estimator import Incremental, IncrementalConfig
+from sapsan.lib.estimator.cnn.cnn3d_estimator import CNN3dModel
+from sapsan.lib.estimator.picae.picae_estimator import PICAEModel
+from sapsan.lib.backends import LocalBackend
 
 
 class TestCnnEstimator(unittest.TestCase):
@@ -65,8 +71,214 @@ class TestCnnEstimator(unittest.TestCase):
                                load_saved_config=True)
         
         self.assertEqual(estimator.config.gamma, loaded_estimator.config.gamma)
-        self.assertEqual(estimator.config.alpha, loaded_estimator.config.alpha)         
-                
+        self.assertEqual(estimator.config.alpha, loaded_estimator.config.alpha)
+
+
+    def test_krr_approximation(self):
+        rng = np.random.default_rng(0)
+        x = rng.random((3, 2000))
+        y = (np.sin(3*x[0]) + x[1]*x[2])[np.newaxis]
+        exact = KRR(config = KRRConfig(gamma=1.0, alpha=1e-3), loaders = [x, y])
+        exact.model = exact.train()
+        for approximation in ['nystroem', 'rff']:
+            estimator = KRR(config = KRRConfig(gamma=1.0, alpha=1e-3, approximation=approximation,
+                                               n_components=300, batch_size=512, random_state=0),
+                            loaders = [x, y])
+            self.assertEqual(estimator.config.parameters['model - approximation'], approximation)
+            estimator.model = estimator.train()
+            pred = estimator.model.predict(x.T)
+            self.assertEqual(pred.shape, (2000, 1))
+            np.testing.assert_allclose(pred, exact.model.predict(x.T), atol=1e-2)
+
+        with self.assertRaises(ValueError):
+            KRR(config = KRRConfig(kernel='laplacian', approximation='rff'), loaders = [x, y]).train()
+
+
+    def test_sklearn_chunked_predict(self):
+        rng = np.random.default_rng(0)
+        x = rng.random((3, 1000))
+        y = (np.sin(3*x[0]) + x[1]*x[2])[np.newaxis]
+        estimator = KRR(config = KRRConfig(gamma=1.0, alpha=1e-3, batch_size=300, n_jobs=2), loaders = [x, y])
+        estimator.model = estimator.train()
+
+        pred = estimator.predict(x, estimator.config)
+        self.assertNotIn('eval - R2', estimator.metrics())
+        self.assertIn('eval - prediction time', estimator.metrics())
+        np.testing.assert_allclose(pred, estimator.model.predict(x.T))
+
+        estimator.predict(x, estimator.config, targets = y + 0.1*rng.standard_normal(y.shape))
+        self.assertLess(estimator.metrics()['eval - R2'], 0.99)
+        self.assertGreater(estimator.metrics()['eval - R2'], 0.5)
+
+        #the kernel block of a chunk is limited to max_predict_bytes
+        estimator.max_predict_bytes = 8*1000*100
+        self.assertEqual(estimator._chunk_size(estimator.config), 100)
+
+
+    def test_incremental(self):
+        import h5py as h5
+        from sapsan.lib.data import HDF5Dataset
+        rng = np.random.default_rng(0)
+        path = os.path.join(self.resources_path, "t{checkpoint:1.0f}", "{feature}.h5")
+        x, y = [], []
+        for checkpoint in range(3):
+            os.makedirs(os.path.dirname(path.format(checkpoint=checkpoint, feature='')))
+            u = rng.random((3, 8, 8, 8))
+            x.append(u.reshape(3, -1))
+            y.append((np.sin(3*u[0]) + u[1]*u[2]).reshape(1, -1))
+            for name, data in [('u', u), ('t', y[-1].reshape(1, 8, 8, 8))]:
+                with h5.File(path.format(checkpoint=checkpoint, feature=name), 'w') as f: f.create_dataset(name, data=data)
+        x, y = np.concatenate(x, axis=1), np.concatenate(y, axis=1)
+
+        data_loader = HDF5Dataset(path = path, features = ['u'], target = ['t'], checkpoints = [0, 1, 2],
+                                  input_size = (8, 8, 8), flat = True)
+        self.assertEqual([chunk[0].shape for chunk in data_loader], [(3, 512)]*3)
+
+        #the streamed random-feature ridge is the same as the one fitted on all the data at once
+        config = dict(model = 'rff', n_components = 200, gamma = 1.0, alpha = 1e-3, batch_size = 100, random_state = 0)
+        estimator = Incremental(config = IncrementalConfig(**config), loaders = data_loader)
+        estimator.model = estimator.train()
+        self.assertEqual(estimator.metrics()['train - samples'], 1536)
+        reference = Incremental(config = IncrementalConfig(**config), loaders = [x, y]).train()
+        np.testing.assert_allclose(estimator.model.predict(x.T), reference.predict(x.T), atol=1e-8)
+
+        estimator = Incremental(config = IncrementalConfig(model = 'sgd', n_epochs = 3, shuffle = True, random_state = 0),
+                                loaders = data_loader)
+        estimator.model = estimator.train()
+        estimator.predict(x, estimator.config, targets = y)
+        from sklearn.linear_model import LinearRegression
+        least_squares = LinearRegression().fit(x.T, y[0]).score(x.T, y[0])
+        self.assertGreater(estimator.metrics()['eval - R2'], least_squares - 0.05)
+
+        estimator = Incremental(config = IncrementalConfig(model = 'ipca', n_components = 2, batch_size = 256),
+                                loaders = [x])
+        estimator.train()
+        self.assertEqual(estimator.predict(x, estimator.config).shape, (1536, 2))
+
+        with self.assertRaises(ValueError):
+            Incremental(config = IncrementalConfig(), model = KRRConfig(), loaders = [x, y])
+
         
     def tearDown(self) -> None:
-        shutil.rmtree(self.resources_path)
\ No newline at end of file
+        shutil.rmtree(self.resources_path)
+
+
+class TestResume(unittest.TestCase):
+    """ Training continues from the checkpoint saved in the logdir. """
+    
+    def setUp(self) -> None:
+        self.logdir = tempfile.mkdtemp()
+        x = np.random.random((4,1,8,8,8)).astype(np.float32)
+        y = np.random.random((4,1)).astype(np.float32)
+        self.loaders = torch_splitter(loaders = [x,y], batch_num = 2)
+    
+    def test_resume(self):
+        estimator = CNN3d(config = CNN3dConfig(n_epochs = 2, logdir = self.logdir),
+                          loaders = self.loaders)
+        estimator.train()
+        checkpoint = torch.load(estimator.checkpoint_path())
+        self.assertEqual(checkpoint['epoch'], 2)
+        
+        estimator = CNN3d(config = CNN3dConfig(n_epochs = 4, logdir = self.logdir, resume = True),
+                          loaders = self.loaders)
+        estimator.train()
+        self.assertEqual(estimator.metrics()['final epoch'], 4)
+        
+        log = np.genfromtxt(os.path.join(self.logdir, 'logs', 'train.csv'), delimiter=',', names=True)
+        self.assertEqual(list(log['step']), [1, 2, 3, 4])
+        
+    def tearDown(self) -> None:
+        shutil.rmtree(self.logdir)
+        if os.path.exists('model_details.txt'): os.remove('model_details.txt')
+
+
+class TestMetricStreaming(unittest.TestCase):
+    """ Batch and epoch metrics reach the tracking backend during training. """
+    
+    def setUp(self) -> None:
+        self.logdir = tempfile.mkdtemp()
+        x = np.random.random((4,1,8,8,8)).astype(np.float32)
+        y = np.random.random((4,1)).astype(np.float32)
+        self.loaders = torch_splitter(loaders = [x,y], batch_num = 2)
+    
+    def test_streaming(self):
+        backend = LocalBackend('stream', path = self.logdir)
+        streamed = []
+        backend.subscribe(lambda name, value, step: streamed.append((name, step)))
+        
+        estimator = CNN3d(config = CNN3dConfig(n_epochs = 2, logdir = self.logdir),
+                          loaders = self.loaders)
+        estimator.tracking_backend = backend
+        estimator.train()
+        
+        #2 train & 2 valid batches per epoch
+        self.assertEqual([step for name, step in streamed if name == 'train - batch loss'], [1, 2, 5, 6])
+        self.assertEqual([step for name, step in streamed if name == 'train - loss'], [1, 2])
+        for key in ['batch lr', 'batch throughput', 'batch memory', 'peak_memory', 'lr']:
+            self.assertIn('train - %s'%key, [name for name, step in streamed])
+        
+        metrics = backend.get_metrics(keys = ['train - loss'])
+        self.assertEqual(list(metrics['step']), [1, 2])
+        
+    def tearDown(self) -> None:
+        shutil.rmtree(self.logdir)
+        if os.path.exists('model_details.txt'): os.remove('model_details.txt')
+
+
+class TestProfiling(unittest.TestCase):
+    """ Epoch time is split into stages; the selected epochs are profiled. """
+    
+    def setUp(self) -> None:
+        self.logdir = tempfile.mkdtemp()
+        x = np.random.random((4,1,8,8,8)).astype(np.float32)
+        y = np.random.random((4,1)).astype(np.float32)
+        self.loaders = torch_splitter(loaders = [x,y], batch_num = 2)
+    
+    def test_breakdown_and_trace(self):
+        estimator = CNN3d(config = CNN3dConfig(n_epochs = 3, logdir = self.logdir, profile_epochs = 2),
+                          loaders = self.loaders)
+        estimator.train()
+        
+        train = estimator.metrics()['train']
+        for key in ['h2d_time', 'forward_time', 'backward_time', 'optimizer_time']:
+            self.assertGreater(train[key], 0)
+            #within the total step time of the 2 batches
+            self.assertLess(train[key], train['step_time']*2)
+        self.assertGreater(train['throughput'], 0)
+        self.assertGreater(train['peak_rss'], 0)
+        #no backward pass or step on validation
+        self.assertEqual(estimator.metrics()['valid']['backward_time'], 0)
+        
+        self.assertEqual([os.path.basename(path) for path in estimator.profiler_artifacts], 
+                         ['trace.json', 'summary.txt'])
+        with open(estimator.profiler_artifacts[0]) as file: trace = file.read()
+        for stage in ['h2d', 'forward', 'backward', 'optimizer']: self.assertIn('"%s"'%stage, trace)
+        
+    def tearDown(self) -> None:
+        shutil.rmtree(self.logdir)
+        if os.path.exists('model_details.txt'): os.remove('model_details.txt')
+
+
+class TestGradientCheckpointing(unittest.TestCase):
+    """ Checkpointed models compute the same gradients as the plain ones. """
+    
+    def gradients(self, model_class, x, **kwargs):
+        grads = []
+        for checkpointing in [False, True]:
+            torch.manual_seed(0)
+            model = model_class(checkpointing=checkpointing, **kwargs)
+            model.train()
+            model(x).sum().backward()
+            grads.append([p.grad for p in model.parameters() if p.grad is not None])
+        return grads
+    
+    def test_cnn3d_checkpointing(self):
+        plain, checkpointed = self.gradients(CNN3dModel, torch.rand(2,3,16,16,16), D_in=3, D_out=1)
+        self.assertEqual(len(plain), len(list(CNN3dModel(3,1).parameters())))
+        for a, b in zip(plain, checkpointed): torch.testing.assert_close(a, b)
+            
+    def test_picae_checkpointing(self):
+        plain, checkpointed = self.gradients(PICAEModel, torch.rand(2,3,16,16,16), 
+                                             input_dim=(16,16,16), batch=2, nfilters=2)
+        self.assertEqual(len(plain), len(checkpointed))
+        for a, b in zip(plain, checkpointed): torch.testing.assert_close(a, b)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+import mlflow
+from mlflow.tracking import MlflowClient
+
+from sapsan.lib.backends import MLflowBackend, LocalBackend
+
+
+class TestMLflowBackend(unittest.TestCase):
+    """ Logged entries are sent in batches by a background thread. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.uri = 'sqlite:///' + os.path.join(self.resources_path, 'mlflow.db')
+        MlflowClient(self.uri).create_experiment('test', artifact_location=os.path.join(self.resources_path, 'artifacts'))
+
+    def test_batched_logging(self):
+        backend = MLflowBackend('test', tracking_uri=self.uri)
+        backend.start('train')
+        run_id = mlflow.active_run().info.run_id
+
+        artifact = os.path.join(self.resources_path, 'artifact.txt')
+        with open(artifact, 'w') as file: file.write('artifact')
+
+        for i in range(150): backend.log_parameter('param %d'%i, i)
+        backend.log_metric('loss', 0.5)
+        backend.log_artifact(artifact)
+        os.remove(artifact)     #as the experiments do right after logging
+        backend.end()
+
+        run = MlflowClient(self.uri).get_run(run_id)
+        self.assertEqual(len(run.data.params), 150)
+        self.assertEqual(run.data.metrics['loss'], 0.5)
+        self.assertEqual([f.path for f in MlflowClient(self.uri).list_artifacts(run_id)], ['artifact.txt'])
+
+    def tearDown(self) -> None:
+        if mlflow.active_run() != None: mlflow.end_run()
+        shutil.rmtree(self.resources_path)
+
+
+class TestLocalBackend(unittest.TestCase):
+    """ Runs are appended to local files and can be compared. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+
+    def log_runs(self, backend):
+        for lr in [0.1, 0.01]:
+            backend.start('train')
+            backend.log_parameter('lr', lr)
+            backend.log_parameter('n_epochs', 2)
+            backend.log_metric('loss', 1.0)
+            backend.log_metric('loss', lr)
+            backend.start('evaluate', nested=True)
+            backend.log_metric('mse', 2*lr)
+            backend.end()
+        backend.close_active_run()
+
+    def test_jsonl_and_parquet(self):
+        for storage in ['jsonl', 'parquet']:
+            backend = LocalBackend('test', path=self.resources_path, storage=storage)
+            self.log_runs(backend)
+            
+            runs = backend.list_runs()
+            self.assertEqual(list(runs['run_name']), ['train', 'evaluate']*2)
+            self.assertEqual(runs['parent'].notna().sum(), 2)
+            
+            table = backend.compare()
+            self.assertEqual(list(table.columns), ['run_name', 'lr', 'loss', 'mse'])
+            train = table[table['run_name']=='train']
+            self.assertEqual(list(train['lr']), ['0.1', '0.01'])
+            self.assertEqual(list(train['loss']), [0.1, 0.01])
+            shutil.rmtree(self.resources_path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path, ignore_errors=True)
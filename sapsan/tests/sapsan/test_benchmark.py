@@ -0,0 +1,72 @@
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+from click.testing import CliRunner
+
+from sapsan.utils.benchmark import run_benchmarks, save_results, load_results, compare
+from sapsan.core.cli.cli import sapsan
+import sapsan as sapsan_package
+
+
+class TestBenchmark(unittest.TestCase):
+    """ Benchmark results are saved as JSON and compared against a baseline. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.cases = ['split_cube_by_batch', 'combine_*', 'dynamic_smagorinsky']
+
+    def test_run_and_compare(self):
+        results = run_benchmarks(sizes = [32, 48], cases = self.cases, repeat = 2, warmup = 0, verbose = False)
+        #dynamic_smagorinsky is skipped above 32^3
+        self.assertEqual(sorted(results['results']), ['combine_cubes[32]', 'combine_cubes[48]',
+                                                      'dynamic_smagorinsky[32]',
+                                                      'split_cube_by_batch[32]', 'split_cube_by_batch[48]'])
+        self.assertEqual(results['results']['combine_cubes[32]']['rounds'], 2)
+
+        path = os.path.join(self.resources_path, 'results.json')
+        save_results(results, path)
+        baseline = load_results(path)
+        self.assertEqual(compare(results, baseline), [])
+
+        baseline['results']['combine_cubes[32]']['median'] /= 2
+        self.assertEqual([key for key, *times in compare(results, baseline, threshold = 0.5)], ['combine_cubes[32]'])
+
+    def test_command(self):
+        output = os.path.join(self.resources_path, 'results.json')
+        args = ['benchmark', '--sizes', '32', '--cases', 'split_cube_by_batch', '--repeat', '1', '--output', output]
+        result = CliRunner().invoke(sapsan, args)
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        baseline = load_results(output)
+        baseline['results']['split_cube_by_batch[32]']['median'] = 1e-12
+        save_results(baseline, os.path.join(self.resources_path, 'baseline.json'))
+        result = CliRunner().invoke(sapsan, args + ['--baseline', os.path.join(self.resources_path, 'baseline.json')])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('split_cube_by_batch[32]', result.output)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class TestLazyImports(unittest.TestCase):
+    """ 'import sapsan' doesn't import the heavy dependencies until they are used. """
+
+    def imported(self, statement):
+        heavy = ['torch', 'catalyst', 'sklearn', 'matplotlib', 'plotly', 'mlflow', 'pandas']
+        check = "%s\nimport sys\nprint(','.join(m for m in %s if m in sys.modules))"%(statement, heavy)
+        output = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, check=True).stdout
+        return [module for module in output.strip().split(',') if module]
+
+    def test_lazy(self):
+        self.assertEqual(self.imported('import sapsan'), [])
+        self.assertEqual(self.imported('import sapsan.core.cli.cli'), [])
+        self.assertEqual(self.imported('from sapsan.lib.data import HDF5Dataset'), [])
+        self.assertIn('torch', self.imported('from sapsan import CNN3d'))
+
+    def test_exports(self):
+        self.assertIn('Train', dir(sapsan_package))
+        self.assertIs(sapsan_package.Train, sys.modules['sapsan.lib.experiments.train'].Train)
+        with self.assertRaises(AttributeError): sapsan_package.NotAnEstimator
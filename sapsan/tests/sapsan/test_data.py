@@ -1,7 +1,19 @@
+import os
+import shutil
+import warnings
+import tempfile
 import numpy as np
+import h5py as h5
 import unittest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 
 from sapsan.utils.shapes import split_cube_by_batch, combine_cubes
+from torch.utils.data import Dataset, TensorDataset, Subset, BatchSampler, SequentialSampler
+from sapsan.lib.data import HDF5Dataset, ATHDFDataset, HDF5PatchDataset, ArrayPatchDataset, DomainDecomposition, SyntheticTurbulence, torch_splitter, make_loader
+from sapsan.lib.data.athena_read import athdf
+from sapsan.lib.data import FilterPyramid, Preprocessor, EquidistantSampling, BlockMeanSampling, SpectralSampling, GaussianSampling
 
 
 def generate_test_cube():
@@ -36,6 +48,37 @@ def generate_test_cube():
     )
 
 
+def write_athdf(path, seed=0):
+    """ A 8^3 cartesian Athena++ mesh of 4^3 blocks, with the (0,0,0) root block refined once. """
+    levels, locations = [], []
+    for k, j, i in np.ndindex(2, 2, 2):
+        if (i, j, k) == (0, 0, 0):
+            for kk, jj, ii in np.ndindex(2, 2, 2):
+                levels.append(1)
+                locations.append((ii, jj, kk))
+        else:
+            levels.append(0)
+            locations.append((i, j, k))
+    levels, locations = np.array(levels, dtype=np.int32), np.array(locations)
+
+    with h5.File(path, 'w') as f:
+        f.attrs['MaxLevel'] = 1
+        f.attrs['MeshBlockSize'] = np.array([4, 4, 4])
+        f.attrs['RootGridSize'] = np.array([8, 8, 8])
+        f.attrs['Coordinates'] = np.bytes_(b'cartesian')
+        f.attrs['NumMeshBlocks'] = len(levels)
+        for d in '123': f.attrs['RootGridX'+d] = np.array([0., 1., 1.])
+        f.attrs['VariableNames'] = np.array([b'rho', b'press', b'vel1', b'vel2', b'vel3'])
+        f.attrs['DatasetNames'] = np.array([b'prim'])
+        f.attrs['NumVariables'] = np.array([5])
+        f['Levels'] = levels
+        f['LogicalLocations'] = locations
+        for d in range(3):
+            f['x%df'%(d+1)] = np.array([np.linspace(loc/2**(lev+1), (loc+1)/2**(lev+1), 5)
+                                        for loc, lev in zip(locations[:, d], levels)])
+        f['prim'] = np.random.default_rng(seed).random((5, len(levels), 4, 4, 4)).astype(np.float32)
+
+
 class TestDatasetUtils(unittest.TestCase):
     """ Dataset utils test. """
 
@@ -57,3 +100,458 @@ class TestDatasetUtils(unittest.TestCase):
         self.assertTrue(np.all(restored_cube == self.cube))
 
 
+def gather_subdomains(rank, path, init_file, result):
+    # a process of the multi-process gather test
+    dist.init_process_group('gloo', init_method='file://'+init_file, rank=rank, world_size=2)
+    decomposition = DomainDecomposition(ndomains=2, rank=rank, halo=2)
+    dataset = HDF5Dataset(path=path, features=['u'], checkpoints=[0],
+                          input_size=(16,16,16), decomposition=decomposition)
+    full = decomposition.gather(dataset.load_numpy(), (16,16,16))
+    if rank == 0: np.save(result, full)
+    dist.destroy_process_group()
+
+
+class TestHDF5Dataset(unittest.TestCase):
+    """ HDF5Dataset loading test. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.resources_path, "{feature}_t{checkpoint:.0f}.h5")
+        for checkpoint in [0, 1]:
+            for feature, nch in [('u', 3), ('tn', 1)]:
+                with h5.File(self.path.format(feature=feature, checkpoint=checkpoint), 'w') as f:
+                    f.create_dataset(feature, data=np.random.random((nch, 16, 16, 16)))
+
+    def test_float32_read(self):
+        """ Data is read straight into float32 and shared with torch tensors. """
+        dataset = HDF5Dataset(path=self.path, features=['u'], target=['tn'],
+                              checkpoints=[0, 1], input_size=(16,16,16))
+        x, y = dataset.load_numpy()
+        self.assertEqual(x.dtype, np.float32)
+        self.assertEqual(x.shape, (2, 3, 16, 16, 16))
+        self.assertEqual(y.shape, (2, 1, 16, 16, 16))
+        
+        loaders = torch_splitter([x, y])
+        self.assertTrue(np.shares_memory(loaders['train'].dataset.tensors[0].numpy(), x))
+
+    def test_split_without_copies(self):
+        """ Train and valid are deterministic index subsets of the same tensors. """
+        x = np.random.random((10, 3, 8, 8, 8)).astype(np.float32)
+        y = np.random.random((10, 1)).astype(np.float32)
+        loaders = torch_splitter([x, y], train_fraction=0.8, shuffle=True, seed=1)
+        train, valid = loaders['train'].dataset, loaders['valid'].dataset
+        
+        self.assertIs(train.dataset, valid.dataset)
+        self.assertTrue(np.shares_memory(train.dataset.tensors[0].numpy(), x))
+        self.assertEqual((len(train), len(valid)), (8, 2))
+        self.assertEqual(sorted(train.indices + valid.indices), list(range(10)))
+        
+        loaders = torch_splitter([x, y], train_fraction=0.8, shuffle=True, seed=1)
+        self.assertEqual(train.indices, loaders['train'].dataset.indices)
+
+    def test_split_fraction_and_count(self):
+        """ A float train_fraction is a fraction, an int is the number of train samples. """
+        x = np.random.random((8, 3, 4, 4, 4)).astype(np.float32)
+        y = np.random.random((8, 1)).astype(np.float32)
+        
+        loaders = torch_splitter([x, y], train_fraction=0.75)
+        self.assertEqual(loaders['train'].dataset.indices, list(range(6)))
+        self.assertEqual(loaders['valid'].dataset.indices, [6, 7])
+        
+        loaders = torch_splitter([x, y], train_fraction=1)
+        self.assertEqual((len(loaders['train'].dataset), len(loaders['valid'].dataset)), (1, 7))
+
+    def test_file_dtype_read(self):
+        """ dtype=None keeps the dtype stored in the file. """
+        dataset = HDF5Dataset(path=self.path, features=['u'], target=['tn'],
+                              checkpoints=[0], input_size=(16,16,16), dtype=None)
+        x, y = dataset.load_numpy()
+        self.assertEqual(x.dtype, np.float64)
+        
+        # flat data for sklearn models keeps the file dtype by default
+        dataset = HDF5Dataset(path=self.path, features=['u'], target=['tn'],
+                              checkpoints=[0], input_size=(16,16,16), flat=True)
+        x, y = dataset.load_numpy()
+        self.assertEqual(x.dtype, np.float64)
+
+    def test_roi(self):
+        """ A region of interest, in cell indices or physical units, is read as a hyperslab. """
+        with h5.File(self.path.format(feature='u', checkpoint=0), 'r') as f:
+            u = f['u'][()]
+        dataset = HDF5Dataset(path=self.path, features=['u'], input_size=(16,16,16), dtype=None,
+                              roi=[(4, 12), None, (0, 8)])
+        np.testing.assert_array_equal(dataset.load_numpy()[0], u[:, 4:12, :, :8])
+
+        # physical bounds, and a sampler that reads every 2nd point of the region
+        dataset = HDF5Dataset(path=self.path, features=['u'], input_size=(16,16,16), dtype=None,
+                              roi=[(0.5, 1.5), None, (0, 1)], domain=[(0, 2)]*3,
+                              sampler=EquidistantSampling((4, 8, 4)))
+        self.assertEqual(dataset.get_parameters()['data - roi'], [(4, 12), (0, 16), (0, 8)])
+        np.testing.assert_array_equal(dataset.load_numpy()[0], u[:, 4:12:2, ::2, :8:2])
+
+        with self.assertRaises(ValueError):
+            HDF5Dataset(path=self.path, features=['u'], input_size=(16,16,16), roi=[(4, 20), None, None])
+
+    def test_domain_decomposition(self):
+        """ Subdomains with periodic halos reassemble into the full domain. """
+        with h5.File(self.path.format(feature='u', checkpoint=0), 'r') as f:
+            full = f['u'][()].astype(np.float32)
+        
+        for mode, ndomains in [('slab', 3), ('pencil', 4)]:
+            pieces = []
+            for rank in range(ndomains):
+                decomposition = DomainDecomposition(ndomains=ndomains, rank=rank, halo=2, mode=mode)
+                dataset = HDF5Dataset(path=self.path, features=['u'], checkpoints=[0],
+                                      input_size=(16,16,16), decomposition=decomposition)
+                x = dataset.load_numpy()[0]
+                
+                region = decomposition.halo_region((16,16,16))
+                index = [np.arange(start, stop)%16 for start, stop in region]
+                self.assertTrue(np.array_equal(x, full[np.ix_(range(3), *index)]))
+                pieces.append(decomposition.crop(x, (16,16,16)))
+                
+            self.assertTrue(np.array_equal(decomposition.combine(pieces, (16,16,16)), full))
+
+    def test_domain_decomposition_gather(self):
+        """ Subdomains read by separate processes are gathered on rank 0. """
+        result = os.path.join(self.resources_path, 'gathered.npy')
+        mp.spawn(gather_subdomains, nprocs=2,
+                 args=(self.path, os.path.join(self.resources_path, 'init'), result))
+        
+        with h5.File(self.path.format(feature='u', checkpoint=0), 'r') as f:
+            full = f['u'][()].astype(np.float32)
+        self.assertTrue(np.array_equal(np.load(result)[0], full))
+        
+    def test_domain_decomposition_checks(self):
+        """ The whole subdomain is a single batch and can't be sampled. """
+        decomposition = DomainDecomposition(ndomains=2, rank=0, halo=2)
+        for kwargs in [dict(batch_num=8), dict(batch_size=(8,8,8))]:
+            with self.assertRaises(ValueError):
+                HDF5Dataset(path=self.path, features=['u'], input_size=(16,16,16), 
+                            decomposition=decomposition, **kwargs)
+        with self.assertRaises(ValueError):
+            DomainDecomposition(ndomains=32, rank=0).region((16,16,16))
+        with self.assertRaises(RuntimeError):
+            decomposition.gather(np.zeros((1,3,12,16,16)), (16,16,16))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class TestSampling(unittest.TestCase):
+    """ Samplers downsample anisotropically, and read HDF5 the same as in memory. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.resources_path, "{feature}.h5")
+        self.data = np.random.default_rng(0).random((3, 16, 16, 8))
+        with h5.File(self.path.format(feature='u'), 'w') as f:
+            f.create_dataset('u', data=self.data, chunks=(1, 4, 16, 8))
+
+    def test_samplers(self):
+        np.testing.assert_array_equal(EquidistantSampling((4,8,4)).sample(self.data), self.data[:, ::4, ::2, ::2])
+        np.testing.assert_allclose(BlockMeanSampling((8,8,4)).sample(self.data)[:, 0, 0, 0],
+                                   self.data[:, :2, :2, :2].mean(axis=(1,2,3)))
+
+        #a resolved field is sampled exactly by the spectral truncation
+        x = np.arange(16)*2*np.pi/16
+        field = np.sin(x)[:, None, None] * np.cos(2*x)[None, :, None] * np.ones(8)
+        np.testing.assert_allclose(SpectralSampling((8,8,4)).sample(field), field[::2, ::2, ::2], atol=1e-12)
+
+        self.assertEqual(GaussianSampling((8,4,4)).sample(self.data).shape, (3, 8, 4, 4))
+        with self.assertRaises(ValueError): BlockMeanSampling((5,8,4)).sample(self.data)
+
+    def test_hdf5_read(self):
+        """ Slabs of the file with halos give the same result as the whole array. """
+        with h5.File(self.path.format(feature='u'), 'r') as f:
+            for sampler in [EquidistantSampling((4,8,4)), BlockMeanSampling((8,4,4)),
+                            SpectralSampling((8,8,4)), GaussianSampling((8,4,4)),
+                            GaussianSampling((8,4,4), sigma=1.5, mode='reflect')]:
+                sampler.max_read = 3*2*16*8*8
+                np.testing.assert_allclose(sampler.read(f['u']), sampler.sample(self.data), err_msg=str(sampler))
+
+        loader = HDF5Dataset(path=self.path, features=['u'], target=['u'], input_size=(16,16,8),
+                             sampler=BlockMeanSampling((8,8,4)))
+        x, y = loader.load_numpy()
+        self.assertEqual(x.shape, (1, 3, 8, 8, 4))
+        np.testing.assert_allclose(x[0], BlockMeanSampling((8,8,4)).sample(self.data), rtol=1e-6)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class TestAthenaRead(unittest.TestCase):
+    """ Vectorized athdf block assembly matches the block-by-block one. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.resources_path, "mesh.athdf")
+        write_athdf(self.path)
+
+    def test_prolongation_and_selection(self):
+        for selection in [{}, dict(x1_min=0.1, x1_max=0.7, x3_min=0.3)]:
+            data = athdf(self.path, return_levels=True, **selection)
+            blockwise = athdf(self.path, return_levels=True, vectorized=False, **selection)
+            for q in ['rho', 'vel2', 'Levels']:
+                np.testing.assert_array_equal(data[q], blockwise[q])
+        self.assertEqual(data['rho'].shape, (12, 16, 11))
+
+    def test_restriction(self):
+        fine = athdf(self.path)['rho']
+        coarse = fine.reshape(8, 2, 8, 2, 8, 2).mean(axis=(1, 3, 5))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            np.testing.assert_allclose(athdf(self.path, level=0, fast_restrict=True)['rho'], coarse, rtol=1e-6)
+            np.testing.assert_allclose(athdf(self.path, level=0)['rho'], coarse, rtol=1e-6)
+        np.testing.assert_array_equal(athdf(self.path, level=0, subsample=True)['rho'], fine[::2, ::2, ::2])
+
+    def test_dataset(self):
+        """ ATHDFDataset reads the features and the target of a checkpoint in one pass. """
+        path = os.path.join(self.resources_path, "out.{checkpoint:05.0f}.athdf")
+        for checkpoint in [0, 1]: write_athdf(path.format(checkpoint=checkpoint), seed=checkpoint)
+
+        dataset = ATHDFDataset(path=path, features=['vel1', 'vel2', 'vel3'], target=['rho'],
+                               checkpoints=[0, 1], batch_size=(8, 8, 8), x1_max=0.5)
+        self.assertEqual(dataset.input_size, (16, 16, 8))
+        x, y = dataset.load_numpy()
+        self.assertEqual(x.shape, (8, 3, 8, 8, 8))
+        self.assertEqual(y.dtype, np.float32)
+        np.testing.assert_array_equal(y[4, 0], athdf(path.format(checkpoint=1), x1_max=0.5)['rho'][:8, :8])
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class TestPatchDataset(unittest.TestCase):
+    """ Random patches are read from HDF5 chunks through an LRU cache. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.resources_path, "{feature}.h5")
+        rng = np.random.default_rng(0)
+        self.data = {'u': rng.random((3, 32, 32, 16)), 'tn': rng.random((1, 32, 32, 16))}
+        for feature, data in self.data.items():
+            with h5.File(self.path.format(feature=feature), 'w') as f:
+                f.create_dataset(feature, data=data, chunks=(3 if feature=='u' else 1, 8, 8, 8), compression='gzip')
+
+    def test_patches(self):
+        dataset = HDF5Dataset(path=self.path, features=['u'], target=['tn'], input_size=(32,32,16))
+        patches = HDF5PatchDataset(dataset, patch_size=(8,8,8), npatches=64, seed=1, cache_size=8*1024**2)
+        self.assertEqual(patches.tile, (8,8,8))
+        snaps, origins = patches.positions(0)
+        for i in [0, 17, 63]:
+            x, y = patches[i]
+            a, b, c = origins[i]
+            np.testing.assert_allclose(x.numpy(), self.data['u'][:, a:a+8, b:b+8, c:c+8], rtol=1e-6)
+            np.testing.assert_allclose(y.numpy(), self.data['tn'][:, a:a+8, b:b+8, c:c+8], rtol=1e-6)
+        for i in range(64): patches[i]
+        self.assertGreater(patches.cache.hit_rate, 0.5)
+        self.assertLessEqual(patches.cache.nbytes, 8*1024**2)
+
+        # the same seed draws the same patches, every epoch draws new ones
+        same = HDF5PatchDataset(dataset, patch_size=(8,8,8), npatches=64, seed=1)
+        np.testing.assert_array_equal(same.positions(0)[1], origins)
+        self.assertFalse(np.array_equal(same.positions(1)[1], origins))
+
+        aligned = HDF5PatchDataset(dataset, patch_size=(8,8,8), npatches=16, seed=1, align=True)
+        self.assertTrue((aligned.positions(0)[1] % 8 == 0).all())
+
+        loader = patches.loader(batch_num=16, num_workers=0)
+        first = torch.cat([x for x, y in loader])
+        second = torch.cat([x for x, y in loader])
+        self.assertEqual(first.shape, (64, 3, 8, 8, 8))
+        self.assertFalse(torch.equal(first, second))
+
+    def test_augmentation(self):
+        """ Flips and rotations keep u = grad(phi) and T = grad(grad(phi)) consistent. """
+        phi = np.random.default_rng(0).random((2, 16, 16, 16))
+        u = np.stack([np.stack(np.gradient(p)) for p in phi])
+        tensor = np.stack([np.concatenate([np.stack(np.gradient(c)) for c in v]) for v in u])
+        x = np.concatenate([phi[:, None], u], axis=1)
+
+        for flip, rotate in [(True, False), (False, True), (True, True)]:
+            patches = ArrayPatchDataset(x, tensor, patch_size=(8,8,8), npatches=8, seed=2,
+                                        flip=flip, rotate=rotate, vectors=[[(1,2,3)], [range(9)]])
+            for i in range(8):
+                x_patch, y_patch = [a.numpy().astype(np.float64) for a in patches[i]]
+                inner = (slice(1, -1),)*3
+                gradient = np.stack(np.gradient(x_patch[0]))
+                np.testing.assert_allclose(x_patch[1:][(slice(None),)+inner], gradient[(slice(None),)+inner], atol=1e-5)
+                hessian = np.concatenate([np.stack(np.gradient(c)) for c in x_patch[1:]])
+                inner = (slice(2, -2),)*3
+                np.testing.assert_allclose(y_patch[(slice(None),)+inner], hessian[(slice(None),)+inner], atol=1e-5)
+            np.testing.assert_array_equal(patches[3][0], patches[3][0])
+
+        self.assertEqual(len(ArrayPatchDataset(x, patch_size=(8,8,8))), 16)
+        with self.assertRaises(ValueError): ArrayPatchDataset(x, patch_size=(8,8,4), rotate=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class TestFilterPyramid(unittest.TestCase):
+    """ All the levels are written into one file and read with HDF5Dataset(level=...). """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.resources_path, "t{checkpoint:1.0f}", "{feature}.h5")
+        self.output_path = os.path.join(self.resources_path, "t{checkpoint:1.0f}", "pyramid.h5")
+        SyntheticTurbulence(32, seed = 0).write(self.input_path, checkpoints = [0, 1], features = ['u'])
+
+    def test_gaussian(self):
+        from sapsan.utils.filters import gaussian
+        pyramid = FilterPyramid(filt = 'gaussian', filt_sizes = [2, 1, 4], factors = [2, 1, 4])
+        paths = pyramid.build(self.input_path, self.output_path, features = ['u'], checkpoints = [0, 1])
+        self.assertEqual(len(paths), 2)
+
+        with h5.File(self.input_path.format(checkpoint=1, feature='u'), 'r') as f: u = f['u'][()]
+        with h5.File(paths[1], 'r') as f:
+            self.assertEqual(f['level_2'].attrs['filt_size'], 4)
+            expected = np.stack([gaussian(c, 4) for c in u])[:, ::4, ::4, ::4]
+            np.testing.assert_allclose(f['level_2/u'][()], expected, atol=1e-3*np.abs(u).max())
+
+        loader = HDF5Dataset(path = self.output_path, features = ['u'], checkpoints = [0, 1],
+                             input_size = (16, 16, 16), level = 0)
+        x = loader.load_numpy()
+        self.assertEqual(x.shape, (2, 3, 16, 16, 16))
+        np.testing.assert_allclose(x[1], np.stack([gaussian(c, 2) for c in u])[:, ::2, ::2, ::2],
+                                   atol=1e-3*np.abs(u).max())
+
+    def test_spectral(self):
+        field = np.random.default_rng(0).random((16, 16))
+        low, full = FilterPyramid(filt = 'spectral', filt_sizes = [3, 0], axis = 2).apply(field)
+        np.testing.assert_array_equal(full, field)
+        modes = np.fft.fftn(low)
+        k = np.fft.fftfreq(16, 1/16)
+        np.testing.assert_allclose(modes[np.add.outer(k**2, k**2) > 9], 0, atol=1e-10)
+        np.testing.assert_allclose(modes[0, 0], np.fft.fftn(field)[0, 0])
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class TestPreprocessor(unittest.TestCase):
+    """ Slab-wise preprocessing matches the whole-field computation. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.resources_path, "raw", "t{checkpoint:1.0f}", "{feature}.h5")
+        self.output_path = os.path.join(self.resources_path, "t{checkpoint:1.0f}", "{feature}_filtered.h5")
+        SyntheticTurbulence(32, seed = 0).write(self.input_path, checkpoints = [0, 1], features = ['u'])
+        with h5.File(self.input_path.format(checkpoint=1, feature='u'), 'r') as f: self.u = f['u'][()].astype(np.float64)
+
+    def test_reflect(self):
+        from sapsan.utils.physics import tensor
+        from sapsan.utils.filters import gaussian
+        preprocessor = Preprocessor(features = ['u'], filt_size = 1, nproc = 2, slab_size = 8, chunk_size = 8,
+                                    dtype = np.float64)
+        self.assertEqual(len(preprocessor.slabs((3, 32, 32, 32))), 4)
+        paths = preprocessor.build(self.input_path, self.output_path, checkpoints = [0, 1])
+        self.assertEqual(len(paths), 6)
+
+        filtered = np.stack([gaussian(c, 1) for c in self.u])
+        with h5.File(self.output_path.format(checkpoint=1, feature='tn'), 'r') as f:
+            self.assertEqual(f['tn'].chunks, (3, 3, 8, 8, 8))
+            np.testing.assert_allclose(f['tn'][()], tensor(self.u, filt = gaussian, filt_size = 1), atol=1e-12)
+        with h5.File(self.output_path.format(checkpoint=1, feature='grad_u'), 'r') as f:
+            np.testing.assert_allclose(f['grad_u'][()], np.stack([np.stack(np.gradient(c)) for c in filtered]),
+                                       atol=1e-12)
+
+        loader = HDF5Dataset(path = self.output_path, features = ['u'], target = ['tn'], checkpoints = [0, 1],
+                             input_size = (32, 32, 32), dtype = None)
+        x, y = loader.load_numpy()
+        self.assertEqual(y.shape, (2, 9, 32, 32, 32))
+        np.testing.assert_allclose(x[1], filtered, atol=1e-12)
+
+    def test_periodic_downsampled(self):
+        from scipy import ndimage
+        preprocessor = Preprocessor(features = ['u'], filt_size = 2, gradients = False, tensor = None,
+                                    periodic = True, factor = 2, slab_size = 8, chunk_size = 4)
+        preprocessor.build(self.input_path, self.output_path, checkpoints = [1])
+        expected = ndimage.gaussian_filter(self.u, (0, 2, 2, 2), mode='wrap')[:, ::2, ::2, ::2]
+        with h5.File(self.output_path.format(checkpoint=1, feature='u'), 'r') as f:
+            self.assertEqual(list(f.keys()), ['u'])
+            np.testing.assert_allclose(f['u'][()], expected, atol=1e-6*np.abs(self.u).max())
+
+    def test_command(self):
+        from click.testing import CliRunner
+        from sapsan.core.cli.cli import sapsan
+        result = CliRunner().invoke(sapsan, ['preprocess', self.input_path, self.output_path, '--checkpoints', '0',
+                                             '--filt-size', '1', '--no-gradients', '--only-x-components'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with h5.File(self.output_path.format(checkpoint=0, feature='tn'), 'r') as f:
+            self.assertEqual(f['tn'].shape, (3, 32, 32, 32))
+        self.assertFalse(os.path.exists(self.output_path.format(checkpoint=0, feature='grad_u')))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class LazyDataset(Dataset):
+    def __len__(self): return 8
+    def __getitem__(self, index): return torch.full((2,), float(index))
+
+
+class TestSyntheticTurbulence(unittest.TestCase):
+    """ Generated fields are divergence-free and load with HDF5Dataset. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+
+    def test_divergence_free(self):
+        for ndim, size in [(3, 32), (2, (64, 48))]:
+            generator = SyntheticTurbulence(size, ndim = ndim, seed = 0)
+            u = generator.velocity()
+            self.assertEqual(u.shape, (ndim,)+generator.shape)
+            self.assertAlmostEqual(float(u.std()), 1, places=4)
+
+            modes = [np.fft.rfftn(component) for component in u]
+            divergence = sum(k*mode for k, mode in zip(generator.wavenumbers(), modes))
+            self.assertLess(np.abs(divergence).max(), 1e-4*max(np.abs(mode).max() for mode in modes))
+
+        np.testing.assert_array_equal(SyntheticTurbulence(16, seed = 3).velocity(1), 
+                                      SyntheticTurbulence(16, seed = 3).velocity(1))
+
+    def test_write_and_load(self):
+        path = os.path.join(self.resources_path, 't{checkpoint:1.0f}', '{feature}.h5')
+        paths = SyntheticTurbulence(16, seed = 0).write(path, checkpoints = [0, 1], features = ['u', 'tn'])
+        self.assertEqual(len(paths), 4)
+
+        loader = HDF5Dataset(path = path, features = ['u'], target = ['tn'],
+                             checkpoints = [0, 1], input_size = [16,16,16])
+        x, y = loader.load_numpy()
+        self.assertEqual(x.shape, (2, 3, 16, 16, 16))
+        self.assertEqual(y.shape, (2, 9, 16, 16, 16))
+        #correlated, but not the same snapshots
+        self.assertFalse(np.array_equal(x[0], x[1]))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
+
+
+class TestMakeLoader(unittest.TestCase):
+    """ DataLoader defaults depend on where the data lives. """
+    
+    def setUp(self) -> None:
+        self.dataset = TensorDataset(torch.arange(8.))
+    
+    def test_in_memory_defaults(self):
+        for dataset in [self.dataset, Subset(self.dataset, [0, 1, 2])]:
+            loader = make_loader(dataset, prefetch_factor=4, persistent_workers=True)
+            self.assertEqual(loader.num_workers, 0)
+            self.assertFalse(loader.persistent_workers)
+            self.assertIsNone(loader.prefetch_factor)
+            
+    def test_lazy_defaults(self):
+        loader = make_loader(LazyDataset(), prefetch_factor=4)
+        self.assertEqual(loader.num_workers, min(4, os.cpu_count() or 1))
+        self.assertTrue(loader.persistent_workers)
+        self.assertEqual(loader.prefetch_factor, 4)
+        
+        loader = make_loader(LazyDataset(), num_workers=0)
+        self.assertFalse(loader.persistent_workers)
+        
+    def test_batch_sampler(self):
+        loader = make_loader(self.dataset, batch_num=1, 
+                             batch_sampler=lambda dataset: BatchSampler(SequentialSampler(dataset), 3, False))
+        self.assertEqual([len(batch[0]) for batch in loader], [3, 3, 2])
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import torch
+from torch.utils.data import TensorDataset
+from click.testing import CliRunner
+
+from sapsan.lib.data import make_loader, distributed_loaders
+from sapsan.utils import distributed
+from sapsan.core.cli.cli import sapsan
+
+
+class TestRankHelpers(unittest.TestCase):
+    """ Rank and world size are read from the launcher's environment. """
+
+    def test_single_process(self):
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertEqual(distributed.get_rank(), 0)
+            self.assertEqual(distributed.get_world_size(), 1)
+            self.assertFalse(distributed.is_launched())
+            self.assertTrue(distributed.is_main_process())
+            with self.assertRaises(RuntimeError):
+                distributed.init_process_group()
+
+    def test_launched_process(self):
+        env = {'RANK': '3', 'LOCAL_RANK': '1', 'WORLD_SIZE': '4', 'LOCAL_WORLD_SIZE': '2'}
+        with mock.patch.dict(os.environ, env, clear=True):
+            self.assertEqual(distributed.get_rank(), 3)
+            self.assertEqual(distributed.get_local_rank(), 1)
+            self.assertEqual(distributed.get_world_size(), 4)
+            self.assertEqual(distributed.get_local_world_size(), 2)
+            self.assertTrue(distributed.is_launched())
+            self.assertFalse(distributed.is_main_process())
+
+
+class TestDistributedLoaders(unittest.TestCase):
+    """ Loaders are sharded between DDP processes. """
+
+    def setUp(self) -> None:
+        self.dataset = TensorDataset(torch.arange(9.))
+
+    def shards(self, loader, world_size = 3, **kwargs):
+        return [distributed_loaders({'train': loader}, rank, world_size, **kwargs)['train']
+                for rank in range(world_size)]
+
+    def test_disjoint_shards(self):
+        shards = self.shards(make_loader(self.dataset, batch_num=2))
+        indices = [list(shard.sampler) for shard in shards]
+
+        #9 samples split evenly between 3 processes, so there is no padding
+        self.assertEqual(sorted(sum(indices, [])), list(range(9)))
+        for shard in shards:
+            self.assertEqual(shard.batch_size, 2)
+            self.assertFalse(shard.sampler.shuffle)
+
+    def test_shuffle_and_seed(self):
+        generator = torch.Generator().manual_seed(7)
+        shards = self.shards(make_loader(self.dataset, shuffle=True, generator=generator))
+        for shard in shards:
+            self.assertTrue(shard.sampler.shuffle)
+            self.assertEqual(shard.sampler.seed, 7)
+
+        shards = self.shards(make_loader(self.dataset, shuffle=True), seed=3)
+        self.assertEqual(shards[0].sampler.seed, 3)
+
+    def test_sharded_loader_untouched(self):
+        loader = make_loader(self.dataset, sharded=True)
+        self.assertIs(distributed_loaders({'train': loader}, 1, 2)['train'], loader)
+
+
+class TestTrainCommand(unittest.TestCase):
+    """ 'sapsan train' launches the script in N processes. """
+
+    def setUp(self) -> None:
+        self.resources_path = tempfile.mkdtemp()
+
+    def test_train_nproc(self):
+        script = os.path.join(self.resources_path, 'script.py')
+        with open(script, 'w') as file:
+            file.write("import os, sys\n"
+                       "open(os.path.join(sys.argv[1], 'rank%s_of_%s'%(os.environ['RANK'], "
+                       "os.environ['WORLD_SIZE'])), 'w').close()\n")
+
+        result = CliRunner().invoke(sapsan, ['train', '--nproc', '2', script, self.resources_path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(sorted(name for name in os.listdir(self.resources_path) if 'rank' in name),
+                         ['rank0_of_2', 'rank1_of_2'])
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.resources_path)
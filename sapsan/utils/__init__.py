@@ -1 +1,8 @@
-from .physics import PowerSpectrum, GradientModel, DynamicSmagorinskyModel, picae_func
+from sapsan._lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'PowerSpectrum': '.physics',
+    'GradientModel': '.physics',
+    'DynamicSmagorinskyModel': '.physics',
+    'picae_func': '.physics',
+})
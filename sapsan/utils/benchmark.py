@@ -0,0 +1,271 @@
+'''
+Benchmarks of the Sapsan hot paths on synthetic fields,
+with results saved as JSON and compared against a baseline
+to catch performance regressions. Run with
+
+    sapsan benchmark --sizes 32,64,128 --output results.json
+    sapsan benchmark --baseline results.json    #fails on regressions
+
+or from python:
+
+    results = run_benchmarks(sizes = [32, 64])
+    save_results(results, 'results.json')
+    regressions = compare(results, load_results('baseline.json'), threshold = 0.2)
+
+Every case is timed 'repeat' times after 'warmup' untimed runs;
+the median is compared, since it is the least sensitive to noise.
+The import_* cases time the imports in a fresh interpreter, to guard
+the lazy loading of the heavy dependencies.
+'''
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import tempfile
+import platform
+import contextlib
+import numpy as np
+
+#size of the cubes the fields are split into for the torch models
+CUBE = 16
+
+BENCHMARKS = {}
+
+def benchmark(name: str, max_size: int = None, sized: bool = True):
+    """
+    Registers a benchmark case: a function that takes the size of the
+    synthetic field and a temporary directory, prepares the inputs, and
+    returns the function to time
+    @param max_size: sizes above it are skipped (for the cases that scale badly)
+    @param sized: False for the cases that don't depend on the size, 
+                  they run once and get size None
+    """
+    def register(setup):
+        BENCHMARKS[name] = dict(setup = setup, max_size = max_size, sized = sized)
+        return setup
+    return register
+
+
+def synthetic_field(size: int, nchannels: int = 3, seed: int = 0):
+    #divergence-free turbulent velocity of shape (channels, size, size, size)
+    from sapsan.lib.data import SyntheticTurbulence
+    return SyntheticTurbulence(size, seed = seed).velocity()[:nchannels]
+
+
+def to_cubes(field):
+    from sapsan.utils.shapes import split_cube_by_batch
+    return split_cube_by_batch(field, field.shape[1:], (CUBE,)*3, field.shape[0])
+
+
+@benchmark('hdf5_load_numpy')
+def hdf5_load_numpy(size, tmpdir):
+    from sapsan.lib.data import HDF5Dataset, SyntheticTurbulence
+
+    #the target is a second velocity field, the stress tensor is too slow to compute at large sizes
+    for feature, seed in [('u', 0), ('tn', 1)]:
+        SyntheticTurbulence(size, seed = seed).write(os.path.join(tmpdir, '%s.h5'%feature), features = ['u'])
+
+    loader = HDF5Dataset(path = os.path.join(tmpdir, '{feature}.h5'),
+                         features = ['u'], target = ['tn'],
+                         input_size = (size,)*3, batch_size = (CUBE,)*3)
+    return loader.load_numpy
+
+
+@benchmark('split_cube_by_batch')
+def split_cube(size, tmpdir):
+    field = synthetic_field(size)
+    return lambda: to_cubes(field)
+
+
+@benchmark('combine_cubes')
+def combine(size, tmpdir):
+    from sapsan.utils.shapes import combine_cubes
+    cubes = to_cubes(synthetic_field(size))
+    return lambda: combine_cubes(cubes, (size,)*3, (CUBE,)*3)
+
+
+@benchmark('torch_splitter')
+def splitter(size, tmpdir):
+    from sapsan.lib.data import torch_splitter
+    x = to_cubes(synthetic_field(size))
+    y = to_cubes(synthetic_field(size, seed=1))
+    return lambda: torch_splitter([x, y], batch_num = 4)
+
+
+def torch_estimator(name, size):
+    import torch
+    from sapsan.lib.data import torch_splitter
+    from sapsan.lib.estimator import CNN3d, CNN3dConfig, PICAE, PICAEConfig
+
+    #all the cubes of the field in a single batch
+    x = to_cubes(synthetic_field(size))
+    if name == 'cnn3d':
+        y = np.random.default_rng(1).standard_normal((len(x), 1)).astype(np.float32)
+        estimator = CNN3d(config = CNN3dConfig(), loaders = torch_splitter([x, y], batch_num = len(x)))
+    else:
+        y = to_cubes(synthetic_field(size, seed=1))
+        estimator = PICAE(config = PICAEConfig(), loaders = torch_splitter([x, y], batch_num = len(x)))
+    return estimator, torch.as_tensor(x), torch.as_tensor(y)
+
+
+def train_step(name, size):
+    #a single forward + backward + optimizer step over the whole field
+    estimator, x, y = torch_estimator(name, size)
+    model, optimizer, loss_func = estimator.model, estimator.optimizer, estimator.loss_func
+    model.train()
+
+    def step():
+        optimizer.zero_grad()
+        loss = loss_func(model(x), y)
+        loss.backward()
+        optimizer.step()
+    return step
+
+
+def predict(name, size):
+    import torch
+    estimator, x, y = torch_estimator(name, size)
+    x = x.numpy()
+
+    def run():
+        with torch.no_grad(): estimator.predict(x, estimator.config)
+    return run
+
+
+benchmark('cnn3d_train_step')(lambda size, tmpdir: train_step('cnn3d', size))
+benchmark('cnn3d_predict')(lambda size, tmpdir: predict('cnn3d', size))
+benchmark('picae_train_step')(lambda size, tmpdir: train_step('picae', size))
+benchmark('picae_predict')(lambda size, tmpdir: predict('picae', size))
+
+
+@benchmark('power_spectrum', max_size = 128)
+def power_spectrum(size, tmpdir):
+    from sapsan.utils.physics import PowerSpectrum
+    spectrum = PowerSpectrum(synthetic_field(size))
+    return spectrum.calculate
+
+
+@benchmark('dynamic_smagorinsky', max_size = 32)
+def dynamic_smagorinsky(size, tmpdir):
+    from sapsan.utils.physics import DynamicSmagorinskyModel
+    u = synthetic_field(size)
+    du = np.stack([np.gradient(u[i]) for i in range(3)])
+    return DynamicSmagorinskyModel(u, du = du).model
+
+
+@benchmark('cdf_plot')
+def cdf(size, tmpdir):
+    import matplotlib.pyplot as plt
+    from sapsan.utils.plot import cdf_plot
+    series = [synthetic_field(size, 1)[0], synthetic_field(size, 1, seed=1)[0]]
+
+    def run():
+        cdf_plot(series)
+        plt.close('all')
+    return run
+
+
+def import_time(statement):
+    #a fresh interpreter every time, since imports are cached
+    import subprocess
+    return lambda: subprocess.run([sys.executable, '-c', statement], check=True)
+
+
+benchmark('import_sapsan', sized = False)(lambda size, tmpdir: import_time('import sapsan'))
+benchmark('import_sapsan_cli', sized = False)(lambda size, tmpdir: import_time('import sapsan.core.cli.cli'))
+benchmark('import_hdf5_dataset', sized = False)(lambda size, tmpdir: import_time('from sapsan.lib.data import HDF5Dataset'))
+
+
+def time_function(func, repeat: int = 5, warmup: int = 1):
+    #wall-clock times of 'repeat' calls, in sec; the output of the calls is discarded
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(warmup): func()
+        for i in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def machine_info():
+    import torch
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads()}
+
+
+def run_benchmarks(sizes = (32, 64),
+                   cases = None,
+                   repeat: int = 5,
+                   warmup: int = 1,
+                   verbose: bool = True):
+    """
+    Runs the benchmarks and returns the results as a dict:
+        {'machine': {...}, 'timestamp': ...,
+         'results': {'case[size]': {'median', 'mean', 'min', 'max', 'stddev', 'rounds'}}}
+    @param sizes: edge sizes of the synthetic fields, multiples of 16
+    @param cases: names or glob patterns of the cases to run, all by default
+    """
+    names = [name for name in BENCHMARKS
+             if cases == None or any(fnmatch.fnmatch(name, pattern) for pattern in cases)]
+    results = {}
+    for size in sizes:
+        if size % CUBE: raise ValueError("size has to be a multiple of %d, but recieved %d"%(CUBE, size))
+    for name in names:
+        for size in sizes if BENCHMARKS[name]['sized'] else [None]:
+            key = '%s[%d]'%(name, size) if size != None else name
+            max_size = BENCHMARKS[name]['max_size']
+            if max_size != None and size > max_size:
+                if verbose: print('%-32s skipped (size > %d)'%(key, max_size))
+                continue
+
+            tmpdir = tempfile.mkdtemp(prefix='sapsan_benchmark_')
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    func = BENCHMARKS[name]['setup'](size, tmpdir)
+                times = time_function(func, repeat, warmup)
+            finally: shutil.rmtree(tmpdir)
+
+            results[key] = {'median': float(np.median(times)),
+                            'mean': float(np.mean(times)),
+                            'min': float(np.min(times)),
+                            'max': float(np.max(times)),
+                            'stddev': float(np.std(times)),
+                            'rounds': len(times)}
+            if verbose: print('%-32s median %.4e sec (min %.4e, %d rounds)'%(key, results[key]['median'],
+                                                                            results[key]['min'], len(times)))
+    return {'machine': machine_info(), 'timestamp': time.time(), 'results': results}
+
+
+def save_results(results: dict, path: str):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path: str):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2):
+    """
+    Cases that got slower than the baseline by more than 'threshold'
+    (0.2 = 20%), as a list of (case, baseline median, median, ratio);
+    cases missing from either set are ignored
+    """
+    regressions = []
+    for key, result in results['results'].items():
+        if key not in baseline['results']: continue
+        reference = baseline['results'][key]['median']
+        ratio = result['median'] / reference if reference > 0 else float('inf')
+        if ratio > 1 + threshold: regressions.append((key, reference, result['median'], ratio))
+    return regressions
@@ -0,0 +1,50 @@
+'''
+Helpers for multi-process (Distributed Data Parallel) runs.
+
+The rank and world size are taken from the environment variables set
+by torchrun (or by the spawned DDP processes), so they can be queried
+before the process group is initialized and without importing torch.
+'''
+
+import os
+
+
+def get_rank():
+    #global rank of the process, 0 if not a distributed run
+    return int(os.environ.get('RANK', 0))
+
+
+def get_local_rank():
+    #rank of the process on its node
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def get_world_size():
+    #total number of processes, 1 if not a distributed run
+    return int(os.environ.get('WORLD_SIZE', 1))
+
+
+def get_local_world_size():
+    #number of processes on this node
+    return int(os.environ.get('LOCAL_WORLD_SIZE', get_world_size()))
+
+
+def is_launched():
+    #True if the processes were started by an external launcher, e.g. torchrun
+    return 'LOCAL_RANK' in os.environ and 'WORLD_SIZE' in os.environ
+
+
+def is_main_process():
+    #only rank 0 should log, checkpoint, and write files
+    return get_rank() == 0
+
+
+def init_process_group(backend: str = 'gloo'):
+    #joins the process group of a run launched by torchrun, e.g. to gather
+    #the results of all ranks after training; no-op if already initialized
+    import torch.distributed as dist
+    if dist.is_initialized(): return
+    if not is_launched():
+        raise RuntimeError("No processes to group with: launch the script with "
+                           "torchrun or 'sapsan train --nproc N'")
+    dist.init_process_group(backend)
@@ -268,12 +268,8 @@ class picae_func():
 
     def convert_to_torchchannel(data):
         """ converts from  [snaps,dim1,dim2,dim3,nch] ndarray to [snaps,nch,dim1,dim2,dim3] torch tensor"""
-        nsnaps = data.shape[0]
-        dim1, dim2, dim3 = data.shape[1], data.shape[2], data.shape[3] 
-        nch = data.shape[-1] #nch is last dimension in numpy input
-        torch_permuted = np.zeros((nsnaps, nch, dim1, dim2, dim3))
-        for i in range(nch):
-            torch_permuted[:,i,:,:,:] = data[:,:,:,:,i]
+        #single copy that keeps the input dtype (e.g. float32); the tensor shares its memory
+        torch_permuted = np.ascontiguousarray(np.moveaxis(data, -1, 1))
         torch_permuted = torch.from_numpy(torch_permuted)
         return torch_permuted
 
@@ -175,13 +175,12 @@ def log_plot(show_log = True, log_path = 'logs/logs/train.csv'):#log.txt'):
     
     plot_data = {'epoch':[], 'train_loss':[]}
 
-    data = np.genfromtxt(log_path, delimiter=',', 
-                      skip_header=1, dtype=np.float32)
-    
-    if len(data.shape)==1: data = np.array([data])
+    #read columns by the header, since the log can contain extra metrics
+    data = np.atleast_1d(np.genfromtxt(log_path, delimiter=',', 
+                                       names=True, dtype=np.float32))
 
-    plot_data['epoch'] = data[:, 0]
-    plot_data['train_loss'] = data[:, 1]
+    plot_data['epoch'] = data['step']
+    plot_data['train_loss'] = data['loss']
 
     df = pd.DataFrame(plot_data)
 